@@ -0,0 +1,124 @@
+"""Headless batch mode: apply one recipe to every CSV/XLSX export in a directory.
+
+    melimess-batch <indir> <outdir> [--recipe recipe.json|recipe.toml] [--workers N] [--seed N]
+                   [--format xlsx|csv|parquet|arrow]
+
+melimess-batch is the console build of this module (see melimess.spec); from
+source, run `python batch.py ...` or `python main.py batch ...`.
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+from crm import CRMLibrary
+from engine import ProcessingEngine, DUPLICATE_PATTERN
+from recipe import Recipe
+
+def load_recipe(path):
+    return Recipe.load(path) if path else Recipe()
+
+
+def find_inputs(indir):
+    return sorted(
+        os.path.join(indir, name) for name in os.listdir(indir)
+        if name.lower().endswith(('.csv', '.xlsx')) and not name.startswith('~$')
+    )
+
+
+def rows_by_name(engine, names):
+    wanted = {str(name).strip() for name in names}
+    return {i for i, name in enumerate(engine.fixed_column) if str(name).strip() in wanted}
+
+
+def process_file(in_path, out_path, recipe):
+    """Run the full pipeline on one file; returns (in_path, ok, seconds, message)."""
+    start = time.perf_counter()
+    options = recipe.options
+    try:
+        engine = ProcessingEngine(seed=options['seed'])
+        # Same library as the GUI starts with unless the recipe names one
+        library = options['crm_library']
+        engine.set_crm_library(CRMLibrary.load(library) if library else CRMLibrary.default())
+        if options['crm_name']:
+            engine.select_crm(options['crm_name'])
+        engine.load(in_path)
+        engine.apply_recipe(recipe)
+        columns = np.array(engine.element_columns())
+        settings = recipe.vectors([engine.get_element_name(col) for col in columns])
+        if options['duplicate_groups']:
+            groups = [sorted(rows_by_name(engine, names)) for names in options['duplicate_groups']]
+        else:
+            groups = list(engine.find_duplicate_groups(options['duplicate_pattern'] or DUPLICATE_PATTERN).values())
+        if groups:
+            _, out_of_range = engine.check_duplicate_groups(groups, columns, settings['dup_range'])
+            flagged = out_of_range.any(axis=0)
+            engine.fix_duplicate_groups(groups, columns[flagged], settings['min'][flagged], settings['max'][flagged])
+        # Without crm_sample, CRM rows are found by matching sample names against the library
+        if options['crm_sample'] is not None:
+            crm_rows = {row: engine.crm_index for row in rows_by_name(engine, [options['crm_sample']])}
+            if not crm_rows:
+                raise ValueError(f"CRM sample {options['crm_sample']!r} not found")
+        else:
+            crm_rows = engine.find_crm_rows()
+        if crm_rows:
+            engine.compare_crm_rows(crm_rows, columns, settings['crm_range'])
+            engine.fix_crm_cells(columns, settings['crm_range'], out_of_range_only=True)
+        if options['apply_limits']:
+            engine.apply_limits(engine.element_columns())
+        engine.save(out_path)
+        message = f"{out_path} (seed {engine.seed})"
+        if engine.load_errors:
+            message += f" ({len(engine.load_errors)} unparseable cells: {engine.load_error_summary()})"
+        return in_path, True, time.perf_counter() - start, message
+    except Exception as e:
+        return in_path, False, time.perf_counter() - start, str(e)
+
+
+def output_path(in_path, outdir, fmt='xlsx'):
+    stem = os.path.splitext(os.path.basename(in_path))[0]
+    return os.path.join(outdir, f"{stem}.{fmt}")
+
+
+def run_batch(indir, outdir, recipe, workers=None, fmt='xlsx'):
+    inputs = find_inputs(indir)
+    os.makedirs(outdir, exist_ok=True)
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(process_file, path, output_path(path, outdir, fmt), recipe) for path in inputs]
+        for future in as_completed(futures):
+            in_path, ok, seconds, message = future.result()
+            print(f"{'OK  ' if ok else 'FAIL'} {seconds:7.2f}s  {os.path.basename(in_path)}  {message}")
+            results.append((in_path, ok, seconds, message))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='melimess-batch', description="Process a directory of CSV/XLSX exports.")
+    parser.add_argument('indir')
+    parser.add_argument('outdir')
+    parser.add_argument('--recipe', help="JSON or TOML recipe with per-element fill/duplicate/CRM settings")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--seed', type=int, default=None, help="Random seed (overrides the recipe)")
+    parser.add_argument('--format', default='xlsx', choices=['xlsx', 'csv', 'parquet', 'arrow'],
+                        help="Output format (default: xlsx)")
+    args = parser.parse_args(argv)
+
+    recipe = load_recipe(args.recipe)
+    if args.seed is not None:
+        recipe.options['seed'] = args.seed
+    start = time.perf_counter()
+    results = run_batch(args.indir, args.outdir, recipe, args.workers, args.format)
+    failed = sum(1 for _, ok, _, _ in results if not ok)
+    print(f"{len(results)} files, {len(results) - failed} ok, {failed} failed "
+          f"in {time.perf_counter() - start:.2f}s")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    sys.exit(main())
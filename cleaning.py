@@ -0,0 +1,110 @@
+"""Vectorized parsing of censored ICP values such as "<2", "2>" or "> 0.5"."""
+import numpy as np
+import pandas as pd
+
+# Optional qualifier before or after a plain decimal/scientific number
+CENSORED_PATTERN = r'^\s*([<>]?)\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)\s*([<>]?)\s*$'
+
+
+class CleanResult:
+    """Parsed values of a block of cells.
+
+    values:     float64 array, NaN for empty or unparseable cells
+    censored:   bool array, True where the cell carried a < or > qualifier
+    qualifiers: str array, '' or the qualifier with 'x' standing for the number
+                ('<x', 'x>', ...) so the original text can be rebuilt
+    errors:     list of (row, col, text) for tokens that could not be parsed
+    """
+    def __init__(self, values, censored, qualifiers, errors):
+        self.values = values
+        self.censored = censored
+        self.qualifiers = qualifiers
+        self.errors = errors
+
+
+def clean_column(column):
+    """Parse one column; returns (values, censored, qualifiers, error_positions)."""
+    column = pd.Series(column).reset_index(drop=True)
+    values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64, copy=True)
+    censored = np.zeros(len(column), dtype=bool)
+    qualifiers = np.full(len(column), '', dtype='<U2')
+
+    # Only cells that are present but not plain numbers need the regex
+    pending = np.isnan(values) & column.notna().to_numpy()
+    if pending.any():
+        text = column[pending].astype(str)
+        blank = text.str.strip() == ''
+        parts = text[~blank].str.extract(CENSORED_PATTERN)
+        matched = parts[1].notna()
+        idx = parts.index[matched].to_numpy()
+        values[idx] = parts.loc[matched, 1].astype(np.float64).to_numpy()
+        prefix = parts.loc[matched, 0].to_numpy(dtype=str)
+        suffix = parts.loc[matched, 2].to_numpy(dtype=str)
+        is_prefix = prefix != ''
+        is_suffix = suffix != ''
+        censored[idx] = is_prefix | is_suffix
+        qualifiers[idx[is_prefix]] = np.char.add(prefix[is_prefix], 'x')
+        qualifiers[idx[is_suffix]] = np.char.add('x', suffix[is_suffix])
+        errors = parts.index[~matched].to_numpy()
+    else:
+        errors = np.empty(0, dtype=np.int64)
+    return values, censored, qualifiers, errors
+
+
+def clean_frame(frame, columns=None):
+    """Parse the given columns of a DataFrame (default: all) into a CleanResult.
+
+    The result arrays have the frame's full shape; columns that are not cleaned
+    are left as NaN / not censored.
+    """
+    num_rows, num_cols = frame.shape
+    values = np.full((num_rows, num_cols), np.nan)
+    censored = np.zeros((num_rows, num_cols), dtype=bool)
+    qualifiers = np.full((num_rows, num_cols), '', dtype='<U2')
+    errors = []
+    for col in (range(num_cols) if columns is None else columns):
+        column = frame.iloc[:, col]
+        values[:, col], censored[:, col], qualifiers[:, col], bad_rows = clean_column(column)
+        errors.extend((int(row), col, str(column.iloc[row])) for row in bad_rows)
+    return CleanResult(values, censored, qualifiers, errors)
+
+
+def parse_censored(text):
+    """Parse a single typed value; returns (value, qualifier) like clean_column.
+
+    Empty text gives (None, ''). Raises ValueError for anything else that is
+    not a number with an optional qualifier.
+    """
+    values, _, qualifiers, errors = clean_column([text.strip() or None])
+    if len(errors):
+        raise ValueError(f"Not a number: {text!r}")
+    value = values[0]
+    return (None if np.isnan(value) else float(value)), str(qualifiers[0])
+
+
+def format_number(value):
+    if not np.isfinite(value):
+        return str(value)
+    if value == int(value): # عدد صحیح است
+        return str(int(value))
+    return f"{value:.2f}" # اعشار دارد
+
+
+def format_numbers(values):
+    """format_number of every value of a float array, "" for NaN; returns a list."""
+    values = np.asarray(values, dtype=np.float64)
+    texts = np.full(values.shape, "", dtype=object)
+    finite = np.isfinite(values)
+    whole = finite & (np.trunc(values) == values)
+    texts[whole] = [str(int(value)) for value in values[whole].tolist()]
+    texts[finite & ~whole] = [f"{value:.2f}" for value in values[finite & ~whole].tolist()]
+    texts[np.isinf(values)] = [str(value) for value in values[np.isinf(values)].tolist()]
+    return texts.tolist()
+
+
+def restore_text(value, qualifier):
+    """Rebuild the displayed text of a cleaned cell, e.g. (2.0, '<x') -> '<2'."""
+    if np.isnan(value):
+        return ""
+    text = format_number(value)
+    return qualifier.replace('x', text) if qualifier else text
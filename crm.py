@@ -0,0 +1,152 @@
+"""Certified reference material (CRM) values, e.g. the OREAS standards in Book1.xlsx.
+
+A library file has the layout of Book1.xlsx: the first row is "CRM ID" followed
+by element names, every other row is one CRM name followed by its values.
+"""
+import hashlib
+import os
+import re
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+import reader
+from cleaning import clean_frame
+
+# Library the GUI and batch runs start with, looked up by default_library_path
+DEFAULT_LIBRARY = 'Book1.xlsx'
+BUILTIN_CRM = 'OREAS 903'
+# Errors of a library file that can't be read (an .xlsx is a zip archive)
+LIBRARY_ERRORS = (OSError, ValueError, zipfile.BadZipFile)
+# OREAS 903 values by element name, used when no library file is found or loaded
+CRM_903 = {'Ag': 0.348687, 'Al': 5375.47, 'As': 47.4915, 'Au': 0.00495, 'Ba': 62.7756, 'Be': 2.6943,
+           'Bi': 8.75768, 'Ca': 6334.05, 'Cd': 0.208075, 'Ce': 46.2309, 'Co': 130.807, 'Cr': 26.1391,
+           'Cs': 0.281904, 'Cu': 6707.61, 'Fe': 39392.9, 'Ga': 1.57672, 'Ge': 0.0976435,
+           'Hf': 0.609417, 'In': 0.112486, 'K': 3311.2, 'La': 22.8093, 'Lu': 0.0991356,
+           'Mg': 2339.93, 'Mn': 707.684, 'Mo': 4.25585, 'Ni': 48.7209, 'P': 1027.94, 'Pb': 8.95167,
+           'Rb': 12.574, 'S': 5009.09, 'Sb': 0.95799, 'Sc': 3.14983, 'Se': 5.34414, 'Sr': 17.683,
+           'Tb': 0.468421, 'Te': 0.0344281, 'Th': 6.3562, 'Ti': 82.2961, 'Tl': 0.137709,
+           'U': 3.23941, 'V': 13.2897, 'W': 0.531139, 'Y': 9.22846, 'Yb': 0.687174, 'Zn': 21.341,
+           'Zr': 18.1508}
+
+
+def normalize_crm_name(name):
+    """Comparable form of a CRM name: "OREAS 903", "oreas-903" -> "OREAS903"."""
+    return re.sub(r'[^0-9A-Z]', '', str(name).upper())
+
+
+def cache_path(path, cache_dir=None):
+    """Cache file of a library in cache_dir (default: reader.CACHE_DIR), named by its full path."""
+    key = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir or reader.CACHE_DIR, f"crm-{key}.npz")
+
+
+def default_library_path():
+    """DEFAULT_LIBRARY in the working directory or next to the program, or None."""
+    for directory in (os.getcwd(), os.path.dirname(os.path.abspath(__file__))):
+        path = os.path.join(directory, DEFAULT_LIBRARY)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+class CRMLibrary:
+    """Reference values of several CRMs, one row per CRM.
+
+    names:    CRM names in file order
+    elements: element names
+    values:   float64 matrix (CRMs x elements), NaN where a CRM has no value
+    """
+    def __init__(self, names, elements, values):
+        self.names = [str(name) for name in names]
+        self.elements = [str(element) for element in elements]
+        self.values = np.asarray(values, dtype=np.float64)
+        self.source = None
+        self._index = {normalize_crm_name(name): i for i, name in enumerate(self.names)}
+        # Sample labels also use the short form, e.g. "CRM 903" for "OREAS 903"
+        self._labels = dict(self._index)
+        for key, i in self._index.items():
+            code = re.sub(r'^[A-Z]+', '', key)
+            if code and code != key:
+                self._labels.setdefault('CRM' + code, i)
+        self._element_index = {element: i for i, element in enumerate(self.elements)}
+        self._aligned = {}
+
+    @classmethod
+    def builtin(cls):
+        return cls([BUILTIN_CRM], list(CRM_903), [list(CRM_903.values())])
+
+    @classmethod
+    def default(cls):
+        """The library found by default_library_path, or the built-in values."""
+        path = default_library_path()
+        return cls.builtin() if path is None else cls.load(path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a library file, using its .npz cache (see cache_path) while the file is unchanged."""
+        stat = os.stat(path)
+        key = np.array([stat.st_mtime_ns, stat.st_size], dtype=np.int64)
+        cached = cache_path(path)
+        library = None
+        if os.path.exists(cached):
+            try:
+                with np.load(cached, allow_pickle=False) as data:
+                    if np.array_equal(data['key'], key):
+                        library = cls(data['names'], data['elements'], data['values'])
+            except reader.NPZ_ERRORS:
+                library = None
+        if library is None:
+            library = cls.read(path)
+            try:
+                os.makedirs(os.path.dirname(cached), exist_ok=True)
+                reader.write_npz(cached, {'key': key, 'names': np.array(library.names, dtype=str),
+                                          'elements': np.array(library.elements, dtype=str), 'values': library.values})
+            except OSError:
+                pass # پوشه فقط‌خواندنی؛ بدون کش ادامه می‌دهیم
+        library.source = path
+        return library
+
+    @classmethod
+    def read(cls, path):
+        if path.lower().endswith('.csv'):
+            df = pd.read_csv(path, header=None, dtype=object)
+        else:
+            df = pd.read_excel(path, header=None, dtype=object)
+        df = df.dropna(how='all').dropna(axis=1, how='all').reset_index(drop=True)
+        if df.shape[0] < 2 or df.shape[1] < 2:
+            raise ValueError(f"No CRM rows found in {path}")
+        elements = df.iloc[0, 1:].astype(str).str.strip()
+        rows = df.iloc[1:].reset_index(drop=True)
+        rows = rows[rows.iloc[:, 0].notna()].reset_index(drop=True)
+        values = clean_frame(rows, columns=range(1, rows.shape[1])).values[:, 1:]
+        return cls(rows.iloc[:, 0].astype(str).str.strip(), elements, values)
+
+    def __len__(self):
+        return len(self.names)
+
+    def index(self, name):
+        """Position of a CRM by name (case/punctuation-insensitive), or None."""
+        return self._index.get(normalize_crm_name(name))
+
+    def match(self, labels):
+        """CRM index of every sample label ("OREAS 903", "CRM-903", ...), -1 where none matches."""
+        labels = pd.Series(labels, dtype=object)
+        keys = labels.where(labels.notna(), '').astype(str).str.upper().str.replace(r'[^0-9A-Z]', '', regex=True)
+        return keys.map(self._labels).fillna(-1).to_numpy(dtype=np.intp)
+
+    def aligned(self, element_names):
+        """Values as a matrix (CRMs x len(element_names)) in the given column order.
+
+        Columns whose element is not in the library are NaN. The result is
+        cached per header, so lookups after the first are plain array indexing.
+        """
+        key = tuple(element_names)
+        if key not in self._aligned:
+            positions = np.array([self._element_index.get(str(name).strip(), -1) for name in key], dtype=np.intp)
+            matrix = np.full((len(self.names), len(key)), np.nan)
+            found = positions >= 0
+            matrix[:, found] = self.values[:, positions[found]]
+            self._aligned[key] = matrix
+        return self._aligned[key]
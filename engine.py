@@ -0,0 +1,757 @@
+import re
+from contextlib import contextmanager
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from cleaning import clean_frame, format_numbers, parse_censored, restore_text
+from crm import CRMLibrary
+from history import History
+from reader import PREAMBLE_ROWS, count_lines, iter_csv, read_xlsx_cached
+
+# Cell status codes kept per cell in dup_status / crm_status. Higher codes win
+# when a whole row is summarised (e.g. the colour of the Fixed column).
+STATUS_NONE = 0
+STATUS_CHECKED = 1       # part of a checked duplicate group
+STATUS_IN_RANGE = 2
+STATUS_FIXED = 3
+STATUS_OUT_OF_RANGE = 4
+
+# Random streams: every (stage, column) pair draws from its own generator derived
+# from the session seed, so a column's values don't depend on which other
+# columns are processed with it, or in which worker.
+STAGE_FILL = 0
+STAGE_DUPLICATES = 1
+STAGE_CRM = 2
+# Per-row arrays of a loaded sheet and the value of an empty row
+ROW_ARRAYS = (
+    ('fixed_column', None), ('original', np.nan), ('censored', False), ('qualifiers', ''),
+    ('modified', np.nan), ('base', np.nan), ('censor', np.nan),
+    ('dup_status', 0), ('crm_status', 0), ('crm_compared', False),
+)
+# Cell arrays that change while processing (autosave deltas, undo history);
+# the rest is fixed once a file is loaded
+CELL_ARRAYS = ('modified', 'base', 'censor', 'dup_status', 'crm_status', 'crm_compared')
+# Where an output value came from, by code (see provenance); later stages win
+PROVENANCE = ('empty', 'original', 'manual', 'random', 'duplicate-fixed', 'crm-fixed', 'limit')
+# Where a committed change set came from, passed to change listeners
+SOURCE_PROGRAM = 'program' # processing steps
+SOURCE_USER = 'user' # typed or pasted values
+SOURCE_HISTORY = 'history' # undo/redo
+# Duplicate suffix of a sample name: "S123 DUP", "S123-dup2", "S123_Dup"
+DUPLICATE_PATTERN = r'[\s_-]*DUP\d*$'
+# Custom document property holding the seed in saved workbooks
+SEED_PROPERTY = 'melimess_seed'
+
+
+class ProcessingEngine:
+    """Sheet state and processing steps of DataProcessor, without any Qt widgets.
+
+    Rows are sample rows (sheet row 7 is row 0) and columns are sheet columns;
+    column 0 holds the fixed sample names, elements start at column 1. All cell
+    state is kept in float64 matrices of that shape with NaN meaning "none":
+    original (as loaded), modified, base (the random-generated value before
+    ratio/offset) and censor (the limit L of a Modified cell entered as "<L").
+    Detection limits are not written into the cells: limits holds one value
+    per column and limits_applied says where they are in force, so cells
+    below their limit are shown as "<limit" only when viewed or exported.
+    """
+    def __init__(self, seed=None):
+        self.crm_library = CRMLibrary.builtin()
+        self.crm_index = 0 # CRM used for new comparisons
+        self.history = History(self, CELL_ARRAYS)
+        self.listeners = []
+        self.set_seed(seed)
+        self.reset()
+
+    def set_seed(self, seed=None):
+        """Use a fixed seed, or draw a fresh one when seed is None."""
+        self.seed = int(np.random.SeedSequence().generate_state(1)[0]) if seed is None else int(seed)
+        self.draws = {}
+
+    def column_rng(self, stage, col_index):
+        """Generator for the next draw of one stage on one column.
+
+        Draws are counted per (stage, column), so the same sequence of
+        operations with the same seed reproduces the same values.
+        """
+        key = (stage, int(col_index))
+        count = self.draws.get(key, 0)
+        self.draws[key] = count + 1
+        return np.random.default_rng([self.seed, stage, int(col_index), count])
+
+    def reset(self):
+        self.history.clear()
+        self.draws = {}
+        self.preamble = None # Rows 0-5 as read
+        self.header_row = None # Row 1: element names (هدر اصلی)
+        self.reserved_rows = {}
+        self.limits = None
+        self.limits_applied = None
+        self.fixed_column = None
+        self.original = None
+        self.censored = None
+        self.qualifiers = None
+        self.load_errors = []
+        self.modified = None
+        self.base = None
+        self.censor = None
+        self.processed = None
+        self.dup_status = None
+        self.crm_status = None
+        self.crm_reference = None
+        self.crm_rows = {} # row -> CRM index in crm_library
+        self.crm_original_row = None # CRM row whose reference values are shown
+        self.crm_compared = None
+        self.dirty = None # columns changed since the last autosave (see session.py)
+
+    def load(self, file_path, on_chunk=None):
+        """Load a CSV/XLSX export; CSV files are streamed, see load_csv."""
+        if file_path.lower().endswith('.csv'):
+            self.load_csv(file_path, on_chunk)
+        else:
+            preamble, names, cleaned = read_xlsx_cached(file_path)
+            self.start_sheet(preamble, len(names))
+            self.store_rows(0, names, cleaned)
+
+    def load_csv(self, file_path, on_chunk=None):
+        """Parse a CSV export chunk by chunk into preallocated arrays.
+
+        on_chunk(rows_loaded) is called after every chunk; the engine is
+        usable at that point, with rows not read yet still empty.
+        """
+        chunks = iter_csv(file_path)
+        preamble = next(chunks)
+        # The line count is an upper bound (blank lines are skipped); trimmed below
+        self.start_sheet(preamble, max(count_lines(file_path) - PREAMBLE_ROWS, 0))
+        loaded = 0
+        for start, names, cleaned in chunks:
+            self.store_rows(start, names, cleaned)
+            loaded = start + len(names)
+            if on_chunk is not None:
+                on_chunk(loaded)
+        if loaded != self.num_rows:
+            self.resize_rows(loaded)
+
+    def start_sheet(self, preamble, num_rows):
+        """Keep the header/reserved rows and allocate all state for num_rows sample rows."""
+        self.reset()
+        self.preamble = preamble
+        # Row 1: element names (هدر اصلی)
+        self.header_row = preamble.iloc[1].copy()
+        # Reserved rows: 2,3,4,5
+        self.reserved_rows = {
+            2: preamble.iloc[2].copy(),
+            3: preamble.iloc[3].copy(),
+            4: preamble.iloc[4].copy(),
+            5: preamble.iloc[5].copy()
+        }
+        # Row 4 (DL) holds the per-element limit used by apply_limits_to_column
+        self.limits = pd.to_numeric(self.reserved_rows[3], errors='coerce').to_numpy(dtype=np.float64, copy=True)
+        self.limits[0] = np.nan
+        self.limits_applied = np.zeros(len(self.limits), dtype=bool)
+        shape = (num_rows, preamble.shape[1])
+        self.fixed_column = np.full(num_rows, None, dtype=object)
+        self.original = np.full(shape, np.nan)
+        self.censored = np.zeros(shape, dtype=bool)
+        self.qualifiers = np.full(shape, '', dtype='<U2')
+        self.modified = np.full(shape, np.nan)
+        self.base = np.full(shape, np.nan)
+        self.censor = np.full(shape, np.nan)
+        self.processed = np.zeros(shape[1], dtype=bool)
+        self.dup_status = np.zeros(shape, dtype=np.int8)
+        self.crm_status = np.zeros(shape, dtype=np.int8)
+        self.crm_compared = np.zeros(shape, dtype=bool)
+        self.dirty = np.ones(shape[1], dtype=bool)
+        self.align_crm()
+
+    def store_rows(self, start, names, cleaned):
+        """Copy a parsed block of sample rows into place, growing the arrays if needed."""
+        end = start + len(names)
+        if end > self.num_rows:
+            # Quoted line breaks can make the line count too small
+            self.resize_rows(max(end, 2 * self.num_rows))
+        self.fixed_column[start:end] = names
+        self.original[start:end] = cleaned.values
+        self.censored[start:end] = cleaned.censored
+        self.qualifiers[start:end] = cleaned.qualifiers
+        self.load_errors.extend((row + start, col, text) for row, col, text in cleaned.errors)
+
+    def resize_rows(self, num_rows):
+        """Grow (with empty rows) or trim every per-row array to num_rows.
+
+        num_rows follows fixed_column, which is swapped last when growing and
+        first when trimming, so the table reading on the GUI thread during a
+        background load never indexes past the other arrays.
+        """
+        names = ROW_ARRAYS[1:] + ROW_ARRAYS[:1] if num_rows > self.num_rows else ROW_ARRAYS
+        for name, empty in names:
+            old = getattr(self, name)
+            new = np.full((num_rows,) + old.shape[1:], empty, dtype=old.dtype)
+            kept = min(num_rows, len(old))
+            new[:kept] = old[:kept]
+            setattr(self, name, new)
+        self.dirty[:] = True
+
+    @property
+    def num_rows(self):
+        return 0 if self.fixed_column is None else len(self.fixed_column)
+
+    @property
+    def num_columns(self):
+        return 0 if self.original is None else self.original.shape[1]
+
+    def element_columns(self):
+        return range(1, self.num_columns)
+
+    def get_element_name(self, col_index):
+        if self.header_row is None or col_index >= len(self.header_row):
+            return "Unknown"
+        name = self.header_row.iloc[col_index]
+        name = "" if pd.isna(name) else str(name).strip()
+        return name if name else "Unknown"
+
+    def original_text(self, row, col_index):
+        """Original cell as loaded, including its "<"/">" qualifier."""
+        return restore_text(self.original[row, col_index], self.qualifiers[row, col_index])
+
+    def load_error_summary(self, limit=5):
+        shown = ", ".join(
+            f"{self.get_element_name(col)} row {row + 7}: {text!r}" for row, col, text in self.load_errors[:limit]
+        )
+        more = len(self.load_errors) - limit
+        return shown + (f" (+{more} more)" if more > 0 else "")
+
+    def numeric_mask(self, col_index):
+        """Rows whose Modified value is a plain number (not empty, not "<L")."""
+        return ~np.isnan(self.modified[:, col_index]) & np.isnan(self.censor[:, col_index])
+
+    def cell_limit(self, row, col_index):
+        """L of a cell shown as "<L" (entered that way or below an applied limit), else NaN."""
+        limit = self.censor[row, col_index]
+        if np.isnan(limit) and self.limits_applied[col_index] and self.modified[row, col_index] < self.limits[col_index]:
+            return self.limits[col_index]
+        return limit
+
+    def value(self, row, col_index):
+        """Modified cell as float, text "<L" when censored, or None when empty."""
+        limit = self.cell_limit(row, col_index)
+        if not np.isnan(limit):
+            return f"<{limit:g}"
+        val = self.modified[row, col_index]
+        return None if np.isnan(val) else float(val)
+
+    def modified_text(self, row, col_index):
+        val = self.value(row, col_index)
+        return "" if val is None else str(val)
+
+    def column_texts(self, col_index):
+        """original_text and modified_text of every row of one column, as two lists."""
+        original = format_numbers(self.original[:, col_index])
+        for row in np.flatnonzero(self.qualifiers[:, col_index] != '').tolist():
+            if original[row]:
+                original[row] = self.qualifiers[row, col_index].replace('x', original[row])
+        modified = self.modified[:, col_index]
+        limits = self.censor[:, col_index].copy()
+        if self.limits_applied[col_index]:
+            limits[np.isnan(limits) & (modified < self.limits[col_index])] = self.limits[col_index]
+        texts = np.full(len(modified), "", dtype=object)
+        plain = ~np.isnan(modified) & np.isnan(limits)
+        texts[plain] = [str(val) for val in modified[plain].tolist()]
+        censored = ~np.isnan(limits)
+        texts[censored] = [f"<{limit:g}" for limit in limits[censored].tolist()]
+        return original, texts.tolist()
+
+    def is_random_filled(self, row, col_index):
+        return not np.isnan(self.base[row, col_index])
+
+    def add_listener(self, listener):
+        """listener(operation, source) is called once per committed change set,
+        see transaction; operation.columns are the columns with changed cells."""
+        self.listeners.append(listener)
+
+    def notify(self, operation, source):
+        for listener in self.listeners:
+            listener(operation, source)
+
+    @contextmanager
+    def transaction(self, label, source=SOURCE_PROGRAM):
+        """Group everything done inside into one change set.
+
+        The change set is one undo step and, once the outermost transaction
+        ends, one call to every listener; nested transactions join the outer
+        one. Nothing is reported when no cell or sheet state changed.
+        """
+        outer = self.history.depth == 0
+        with self.history.operation(label) as operation:
+            yield operation
+        if outer and self.history.undo_stack and self.history.undo_stack[-1] is operation:
+            self.notify(operation, source)
+
+    def undo(self):
+        """Revert the last change set; returns it, or None when there is nothing to undo."""
+        operation = self.history.undo()
+        if operation is not None:
+            self.notify(operation, SOURCE_HISTORY)
+        return operation
+
+    def redo(self):
+        operation = self.history.redo()
+        if operation is not None:
+            self.notify(operation, SOURCE_HISTORY)
+        return operation
+
+    def touch(self, columns):
+        """Called before the cells of columns change: marks them for the next
+        autosave and lets an open undo operation save their old values."""
+        self.history.touched(columns)
+        self.dirty[columns] = True
+
+    def mark_processed(self, col_index):
+        self.processed[col_index] = True
+
+    def all_columns_processed(self):
+        return bool(self.processed[1:].all())
+
+    def set_value(self, col_index, row, val, censor=np.nan):
+        """Store a user edit; a hand-edited cell is no longer random-generated."""
+        if row >= self.num_rows:
+            return
+        self.mark_processed(col_index)
+        val = np.nan if val is None else val
+        self.touch(col_index)
+        old = (self.modified[row, col_index], self.censor[row, col_index])
+        self.modified[row, col_index] = val
+        self.censor[row, col_index] = censor
+        if not np.array_equal(old, (val, censor), equal_nan=True):
+            self.base[row, col_index] = np.nan
+
+    def set_text(self, col_index, row, text):
+        """Parse and store a typed/pasted value; "<L" is kept as censored.
+
+        Raises ValueError for text that is not a number or "<number".
+        """
+        val, qualifier = parse_censored(text)
+        if qualifier not in ('', '<x', 'x<'):
+            raise ValueError(f"Unsupported qualifier in {text!r}")
+        self.set_value(col_index, row, val, val if qualifier else np.nan)
+
+    def set_texts(self, start_row, columns, texts):
+        """Parse and store a block of typed/pasted values in one assignment.
+
+        texts is a list of rows of strings (e.g. a TSV clipboard block); its
+        columns go to the given engine columns from start_row down, and what
+        falls outside the sheet is dropped. Empty strings clear cells; text
+        set_text would reject is left out. Returns (rows, columns, skipped):
+        the size of the block written and the number of cells left out.
+        """
+        cols = self._columns(columns)
+        block = pd.DataFrame(texts, dtype=object).iloc[:max(self.num_rows - start_row, 0), :len(cols)]
+        cols = cols[:block.shape[1]]
+        if block.empty:
+            return 0, 0, 0
+        cleaned = clean_frame(block)
+        ok = np.isin(cleaned.qualifiers, ('', '<x', 'x<'))
+        for row, col, _ in cleaned.errors:
+            ok[row, col] = False
+        values = cleaned.values
+        censor = np.where(cleaned.qualifiers != '', values, np.nan)
+        cells = np.ix_(np.arange(start_row, start_row + len(block)), cols)
+        self.processed[cols] = True
+        self.touch(cols)
+        old_values, old_censor = self.modified[cells], self.censor[cells]
+        unchanged = ((old_values == values) | (np.isnan(old_values) & np.isnan(values))) & \
+            ((old_censor == censor) | (np.isnan(old_censor) & np.isnan(censor)))
+        self.modified[cells] = np.where(ok, values, old_values)
+        self.censor[cells] = np.where(ok, censor, old_censor)
+        # Like set_value: a changed cell is no longer random-generated
+        self.base[cells] = np.where(ok & ~unchanged, np.nan, self.base[cells])
+        return block.shape[0], block.shape[1], int((~ok).sum())
+
+    def _columns(self, columns):
+        """Normalise a column index or a sequence of them to an index array."""
+        return np.atleast_1d(np.asarray(columns, dtype=np.intp))
+
+    @staticmethod
+    def _per_column(value, cols):
+        """Broadcast a scalar or per-column setting to one value per column."""
+        return np.broadcast_to(np.asarray(value, dtype=np.float64), cols.shape)
+
+    def _draw_uniforms(self, stage, cols, counts):
+        """counts[i] uniform draws from the stream of cols[i], one column after another.
+
+        Callers list their cells column-major (np.nonzero(mask.T)) so each
+        column's cells take consecutive draws from its own stream. Columns with
+        nothing to draw are skipped and their draw counters left unchanged.
+        """
+        return np.concatenate(
+            [np.empty(0)] + [self.column_rng(stage, col).random(n) for col, n in zip(cols, counts) if n]
+        )
+
+    def fill_empty_cells(self, columns, min_val, max_val, ratio, offset):
+        """Generate Modified values from Original * random factor in one pass.
+
+        columns is one column index or a sequence of them; min/max/ratio/offset
+        are scalars or one value per column. Previously random-filled cells are
+        regenerated and empty ones filled. Returns the number of cells written.
+        """
+        cols = self._columns(columns)
+        min_val, max_val, ratio, offset = (self._per_column(v, cols) for v in (min_val, max_val, ratio, offset))
+        self.processed[cols] = True
+        self.touch(cols)
+        original = self.original[:, cols]
+        empty = np.isnan(self.modified[:, cols]) & np.isnan(self.censor[:, cols])
+        idx, rows = np.nonzero((~np.isnan(original) & (~np.isnan(self.base[:, cols]) | empty)).T)
+        uniforms = self._draw_uniforms(STAGE_FILL, cols, np.bincount(idx, minlength=len(cols)))
+        targets = cols[idx]
+        bases = original[rows, idx] * (min_val[idx] + (max_val[idx] - min_val[idx]) * uniforms)
+        self.base[rows, targets] = bases
+        self.modified[rows, targets] = np.round(bases * ratio[idx] + offset[idx], 2)
+        self.censor[rows, targets] = np.nan
+        return len(rows)
+
+    def apply_ratio_offset(self, columns, ratio, offset, apply_to_manual=False):
+        """Recompute Modified = Base * ratio + offset for the random-filled cells.
+
+        With apply_to_manual the same transform is applied to hand-entered
+        numbers. Accepts the same column/setting forms as fill_empty_cells.
+        """
+        cols = self._columns(columns)
+        ratio, offset = self._per_column(ratio, cols), self._per_column(offset, cols)
+        self.processed[cols] = True
+        self.touch(cols)
+        base = self.base[:, cols]
+        modified = self.modified[:, cols]
+        filled = ~np.isnan(base)
+        new_values = np.where(filled, base, modified)
+        targets = filled
+        if apply_to_manual:
+            targets = filled | (~np.isnan(modified) & np.isnan(self.censor[:, cols]))
+        self.modified[:, cols] = np.where(targets, np.round(new_values * ratio + offset, 2), modified)
+        return int(targets.sum())
+
+    def find_duplicate_groups(self, pattern=DUPLICATE_PATTERN):
+        """Group sample rows by base ID, e.g. "S123" and "S123 DUP" -> {"S123": [r1, r2]}.
+
+        pattern matches the duplicate suffix of a sample name (case-insensitive).
+        Only IDs that have at least one duplicate row are returned.
+        """
+        names = pd.Series(self.fixed_column, dtype=object)
+        names = names[names.notna()].astype(str).str.strip()
+        names = names[names != '']
+        base_ids = names.str.replace(pattern, '', regex=True, flags=re.IGNORECASE).str.strip()
+        has_duplicate = (base_ids != names).groupby(base_ids).any()
+        groups = base_ids.groupby(base_ids).groups
+        return {
+            base_id: np.sort(np.asarray(groups[base_id], dtype=np.intp))
+            for base_id in has_duplicate.index[has_duplicate.to_numpy()]
+            if len(groups[base_id]) > 1
+        }
+
+    @staticmethod
+    def _group_layout(groups):
+        """Concatenated rows of all groups and the group label of each row."""
+        row_lists = [np.asarray(rows, dtype=np.intp) for rows in groups]
+        if not row_lists:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp)
+        labels = np.repeat(np.arange(len(row_lists)), [len(rows) for rows in row_lists])
+        return np.concatenate(row_lists), labels
+
+    @staticmethod
+    def _group_means(values, valid, labels, num_groups):
+        """Per-group, per-column mean of the valid values; returns (means, counts)."""
+        sums = np.zeros((num_groups, values.shape[1]))
+        counts = np.zeros((num_groups, values.shape[1]), dtype=np.intp)
+        np.add.at(sums, labels, np.where(valid, values, 0.0))
+        np.add.at(counts, labels, valid)
+        return sums / np.maximum(counts, 1), counts
+
+    def apply_recipe(self, recipe, columns=None):
+        """Fill and ratio/offset every column with its own recipe settings in one pass.
+
+        recipe is a recipe.Recipe; columns defaults to every element. Returns
+        the number of cells filled.
+        """
+        cols = self._columns(self.element_columns() if columns is None else columns)
+        settings = recipe.vectors([self.get_element_name(col) for col in cols])
+        filled = self.fill_empty_cells(cols, settings['min'], settings['max'], settings['ratio'], settings['offset'])
+        manual = settings['apply_to_manual'].astype(bool)
+        if manual.any():
+            self.apply_ratio_offset(cols[manual], settings['ratio'][manual], settings['offset'][manual], apply_to_manual=True)
+        return filled
+
+    def check_duplicate_groups(self, groups, columns, dup_range):
+        """Compare every row group with its own mean in every given column at once.
+
+        groups is a sequence of row index lists. Returns (rows, out_of_range):
+        the rows of all groups concatenated and a bool matrix (rows x columns)
+        that is True where a Modified value deviates from its group's mean by
+        more than dup_range (a scalar or one value per column). Checked and
+        out-of-range cells are marked in dup_status; groups without numeric
+        values in a column are left untouched.
+        """
+        cols = self._columns(columns)
+        self.touch(cols)
+        rows, labels = self._group_layout(groups)
+        values = self.modified[np.ix_(rows, cols)]
+        numeric = ~np.isnan(values) & np.isnan(self.censor[np.ix_(rows, cols)])
+        means, counts = self._group_means(values, numeric, labels, len(groups))
+        means, checked = means[labels], counts[labels] > 0
+        out_of_range = numeric & (np.abs(values - means) > means * self._per_column(dup_range, cols))
+        row_idx, col_idx = np.nonzero(checked)
+        self.dup_status[rows[row_idx], cols[col_idx]] = np.where(
+            out_of_range[row_idx, col_idx], STATUS_OUT_OF_RANGE, STATUS_CHECKED
+        )
+        return rows, out_of_range
+
+    def fix_duplicate_groups(self, groups, columns, min_val, max_val):
+        """Replace out-of-range cells of every group with group mean * random factor.
+
+        The mean is taken over the group's Original values. Empty Modified
+        cells of the groups are copied back from Original. Returns
+        (fixed, restored): bool matrices over the concatenated group rows.
+        """
+        cols = self._columns(columns)
+        self.touch(cols)
+        rows, labels = self._group_layout(groups)
+        originals = self.original[np.ix_(rows, cols)]
+        present = ~np.isnan(originals)
+        means, counts = self._group_means(originals, present, labels, len(groups))
+        has_values = counts[labels] > 0
+        self.processed[cols[has_values.any(axis=0)]] = True
+        fixed = has_values & (self.dup_status[np.ix_(rows, cols)] == STATUS_OUT_OF_RANGE)
+        col_idx, row_idx = np.nonzero(fixed.T)
+        uniforms = self._draw_uniforms(STAGE_DUPLICATES, cols, np.bincount(col_idx, minlength=len(cols)))
+        targets = rows[row_idx], cols[col_idx]
+        min_val = self._per_column(min_val, cols)[col_idx]
+        max_val = self._per_column(max_val, cols)[col_idx]
+        self.modified[targets] = np.round(means[labels[row_idx], col_idx] * (min_val + (max_val - min_val) * uniforms), 2)
+        self.censor[targets] = np.nan
+        self.dup_status[targets] = STATUS_FIXED
+        empty = np.isnan(self.modified[np.ix_(rows, cols)]) & np.isnan(self.censor[np.ix_(rows, cols)])
+        restored = has_values & ~fixed & empty & present
+        row_idx, col_idx = np.nonzero(restored)
+        self.modified[rows[row_idx], cols[col_idx]] = originals[row_idx, col_idx]
+        return fixed, restored
+
+    def set_crm_library(self, library):
+        """Use another CRM library; comparisons made with the previous one are cleared.
+
+        The swap is one undo step: undoing it brings back the previous library
+        and its comparisons, so older steps never see CRM indices of another library.
+        """
+        with self.transaction("Load CRM library"):
+            self.clear_crm()
+            self.crm_library = library
+            self.crm_index = 0
+            self.align_crm()
+
+    def select_crm(self, name):
+        index = self.crm_library.index(name)
+        if index is None:
+            raise ValueError(f"CRM {name!r} is not in the library")
+        self.crm_index = index
+
+    def align_crm(self):
+        """Line up the library values with the header row (CRMs x sheet columns)."""
+        if self.header_row is None:
+            self.crm_reference = None
+            return
+        self.crm_reference = self.crm_library.aligned([self.get_element_name(c) for c in range(self.num_columns)])
+
+    def crm_name(self, row=None):
+        return self.crm_library.names[self.crm_rows.get(row, self.crm_index)]
+
+    def crm_value(self, col_index, row=None):
+        """Reference value of an element for the CRM of row (default: the selected CRM)."""
+        val = self.crm_reference[self.crm_rows.get(row, self.crm_index), col_index]
+        return None if np.isnan(val) else float(val)
+
+    @property
+    def crm_compared_columns(self):
+        """Columns with at least one compared CRM cell."""
+        if self.crm_compared is None:
+            return set()
+        return set(np.flatnonzero(self.crm_compared.any(axis=0)).tolist())
+
+    def find_crm_rows(self):
+        """Rows whose sample name is a CRM of the library; returns {row: CRM index}."""
+        matches = self.crm_library.match(self.fixed_column)
+        rows = np.flatnonzero(matches >= 0)
+        return dict(zip(rows.tolist(), matches[rows].tolist()))
+
+    def compare_crm_rows(self, crm_rows, columns, crm_range):
+        """Compare CRM rows with their own reference values in every given column at once.
+
+        crm_rows maps row -> CRM index (see find_crm_rows); the rows keep that
+        CRM for later fixes. Cells without a reference value or Original are
+        not marked compared. Returns (rows, recovery): the sorted rows and a
+        matrix (rows x columns) of Modified / reference in percent, NaN where
+        nothing was compared.
+        """
+        cols = self._columns(columns)
+        self.touch(cols)
+        self.crm_rows.update(crm_rows)
+        rows = np.array(sorted(crm_rows), dtype=np.intp)
+        if self.crm_original_row is None and len(rows):
+            self.crm_original_row = int(rows[0])
+        cells = np.ix_(rows, cols)
+        refs = self.crm_reference[np.ix_([self.crm_rows[row] for row in rows], cols)]
+        comparable = ~np.isnan(refs) & ~np.isnan(self.original[cells])
+        self.crm_compared[cells] |= comparable
+        values = self.modified[cells]
+        numeric = comparable & ~np.isnan(values) & np.isnan(self.censor[cells])
+        in_range = np.abs(values - refs) <= refs * self._per_column(crm_range, cols)
+        row_idx, col_idx = np.nonzero(numeric)
+        self.crm_status[rows[row_idx], cols[col_idx]] = np.where(
+            in_range[row_idx, col_idx], STATUS_IN_RANGE, STATUS_OUT_OF_RANGE
+        )
+        return rows, np.where(numeric, values / np.where(numeric, refs, 1.0) * 100, np.nan)
+
+    def fix_crm_cells(self, columns, crm_range, out_of_range_only=False):
+        """Replace compared CRM cells with reference * random factor within crm_range.
+
+        Works on every CRM row at once; crm_range is a scalar or one value per
+        column. With out_of_range_only, cells that compared in range are kept.
+        Returns the number of cells written.
+        """
+        cols = self._columns(columns)
+        self.touch(cols)
+        rows = np.array(sorted(self.crm_rows), dtype=np.intp)
+        targets = self.crm_compared[np.ix_(rows, cols)]
+        if out_of_range_only:
+            targets &= self.crm_status[np.ix_(rows, cols)] == STATUS_OUT_OF_RANGE
+        col_idx, row_idx = np.nonzero(targets.T)
+        uniforms = self._draw_uniforms(STAGE_CRM, cols, np.bincount(col_idx, minlength=len(cols)))
+        refs = self.crm_reference[[self.crm_rows[row] for row in rows[row_idx]], cols[col_idx]]
+        cells = rows[row_idx], cols[col_idx]
+        self.processed[np.unique(cols[col_idx])] = True
+        crm_range = self._per_column(crm_range, cols)[col_idx]
+        self.modified[cells] = np.round(refs * (1.0 - crm_range + 2 * crm_range * uniforms), 2)
+        self.censor[cells] = np.nan
+        self.crm_status[cells] = STATUS_FIXED
+        return len(row_idx)
+
+    def clear_crm(self, col_index=None):
+        if self.crm_compared is None:
+            return
+        columns = slice(None) if col_index is None else col_index
+        self.touch(columns)
+        self.crm_status[:, columns] = np.where(self.crm_compared[:, columns], STATUS_NONE, self.crm_status[:, columns])
+        self.crm_compared[:, columns] = False
+        if not self.crm_compared.any():
+            self.crm_rows.clear()
+            self.crm_original_row = None
+
+    def crm_recovery(self):
+        """Mean recovery (Modified / reference, %) per CRM and element over all compared rows."""
+        rows = np.array(sorted(self.crm_rows), dtype=np.intp)
+        crm_idx = np.array([self.crm_rows[row] for row in rows], dtype=np.intp)
+        refs = self.crm_reference[crm_idx]
+        numeric = self.crm_compared[rows] & ~np.isnan(self.modified[rows]) & np.isnan(self.censor[rows])
+        recovery = np.where(numeric, self.modified[rows] / np.where(numeric, refs, 1.0) * 100, np.nan)
+        columns = np.flatnonzero(numeric.any(axis=0))
+        table = pd.DataFrame(recovery[:, columns], columns=[self.get_element_name(col) for col in columns])
+        return table.groupby([self.crm_library.names[i] for i in crm_idx]).mean()
+
+    def cell_status(self, row, col_index):
+        crm = self.crm_status[row, col_index]
+        return crm if crm != STATUS_NONE else self.dup_status[row, col_index]
+
+    def row_status(self, row, col_index=None):
+        """Status of a whole row (all elements) or of one element, for the Fixed column."""
+        if col_index is not None:
+            return self.cell_status(row, col_index)
+        return max(self.dup_status[row].max(), self.crm_status[row].max())
+
+    def limit_value(self, col_index):
+        limit_val = self.limits[col_index]
+        return None if np.isnan(limit_val) else float(limit_val)
+
+    def set_limit(self, col_index, limit_val):
+        """Change the limit of one column (None removes it); applied limits update at once."""
+        self.limits[col_index] = np.nan if limit_val is None else float(limit_val)
+
+    def below_limit(self):
+        """Bool matrix of plain numbers below the applied limit of their column."""
+        return (self.modified < self.limits) & self.limits_applied & np.isnan(self.censor)
+
+    def apply_limits(self, columns):
+        """Put the row-4 limits of the given columns in force; returns the number of cells below them.
+
+        Nothing is overwritten: the comparison is redone whenever cells are
+        shown or exported, so values or limits changed later are picked up.
+        """
+        cols = self._columns(columns)
+        cols = cols[~np.isnan(self.limits[cols])]
+        self.processed[cols] = True
+        self.limits_applied[cols] = True
+        return int(((self.modified[:, cols] < self.limits[cols]) & np.isnan(self.censor[:, cols])).sum())
+
+    def clear_limits(self, columns):
+        self.limits_applied[self._columns(columns)] = False
+
+    def apply_limits_to_column(self, col_index):
+        """Apply the row-4 limit of one column; returns the rows below it."""
+        self.apply_limits([col_index])
+        return np.flatnonzero(self.below_limit()[:, col_index])
+
+    def output_limits(self):
+        """Matrix of the L of every cell written as "<L", NaN elsewhere."""
+        return np.where(self.below_limit(), self.limits, self.censor)
+
+    def limit_row(self):
+        """Row 4 of the output: the DL row as read, with limits changed in the program filled in."""
+        row = self.reserved_rows[3].to_numpy(dtype=object, copy=True)
+        loaded = pd.to_numeric(self.reserved_rows[3], errors='coerce').to_numpy(dtype=np.float64)
+        changed = ~((loaded == self.limits) | (np.isnan(loaded) & np.isnan(self.limits)))
+        changed[0] = False
+        row[changed] = [None if np.isnan(limit) else float(limit) for limit in self.limits[changed]]
+        return row
+
+    def output_values(self):
+        """Sample rows as an object array: Modified where processed, else Original."""
+        values = np.where(self.processed, self.modified, self.original).astype(object)
+        values[np.isnan(values.astype(np.float64))] = None
+        limits = self.output_limits()
+        censored = ~np.isnan(limits) & self.processed
+        values[censored] = [f"<{limit:g}" for limit in limits[censored]]
+        values[:, 0] = self.fixed_column
+        return values
+
+    def output_censored(self):
+        """Bool matrix of output cells written as "<L": limit-censored, or censored in Original."""
+        censored = np.where(self.processed, ~np.isnan(self.output_limits()), self.censored)
+        censored[:, 0] = False
+        return censored
+
+    def provenance(self):
+        """int8 matrix of indexes into PROVENANCE for every output cell."""
+        output = np.where(self.processed, self.modified, self.original)
+        codes = np.where(np.isnan(output), 0, 1).astype(np.int8)
+        processed = np.broadcast_to(self.processed, output.shape)
+        changed = processed & ~np.isnan(self.modified) & (self.modified != self.original)
+        codes[changed] = 2
+        codes[processed & ~np.isnan(self.base)] = 3
+        codes[processed & (self.dup_status == STATUS_FIXED)] = 4
+        codes[processed & (self.crm_status == STATUS_FIXED)] = 5
+        codes[processed & ~np.isnan(self.output_limits())] = 6
+        codes[:, 0] = 0
+        return codes
+
+    def save(self, save_path, progress=None):
+        """Write the result; the format follows the extension (XLSX, CSV, parquet or Arrow, see writer.py)."""
+        from writer import write_output # writer imports this module
+        write_output(self, save_path, progress)
+
+
+def read_saved_seed(path):
+    """Seed recorded in a workbook written by ProcessingEngine.save, or None."""
+    workbook = openpyxl.load_workbook(path, read_only=True)
+    try:
+        for prop in workbook.custom_doc_props.props:
+            if prop.name == SEED_PROPERTY:
+                return int(prop.value)
+        return None
+    finally:
+        workbook.close()
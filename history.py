@@ -0,0 +1,217 @@
+"""Undo/redo as per-operation cell deltas.
+
+An operation is everything the engine does inside `with history.operation(label)`.
+The engine calls touched() before it writes to a column; the first time a
+column is touched in an operation its cell arrays are copied. When the
+operation ends, only the cells that actually changed are kept, as flat
+(rows, cols, old, new) arrays per cell array; a column in which so many
+cells changed that the flat form would be larger is kept whole instead. The per-column vectors
+(processed flags, limits) are kept the same way, as the entries the operation
+changed, so undo leaves columns marked processed outside any operation (e.g.
+by navigation) alone. The small remaining sheet state (CRM library, CRM
+rows, draw counters) is kept whole from before and after, so operations
+recorded before a CRM library was swapped are undone with that library. The column copies are
+dropped, so a finished operation costs memory in proportion to the cells it
+changed, and the oldest operations are dropped once the kept ones use more
+than HISTORY_BYTES.
+"""
+from contextlib import contextmanager
+
+import numpy as np
+
+HISTORY_LIMIT = 1000 # operations kept for undo
+HISTORY_BYTES = 256 * 1024 * 1024 # memory the kept operations may use; the newest one is always kept
+# Per-column vectors of the engine, recorded as deltas like the cell arrays
+COLUMN_VECTORS = ('processed', 'limits', 'limits_applied')
+
+
+class CellDelta:
+    """Changed cells of one array: positions plus old and new values, and the
+    whole old and new columns (rows x dense_cols) of mostly changed columns."""
+    __slots__ = ('rows', 'cols', 'old', 'new', 'dense_cols', 'dense_old', 'dense_new')
+
+    def __init__(self, rows, cols, old, new, dense_cols, dense_old, dense_new):
+        self.rows, self.cols, self.old, self.new = rows, cols, old, new
+        self.dense_cols, self.dense_old, self.dense_new = dense_cols, dense_old, dense_new
+
+    @property
+    def nbytes(self):
+        return sum(getattr(self, name).nbytes for name in self.__slots__)
+
+    def apply(self, array, side):
+        """Write the old (side='old') or new values into array."""
+        array[self.rows, self.cols] = getattr(self, side)
+        array[:, self.dense_cols] = getattr(self, 'dense_' + side)
+
+
+class Operation:
+    def __init__(self, label, state, vectors):
+        self.label = label
+        self.before = state
+        self.after = None
+        self.deltas = {} # array name -> CellDelta
+        self.vectors = vectors # vector name -> copy from the start; then (columns, old, new) of its changes
+
+    @property
+    def columns(self):
+        """Columns with changed cells."""
+        if not self.deltas:
+            return np.empty(0, dtype=np.intp)
+        cols = [delta.cols for delta in self.deltas.values()] + [delta.dense_cols for delta in self.deltas.values()]
+        return np.unique(np.concatenate(cols))
+
+    @property
+    def nbytes(self):
+        return sum(delta.nbytes for delta in self.deltas.values()) + \
+            sum(sum(array.nbytes for array in change) for change in self.vectors.values())
+
+
+class History:
+    """Undo and redo stacks of one engine; arrays are the names of its cell arrays."""
+    def __init__(self, engine, arrays, limit=HISTORY_LIMIT, max_bytes=HISTORY_BYTES):
+        self.engine = engine
+        self.arrays = arrays
+        self.limit = limit
+        self.max_bytes = max_bytes
+        self.undo_stack = []
+        self.redo_stack = []
+        self.depth = 0
+        self.current = None
+        self.saved = {} # column -> {array name: column copy} for the open operation
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def state(self):
+        engine = self.engine
+        return {
+            'crm_library': engine.crm_library,
+            'crm_index': engine.crm_index,
+            'crm_rows': dict(engine.crm_rows),
+            'crm_original_row': engine.crm_original_row,
+            'draws': dict(engine.draws),
+        }
+
+    def restore_state(self, state):
+        engine = self.engine
+        if engine.crm_library is not state['crm_library']:
+            # The CRM picked in the selector is kept unless the library changes with it
+            engine.crm_library = state['crm_library']
+            engine.crm_index = state['crm_index']
+            engine.align_crm()
+        engine.crm_rows = dict(state['crm_rows'])
+        engine.crm_original_row = state['crm_original_row']
+        engine.draws = dict(state['draws'])
+
+    @staticmethod
+    def same_state(a, b):
+        """True when nothing but the draw counters differs."""
+        return a['crm_library'] is b['crm_library'] and a['crm_rows'] == b['crm_rows'] and \
+            a['crm_original_row'] == b['crm_original_row']
+
+    def vectors(self):
+        engine = self.engine
+        return {name: getattr(engine, name).copy() for name in COLUMN_VECTORS if getattr(engine, name) is not None}
+
+    @contextmanager
+    def operation(self, label):
+        """Record everything done inside as one undo step; nested operations join the outer one."""
+        self.depth += 1
+        if self.depth == 1:
+            self.current = Operation(label, self.state(), self.vectors())
+            self.saved = {}
+        try:
+            yield self.current
+        finally:
+            self.depth -= 1
+            if self.depth == 0:
+                self.finish()
+
+    def touched(self, columns):
+        """Called by the engine before it changes the cells of columns."""
+        if self.depth == 0:
+            return
+        for col in np.atleast_1d(np.arange(self.engine.num_columns)[columns]).tolist():
+            if col not in self.saved:
+                self.saved[col] = {name: getattr(self.engine, name)[:, col].copy() for name in self.arrays}
+
+    def finish(self):
+        operation, saved = self.current, self.saved
+        self.current, self.saved = None, {}
+        if self.engine.original is None:
+            return
+        operation.after = self.state()
+        for name, old in list(operation.vectors.items()):
+            new = getattr(self.engine, name)
+            changed = old != new
+            if old.dtype.kind == 'f':
+                changed &= ~(np.isnan(old) & np.isnan(new))
+            columns = np.flatnonzero(changed)
+            if len(columns):
+                operation.vectors[name] = (columns, old[columns], new[columns])
+            else:
+                del operation.vectors[name]
+        if saved:
+            cols = np.array(sorted(saved), dtype=np.intp)
+            for name in self.arrays:
+                old = np.column_stack([saved[col][name] for col in cols])
+                new = getattr(self.engine, name)[:, cols]
+                changed = old != new
+                if old.dtype.kind == 'f':
+                    changed &= ~(np.isnan(old) & np.isnan(new))
+                rows, idx = np.nonzero(changed)
+                if not len(rows):
+                    continue
+                # A changed cell costs two int32 positions and two values, a whole column two values per row
+                dense = np.bincount(idx, minlength=len(cols)) * (8 + 2 * old.itemsize) > len(old) * 2 * old.itemsize
+                cells = ~dense[idx]
+                rows, idx = rows[cells], idx[cells]
+                operation.deltas[name] = CellDelta(
+                    rows.astype(np.int32), cols[idx].astype(np.int32), old[rows, idx], new[rows, idx],
+                    cols[dense].astype(np.int32), old[:, dense], new[:, dense],
+                )
+        if not operation.deltas and not operation.vectors and self.same_state(operation.before, operation.after):
+            return
+        self.undo_stack.append(operation)
+        del self.undo_stack[:-self.limit]
+        self.redo_stack.clear()
+        self.trim()
+
+    def trim(self):
+        """Drop the oldest operations until the kept ones fit in max_bytes."""
+        sizes = [operation.nbytes for operation in self.undo_stack]
+        total = sum(sizes)
+        drop = 0
+        while total > self.max_bytes and drop < len(sizes) - 1:
+            total -= sizes[drop]
+            drop += 1
+        del self.undo_stack[:drop]
+
+    def apply(self, operation, side):
+        """Write the old (side='old') or new values of an operation back into the engine."""
+        for name, delta in operation.deltas.items():
+            delta.apply(getattr(self.engine, name), side)
+        for name, (columns, old, new) in operation.vectors.items():
+            getattr(self.engine, name)[columns] = old if side == 'old' else new
+        self.restore_state(operation.before if side == 'old' else operation.after)
+        columns = operation.columns
+        if len(columns):
+            self.engine.touch(columns)
+
+    def undo(self):
+        """Revert the last operation; returns it, or None when there is nothing to undo."""
+        if not self.undo_stack or self.depth:
+            return None
+        operation = self.undo_stack.pop()
+        self.apply(operation, 'old')
+        self.redo_stack.append(operation)
+        return operation
+
+    def redo(self):
+        if not self.redo_stack or self.depth:
+            return None
+        operation = self.redo_stack.pop()
+        self.apply(operation, 'new')
+        self.undo_stack.append(operation)
+        return operation
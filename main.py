@@ -1,15 +1,31 @@
+import os
+import re
 import sys
-import pandas as pd
-import random
+import time
+import multiprocessing
+import numpy as np
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
-    QPushButton, QFileDialog, QTableWidget, QTableWidgetItem,
+    QPushButton, QFileDialog, QTableView,
     QLineEdit, QLabel, QCheckBox, QMessageBox, QSplitter,
-    QGroupBox, QFormLayout, QDoubleSpinBox, QStatusBar, QComboBox
+    QGroupBox, QFormLayout, QDoubleSpinBox, QStatusBar, QComboBox, QProgressBar
 )
-from PyQt6.QtCore import Qt, QEvent
-from PyQt6.QtGui import QColor, QBrush, QFont
+from PyQt6.QtCore import Qt, QEvent, QThreadPool, pyqtSignal
+from PyQt6.QtGui import QFont
+from crm import DEFAULT_LIBRARY, LIBRARY_ERRORS, CRMLibrary
+from engine import ProcessingEngine, DUPLICATE_PATTERN, SOURCE_USER, STATUS_OUT_OF_RANGE
+from recipe import Recipe
+from reader import NPZ_ERRORS
+from session import Autosaver, restore, session_view
+from table_model import SheetTableModel, CRMReferenceModel
+from parallel import ColumnPool, columns_of, combine
+from workers import COLUMN_BATCH, Cancelled, Worker, run_operation
+
+
 class DataProcessor(QMainWindow):
+    # Engine change sets can be committed on a worker thread; this hands them to the GUI thread
+    engine_changed = pyqtSignal(object, str)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Data Processor with PyQt6")
@@ -46,13 +62,13 @@ class DataProcessor(QMainWindow):
             QCheckBox {
                 color: #333;
             }
-            QTableWidget {
+            QTableView {
                 background-color: white;
                 alternate-background-color: #f9f9f9;
                 gridline-color: #ddd;
                 selection-background-color: #a8d1ff;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 4px;
             }
             QHeaderView::section {
@@ -85,8 +101,8 @@ class DataProcessor(QMainWindow):
         self.setCentralWidget(self.central_widget)
         main_layout = QHBoxLayout(self.central_widget)
         # Left panel for controls
-        left_panel = QWidget()
-        left_layout = QVBoxLayout(left_panel)
+        self.left_panel = QWidget()
+        left_layout = QVBoxLayout(self.left_panel)
         left_layout.setSpacing(10)
         # File Group
         file_group = QGroupBox("File Operations")
@@ -95,6 +111,31 @@ class DataProcessor(QMainWindow):
         self.load_button.clicked.connect(self.load_file)
         self.load_button.setToolTip("Load a CSV or Excel file to process")
         file_layout.addWidget(self.load_button)
+        seed_layout = QHBoxLayout()
+        self.seed_edit = QLineEdit()
+        self.seed_edit.setPlaceholderText("random")
+        self.seed_edit.setToolTip("Seed for generated values; leave empty for a new seed per file")
+        seed_layout.addWidget(QLabel("Seed:"))
+        seed_layout.addWidget(self.seed_edit)
+        file_layout.addLayout(seed_layout)
+        self.seed_label = QLabel("Session seed: -")
+        file_layout.addWidget(self.seed_label)
+        # Per-element settings of the spin boxes, saved/loaded as a recipe file
+        self.recipe = Recipe()
+        recipe_buttons_layout = QHBoxLayout()
+        self.load_recipe_button = QPushButton("Load Recipe")
+        self.load_recipe_button.clicked.connect(self.load_recipe)
+        self.load_recipe_button.setToolTip("Load per-element settings from a JSON/TOML recipe")
+        recipe_buttons_layout.addWidget(self.load_recipe_button)
+        self.save_recipe_button = QPushButton("Save Recipe")
+        self.save_recipe_button.clicked.connect(self.save_recipe)
+        self.save_recipe_button.setToolTip("Save the settings of every element as a recipe (also usable in batch mode)")
+        recipe_buttons_layout.addWidget(self.save_recipe_button)
+        file_layout.addLayout(recipe_buttons_layout)
+        self.apply_recipe_button = QPushButton("Apply Recipe to Sheet")
+        self.apply_recipe_button.clicked.connect(self.apply_recipe)
+        self.apply_recipe_button.setToolTip("Fill every column with its own recipe settings in one pass")
+        file_layout.addWidget(self.apply_recipe_button)
         left_layout.addWidget(file_group)
         # Navigation Group
         nav_group = QGroupBox("Column Navigation")
@@ -157,9 +198,15 @@ class DataProcessor(QMainWindow):
         fill_layout.addRow(self.apply_to_manual_checkbox)
         self.fill_button = QPushButton("Generate Random")
         self.fill_button.clicked.connect(self.fill_empty_cells)
-        self.fill_button.setToolTip("Generate random values for empty cells")
+        self.fill_button.setToolTip("Generate random values for empty cells (all mode: columns chosen in Select Column)")
         fill_layout.addRow(self.fill_button)
         left_layout.addWidget(fill_group)
+        # Every change is stored in the recipe for the element being edited
+        self.min_spin.valueChanged.connect(lambda value: self.store_recipe_setting('min', value))
+        self.max_spin.valueChanged.connect(lambda value: self.store_recipe_setting('max', value))
+        self.offset_spin.valueChanged.connect(lambda value: self.store_recipe_setting('offset', value))
+        self.ratio_spin.valueChanged.connect(lambda value: self.store_recipe_setting('ratio', value))
+        self.apply_to_manual_checkbox.toggled.connect(lambda checked: self.store_recipe_setting('apply_to_manual', checked))
         # Connect spin boxes for real-time application
         self.offset_spin.valueChanged.connect(self.apply_ratio_offset_to_filled)
         self.ratio_spin.valueChanged.connect(self.apply_ratio_offset_to_filled)
@@ -175,6 +222,8 @@ class DataProcessor(QMainWindow):
         column_select_layout.addWidget(QLabel("Select Column:"))
         column_select_layout.addWidget(self.column_combo)
         self.column_combo.currentIndexChanged.connect(self.update_clear_crm_button)
+        self.column_combo.currentIndexChanged.connect(self.show_recipe_settings)
+        self.column_combo.currentIndexChanged.connect(self.update_limit_edit)
         global_layout.addLayout(column_select_layout)
         # Duplicate Handling for selected column
         global_dup_group = QGroupBox("Duplicate Handling")
@@ -185,6 +234,7 @@ class DataProcessor(QMainWindow):
         self.global_dup_range_spin.setMaximum(1.0)
         self.global_dup_range_spin.setSingleStep(0.01)
         global_dup_layout.addRow("Duplicate Range:", self.global_dup_range_spin)
+        self.global_dup_range_spin.valueChanged.connect(lambda value: self.store_recipe_setting('dup_range', value))
         global_dup_buttons_layout = QHBoxLayout()
         self.global_check_dup_button = QPushButton("Check Duplicates")
         self.global_check_dup_button.clicked.connect(self.global_check_duplicates)
@@ -195,6 +245,20 @@ class DataProcessor(QMainWindow):
         self.global_fix_dup_button.setToolTip("Fix highlighted duplicates with average-based values for selected column")
         global_dup_buttons_layout.addWidget(self.global_fix_dup_button)
         global_dup_layout.addRow(global_dup_buttons_layout)
+        # Duplicate pairs found from sample names ("S123" / "S123 DUP")
+        self.dup_pattern_edit = QLineEdit(DUPLICATE_PATTERN)
+        self.dup_pattern_edit.setToolTip("Regular expression matching the duplicate suffix of a sample name (case-insensitive)")
+        global_dup_layout.addRow("Duplicate Suffix:", self.dup_pattern_edit)
+        auto_dup_buttons_layout = QHBoxLayout()
+        self.auto_check_dup_button = QPushButton("Auto Check by Sample ID")
+        self.auto_check_dup_button.clicked.connect(self.auto_check_duplicates)
+        self.auto_check_dup_button.setToolTip("Check every sample/duplicate pair found by name in the selected column(s)")
+        auto_dup_buttons_layout.addWidget(self.auto_check_dup_button)
+        self.auto_fix_dup_button = QPushButton("Auto Fix by Sample ID")
+        self.auto_fix_dup_button.clicked.connect(self.auto_fix_duplicates)
+        self.auto_fix_dup_button.setToolTip("Fix out-of-range values of every pair found by name in the selected column(s)")
+        auto_dup_buttons_layout.addWidget(self.auto_fix_dup_button)
+        global_dup_layout.addRow(auto_dup_buttons_layout)
         global_layout.addWidget(global_dup_group)
         # CRM Handling for selected column
         global_crm_group = QGroupBox("CRM Handling")
@@ -205,11 +269,26 @@ class DataProcessor(QMainWindow):
         self.global_crm_range_spin.setMaximum(1.0)
         self.global_crm_range_spin.setSingleStep(0.01)
         global_crm_layout.addRow("CRM Range:", self.global_crm_range_spin)
+        self.global_crm_range_spin.valueChanged.connect(lambda value: self.store_recipe_setting('crm_range', value))
+        crm_select_layout = QHBoxLayout()
+        self.crm_combo = QComboBox()
+        self.crm_combo.setToolTip("CRM used for the next comparison")
+        self.crm_combo.currentTextChanged.connect(self.select_crm)
+        crm_select_layout.addWidget(self.crm_combo)
+        self.load_crm_button = QPushButton("Load CRM Library")
+        self.load_crm_button.clicked.connect(self.load_crm_library)
+        self.load_crm_button.setToolTip("Load CRM values from a workbook/CSV laid out like Book1.xlsx")
+        crm_select_layout.addWidget(self.load_crm_button)
+        global_crm_layout.addRow("CRM:", crm_select_layout)
         global_crm_buttons_layout = QVBoxLayout()
-        self.global_compare_crm_button = QPushButton("Compare with CRM 903")
+        self.global_compare_crm_button = QPushButton("Compare with CRM")
         self.global_compare_crm_button.clicked.connect(self.global_compare_with_crm)
-        self.global_compare_crm_button.setToolTip("Compare selected row with CRM 903 value for selected column")
+        self.global_compare_crm_button.setToolTip("Compare selected row with the chosen CRM value for selected column")
         global_crm_buttons_layout.addWidget(self.global_compare_crm_button)
+        self.auto_compare_crm_button = QPushButton("Auto-detect CRM Rows")
+        self.auto_compare_crm_button.clicked.connect(self.auto_compare_with_crm)
+        self.auto_compare_crm_button.setToolTip("Find CRM samples by name and compare each with its own CRM values")
+        global_crm_buttons_layout.addWidget(self.auto_compare_crm_button)
         self.global_fix_crm_button = QPushButton("Fix CRM Differences")
         self.global_fix_crm_button.clicked.connect(self.global_fix_crm_differences)
         self.global_fix_crm_button.setToolTip("Adjust selected CRM row to match within range for selected column")
@@ -219,6 +298,10 @@ class DataProcessor(QMainWindow):
         self.global_clear_crm_button.setEnabled(False)
         self.global_clear_crm_button.setToolTip("Remove CRM reference row and clear highlights for selected column")
         global_crm_buttons_layout.addWidget(self.global_clear_crm_button)
+        self.crm_recovery_button = QPushButton("CRM Recovery Report")
+        self.crm_recovery_button.clicked.connect(self.show_crm_recovery)
+        self.crm_recovery_button.setToolTip("Mean recovery (%) per element for every compared CRM")
+        global_crm_buttons_layout.addWidget(self.crm_recovery_button)
         global_crm_layout.addRow(global_crm_buttons_layout)
         global_layout.addWidget(global_crm_group)
         # Limits Handling for selected column
@@ -228,6 +311,20 @@ class DataProcessor(QMainWindow):
         self.global_apply_limits_button.clicked.connect(self.global_apply_limits)
         self.global_apply_limits_button.setToolTip("Apply limits from row 4 to modified values in selected column")
         global_limits_layout.addWidget(self.global_apply_limits_button)
+        # Limits are compared when cells are shown/saved, so an edited limit shows at once
+        limit_edit_layout = QHBoxLayout()
+        self.limit_edit = QLineEdit()
+        self.limit_edit.setPlaceholderText("none")
+        self.limit_edit.setToolTip("Detection limit of the selected column (row 4); empty removes it")
+        self.limit_edit.setEnabled(False)
+        self.limit_edit.editingFinished.connect(self.edit_limit)
+        limit_edit_layout.addWidget(QLabel("Limit (DL):"))
+        limit_edit_layout.addWidget(self.limit_edit)
+        global_limits_layout.addLayout(limit_edit_layout)
+        self.clear_limits_button = QPushButton("Remove Limits from Selected Column")
+        self.clear_limits_button.clicked.connect(self.clear_limits)
+        self.clear_limits_button.setToolTip("Show the numbers again instead of \"<limit\"")
+        global_limits_layout.addWidget(self.clear_limits_button)
         global_layout.addWidget(global_limits_group)
         left_layout.addWidget(self.global_group)
         # Actions Group
@@ -246,281 +343,355 @@ class DataProcessor(QMainWindow):
         left_layout.addStretch()
         # Splitter
         splitter = QSplitter(Qt.Orientation.Horizontal)
-        splitter.addWidget(left_panel)
-        self.table = QTableWidget()
-        self.table.setEditTriggers(QTableWidget.EditTrigger.DoubleClicked | QTableWidget.EditTrigger.AnyKeyPressed)
-        self.table.setSelectionMode(QTableWidget.SelectionMode.ContiguousSelection)
+        splitter.addWidget(self.left_panel)
+        self.engine = ProcessingEngine()
+        self.model = SheetTableModel(self.engine, self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setEditTriggers(QTableView.EditTrigger.DoubleClicked | QTableView.EditTrigger.AnyKeyPressed)
+        self.table.setSelectionMode(QTableView.SelectionMode.ContiguousSelection)
         self.table.setAlternatingRowColors(True)
         self.table.horizontalHeader().setStretchLastSection(True)
         self.table.verticalHeader().setVisible(True)
         self.table.verticalHeader().setDefaultSectionSize(25)
         self.table.verticalHeader().setSectionsClickable(True)
-        self.table.cellChanged.connect(self.on_cell_changed)
-        
-        splitter.addWidget(self.table)
+        # Frozen strip above the table with the CRM reference values; it only
+        # mirrors the table's columns, so table rows always equal engine rows
+        self.crm_model = CRMReferenceModel(self.model, self)
+        self.crm_strip = QTableView()
+        self.crm_strip.setModel(self.crm_model)
+        self.crm_strip.horizontalHeader().setVisible(False)
+        self.crm_strip.horizontalHeader().setStretchLastSection(True)
+        self.crm_strip.verticalHeader().setDefaultSectionSize(25)
+        self.crm_strip.setHorizontalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.crm_strip.setVerticalScrollBarPolicy(Qt.ScrollBarPolicy.ScrollBarAlwaysOff)
+        self.crm_strip.setFixedHeight(25 + 2 * self.crm_strip.frameWidth())
+        self.crm_strip.setSelectionMode(QTableView.SelectionMode.NoSelection)
+        self.crm_strip.setVisible(False)
+        self.table.horizontalHeader().sectionResized.connect(
+            lambda section, old_size, new_size: self.crm_strip.setColumnWidth(section, new_size)
+        )
+        self.table.horizontalScrollBar().valueChanged.connect(self.crm_strip.horizontalScrollBar().setValue)
+        self.table.verticalHeader().geometriesChanged.connect(self.sync_crm_strip)
+        self.table.selectionModel().currentRowChanged.connect(self.update_crm_strip)
+        self.model.modelReset.connect(self.sync_crm_strip)
+        self.model.modelReset.connect(self.update_crm_strip)
+        table_panel = QWidget()
+        table_layout = QVBoxLayout(table_panel)
+        table_layout.setContentsMargins(0, 0, 0, 0)
+        table_layout.setSpacing(0)
+        table_layout.addWidget(self.crm_strip)
+        table_layout.addWidget(self.table)
+
+        splitter.addWidget(table_panel)
         splitter.setSizes([350, 850]) # Slightly wider left panel for better UI
         main_layout.addWidget(splitter)
         # Status bar
         self.status_bar = QStatusBar()
         self.setStatusBar(self.status_bar)
         self.status_bar.showMessage("Ready")
-        # Data storage
-        self.df = None
-        self.header_row = None # Row 1: element names (هدر اصلی)
-        self.reserved_rows = {}
-        self.processed_columns = {}
-        self.base_columns = {}
+        # Progress of the background operation, if one is running
+        self.worker = None
+        self.worker_label = None
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(200)
+        self.progress_bar.setVisible(False)
+        self.status_bar.addPermanentWidget(self.progress_bar)
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.clicked.connect(self.cancel_worker)
+        self.cancel_button.setVisible(False)
+        self.status_bar.addPermanentWidget(self.cancel_button)
+        # View state (data lives in self.engine)
         self.current_column_index = 0
-        self.current_column_data = None
-        self.fixed_column = None
-        self.crm_original_row = None
-        self.crm_reference_row = None
-        self.crm_compared_columns = set()
         self.all_processed_mode = False
-        # CRM 903 - OREAS 903 values by element name
-        self.crm_903 = {'Ag': 0.348687, 'Al': 5375.47, 'Al2O3': 0.0, 'As': 47.4915, 'Au': 0.00495, 
-                        'B': 0.0, 'Ba': 62.7756, 'BaO': 0.0, 'Be': 2.6943, 'BeO': 0.0,
-                        'Bi': 8.75768, 'C': 0.0, 'C-(Carbonate)': 0.0, 'C-(Graphite)': 0.0,
-                        'Ca': 6334.05, 'CaO': 0.0, 'Cd': 0.208075, 'Ce': 46.2309, 'CeO2': 0.0,
-                        'Cl': 0.0, 'Co': 130.807, 'Cr': 26.1391, 'Cr2O3': 0.0, 
-                        'Cs': 0.281904, 'Cu': 6707.61, 'Cu-Res(4A)': 0.0, 'Cu-Sol(CN)': 0.0,
-                        'Cu-Sol(H2SO4)': 0.0, 'Cu-Tot(Calc)': 0.0, 'Dy': 0.0, 'Dy2O3': 0.0, 'Er': 0.0,
-                        'Er2O3': 0.0, 'Eu': 0.0, 'Eu2O3': 0.0,'F': 0.0, 'Fe': 39392.9, 'Fe(Calc)': 0.0,
-                        'Fe2+': 0.0, 'Fe2O3': 0.0, 'Fe3+': 0.0, 'Fe3O4': 0.0, 'FeO': 0.0, 'Ga': 1.57672,
-                        'Ga2O3': 0.0, 'Gd': 0.0, 'Gd2O3': 0.0, 'Ge': 0.0976435, 'H2O-': 0.0, 'Hf': 0.609417,
-                        'HfO2': 0.0, 'Hg': 0.0, 'Ho': 0.0, 'Ho2O3': 0.0, 'In': 0.112486, 'Ir': 0.0, 'K': 3311.2,
-                        'K2O': 0.0, 'LOI1000': 0.0, 'LOI300-1000': 0.0, 'LOI371': 0.0, 'LOI425': 0.0, 'LOI650': 0.0,
-                        'La': 22.8093, 'La2O3': 0.0, 'Li': 0.0, 'Li2O': 0.0, 'Lu': 0.0991356, 'Lu2O3': 0.0, 'MOI300': 0.0, 
-                        'MassRec': 0.0, 'Mg': 2339.93, 'MgO': 0.0, 'Mn': 707.684, 'MnO': 0.0, 'Mo': 4.25585, 'Na': 0.0,
-                        'Na2O': 0.0, 'Nb': 0.0, 'Nb2O5': 0.0, 'Nd': 0.0, 'Nd2O3': 0.0, 'Ni': 48.7209, 'NiO': 0.0, 'Os': 0.0, 
-                        'P': 1027.94, 'P2O5': 0.0, 'Pb': 8.95167, 'PbO': 0.0, 'Pd': 0.0, 'Pr': 0.0, 'Pr6O11': 0.0, 'Pt': 0.0,
-                        'Rb': 12.574, 'Re': 0.0, 'Rh': 0.0, 'Ru': 0.0, 'S': 5009.09, 'S-(Sulphate)': 0.0, 'S-(Sulphide)': 0.0,
-                        'SG': 0.0, 'SO3': 0.0, 'Sb': 0.95799, 'Sc': 3.14983, 'Se': 5.34414, 'Si': 0.0, 'SiO2': 0.0, 'Sm': 0.0,
-                        'Sm2O3': 0.0, 'Sn': 0.0, 'SnO2': 0.0, 'Sr': 17.683, 'SrO': 0.0, 'Ta': 0.0, 'Ta2O5': 0.0, 'Tb': 0.468421,
-                        'Tb4O7': 0.0, 'Te': 0.0344281, 'Th': 6.3562, 'ThO2': 0.0, 'Ti': 82.2961, 'TiO2': 0.0, 'Tl': 0.137709,
-                        'Tm': 0.0, 'Tm2O3': 0.0, 'U': 3.23941, 'U3O8': 0.0, 'V': 13.2897, 'V2O5': 0.0, 'W': 0.531139, 'WO3': 0.0,
-                        'Y': 9.22846, 'Y2O3': 0.0, 'Yb': 0.687174, 'Yb2O3': 0.0, 'Zn': 21.341, 'ZnO': 0.0, 'Zr': 18.1508, 'ZrO2': 0.0}
-        # Install event filter for global Ctrl+V
+        try:
+            self.engine.set_crm_library(CRMLibrary.default())
+        except LIBRARY_ERRORS as e:
+            self.status_bar.showMessage(f"Using built-in CRM values ({DEFAULT_LIBRARY}: {e})")
+        self.update_crm_combo()
+        # Background autosave of the loaded sheet, every few edits
+        self.source_path = None
+        self.session_active = False
+        self.autosave = Autosaver(self.engine)
+        # Worker processes for "All" operations on large sheets; started on first use
+        self.pool = ColumnPool()
+        self.engine.add_listener(self.engine_changed.emit)
+        self.engine_changed.connect(self.autosave_edit)
+        self.model.modelReset.connect(self.autosave_edit) # column navigation
+        # Install event filter for global Ctrl+V, Ctrl+Z and Ctrl+Y
         self.installEventFilter(self)
     def eventFilter(self, source, event):
         if event.type() == QEvent.Type.KeyPress:
             key_event = event
-            if key_event.modifiers() == Qt.KeyboardModifier.ControlModifier and key_event.key() == Qt.Key.Key_V:
+            modifiers, key = key_event.modifiers(), key_event.key()
+            control = Qt.KeyboardModifier.ControlModifier
+            if modifiers == control and key == Qt.Key.Key_V:
                 self.paste_from_clipboard()
                 return True
+            if modifiers == control and key == Qt.Key.Key_Z:
+                self.undo()
+                return True
+            if (modifiers == control and key == Qt.Key.Key_Y) or \
+                    (modifiers == control | Qt.KeyboardModifier.ShiftModifier and key == Qt.Key.Key_Z):
+                self.redo()
+                return True
         return super().eventFilter(source, event)
-    def on_cell_changed(self, row, col):
-        if self.all_processed_mode:
-            # For all mode, update processed_columns and set base to None if edited
-            if col < 1:
-                return
-            col_index = col
-            item = self.table.item(row, col)
-            text = item.text().strip() if item else ""
-            try:
-                val = float(text) if text else None
-            except ValueError:
-                val = text if text else None
-            num_before = sum(1 for r in [self.crm_reference_row] if r is not None and r < row)
-            actual_row = row - num_before
-            if actual_row < len(self.processed_columns.get(col_index, [])):
-                old_val = self.processed_columns[col_index][actual_row]
-                self.processed_columns[col_index][actual_row] = val
-                if old_val != val and col_index in self.base_columns and self.base_columns[col_index][actual_row] is not None:
-                    self.base_columns[col_index][actual_row] = None
-        else:
-            # For single column mode
-            if col != 2:
-                return
-            item = self.table.item(row, col)
-            text = item.text().strip() if item else ""
-            try:
-                val = float(text) if text else None
-            except ValueError:
-                val = text if text else None
-            old_val = self.current_column_data.at[row, 'Modified']
-            self.current_column_data.at[row, 'Modified'] = val
-            if old_val != val and self.current_column_data.at[row, 'Base'] is not None:
-                self.current_column_data.at[row, 'Base'] = None
     def paste_from_clipboard(self):
+        """Paste a TSV block (e.g. copied from Excel) at the current cell, keeping its 2-D shape."""
+        if self.worker is not None:
+            return
         clipboard = QApplication.clipboard()
         mime_data = clipboard.mimeData()
         if not mime_data.hasText():
             return
-        text = mime_data.text()
-        rows = [row.split('\t') for row in text.split('\n') if row.strip()]
-        if not rows:
-            return
-        flat_values = []
-        for row in rows:
-            flat_values.extend([v.strip() for v in row if v.strip()])
-    
-        if not flat_values:
+        lines = mime_data.text().replace('\r\n', '\n').split('\n')
+        while lines and not lines[-1].strip():
+            lines.pop()
+        if not lines:
             return
+        rows = [line.split('\t') for line in lines]
+        width = max(len(row) for row in rows)
+        rows = [row + [''] * (width - len(row)) for row in rows]
         current = self.table.currentIndex()
-        if not current.isValid():
+        if not current.isValid() or self.model.element_column(current.column()) is None:
             return
-        start_row = current.row()
-        if self.all_processed_mode:
-            start_col = current.column()
-            if start_col < 1:
-                return
-            col_index = start_col
+        if self.model.all_columns:
+            # Block columns go to the element columns right of the current cell
+            columns = list(range(current.column(), self.model.columnCount()))
         else:
-            start_col = 2
-            col_index = self.current_column_index
-        num_rows = self.table.rowCount()
-        
-        for i, val_str in enumerate(flat_values):
-            row = start_row + i
-            if row >= num_rows:
-                break
-            try:
-                val = float(val_str)
-            except ValueError:
-                val = val_str
-            item = self.table.item(row, start_col)
-            if not item:
-                item = QTableWidgetItem()
-                self.table.setItem(row, start_col, item)
-            item.setText(str(val))
-            
-            num_before = sum(1 for r in [self.crm_reference_row] if r is not None and r < row)
-            actual_row = row - num_before
-            if self.all_processed_mode:
-                if actual_row < len(self.processed_columns.get(col_index, [])):
-                    self.processed_columns[col_index][actual_row] = val
-                    if col_index in self.base_columns:
-                        self.base_columns[col_index][actual_row] = None
-            else:
-                if actual_row < len(self.current_column_data):
-                    self.current_column_data.at[actual_row, 'Modified'] = val
-                    self.current_column_data.at[actual_row, 'Base'] = None
-        self.status_bar.showMessage("Pasted from clipboard")
+            columns = [self.current_column_index]
+        start_row = current.row()
+        with self.engine.transaction("Paste", SOURCE_USER):
+            num_rows, num_cols, skipped = self.engine.set_texts(start_row, columns, rows)
+        if not num_rows:
+            return
+        left = current.column() if self.model.all_columns else 2
+        self.model.refresh(start_row, left, start_row + num_rows - 1, left + num_cols - 1)
+        message = f"Pasted {num_rows} x {num_cols} cells from clipboard"
+        if skipped:
+            message += f" ({skipped} non-numeric values skipped)"
+        self.status_bar.showMessage(message)
+    def undo(self):
+        if self.worker is not None:
+            return
+        operation = self.engine.undo()
+        if operation is None:
+            self.status_bar.showMessage("Nothing to undo")
+            return
+        self.after_history_step()
+        self.status_bar.showMessage(f"Undone: {operation.label}")
+    def redo(self):
+        if self.worker is not None:
+            return
+        operation = self.engine.redo()
+        if operation is None:
+            self.status_bar.showMessage("Nothing to redo")
+            return
+        self.after_history_step()
+        self.status_bar.showMessage(f"Redone: {operation.label}")
+    def after_history_step(self):
+        self.update_limit_edit()
+        self.update_crm_combo() # undo/redo can swap the CRM library back
+        self.update_crm_strip()
+        self.update_clear_crm_button()
     def reset_data(self):
-        self.df = None
-        self.header_row = None
-        self.reserved_rows = {}
-        self.processed_columns = {}
-        self.base_columns = {}
+        self.session_active = False
+        self.engine.reset()
         self.current_column_index = 0
-        self.current_column_data = None
-        self.fixed_column = None
-        self.crm_original_row = None
-        self.crm_reference_row = None
-        self.crm_compared_columns = set()
         self.all_processed_mode = False
-        self.table.clear()
+        self.model.clear()
         self.prev_column_button.setEnabled(False)
         self.next_column_button.setEnabled(False)
         self.global_group.setEnabled(False)
         self.apply_limits_button.setEnabled(False)
+    def start_worker(self, label, fn, on_finished, on_failed=None, on_cancelled=None, on_progress=None):
+        """Run fn(worker) on the thread pool. The controls are locked until it ends;
+        the table stays scrollable and shows results as they come in."""
+        worker = Worker(fn)
+        worker.signals.progress.connect(on_progress or self.show_worker_progress)
+        for signal in (worker.signals.finished, worker.signals.failed, worker.signals.cancelled):
+            signal.connect(self.worker_done)
+        worker.signals.finished.connect(on_finished)
+        worker.signals.failed.connect(
+            on_failed or (lambda e: QMessageBox.critical(self, "Error", f"{label} failed: {str(e)}"))
+        )
+        worker.signals.cancelled.connect(on_cancelled or (lambda: self.status_bar.showMessage(f"{label} cancelled")))
+        self.worker = worker
+        self.worker_label = label
+        self.left_panel.setEnabled(False)
+        self.table.setEditTriggers(QTableView.EditTrigger.NoEditTriggers)
+        self.progress_bar.setRange(0, 0)
+        self.progress_bar.setVisible(True)
+        self.cancel_button.setEnabled(True)
+        self.cancel_button.setVisible(True)
+        self.status_bar.showMessage(f"{label}...")
+        QThreadPool.globalInstance().start(worker)
+    def worker_done(self, *args):
+        self.worker = None
+        self.left_panel.setEnabled(True)
+        self.table.setEditTriggers(QTableView.EditTrigger.DoubleClicked | QTableView.EditTrigger.AnyKeyPressed)
+        self.progress_bar.setVisible(False)
+        self.cancel_button.setVisible(False)
+    def cancel_worker(self):
+        if self.worker is not None:
+            self.worker.cancel()
+            self.cancel_button.setEnabled(False)
+            self.status_bar.showMessage(f"Cancelling {self.worker_label.lower()}...")
+    def show_worker_progress(self, done, total, columns):
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+        if columns:
+            self.model.refresh_columns(columns)
+        self.status_bar.showMessage(f"{self.worker_label}... {done}/{total}")
+    def run_columns(self, label, method, args, on_finished):
+        """Run engine.<method>(*args) (see parallel.OPERATIONS) in one transaction, then on_finished(result).
+
+        Up to COLUMN_BATCH columns run right away; "All" operations run on a
+        worker thread with progress, partial repaints and cancellation, and on
+        the process pool when the sheet is large enough.
+        """
+        if len(columns_of(method, args)) <= COLUMN_BATCH:
+            with self.engine.transaction(label):
+                result = getattr(self.engine, method)(*args)
+            on_finished(result)
+            return
+        pool = self.pool if self.pool.worth(self.engine, len(columns_of(method, args))) else None
+        self.start_worker(
+            label, lambda worker: combine(run_operation(worker, self.engine, label, method, args, pool)), on_finished
+        )
     def load_file(self):
         file_path, _ = QFileDialog.getOpenFileName(self, "Open File", "", "CSV/Excel (*.csv *.xlsx)")
         if file_path:
+            seed_text = self.seed_edit.text().strip()
+            if seed_text and not seed_text.isdigit():
+                QMessageBox.warning(self, "Error", "Seed must be a non-negative whole number.")
+                return
             self.reset_data()
-            try:
-                if file_path.endswith('.csv'):
-                    self.df = pd.read_csv(file_path, header=None)
-                else:
-                    self.df = pd.read_excel(file_path, header=None)
-               
-                # Row 1: element names (هدر اصلی)
-                self.header_row = self.df.iloc[1].copy()
-               
-                # Reserved rows: 2,3,4,5
-                self.reserved_rows = {
-                    2: self.df.iloc[2].copy(),
-                    3: self.df.iloc[3].copy(),
-                    4: self.df.iloc[4].copy(),
-                    5: self.df.iloc[5].copy()
-                }
-               
-                self.processing_df = self.df.iloc[6:].reset_index(drop=True)
-               
-                for col in self.processing_df.columns:
-                    self.processing_df[col] = self.processing_df[col].apply(self.clean_cell)
-               
-                self.fixed_column = self.processing_df.iloc[:, 0].values
-                self.next_column_button.setEnabled(True)
-                self.load_column(1)
-                self.status_bar.showMessage(f"Loaded file: {file_path}")
-            except Exception as e:
-                QMessageBox.critical(self, "Error", f"Failed to load file: {str(e)}")
-                self.status_bar.showMessage("Error loading file")
-    def clean_cell(self, cell):
-        if isinstance(cell, str):
-            if cell.startswith('<') or cell.startswith('>'):
-                return float(cell[1:])
-            elif cell.endswith('<') or cell.endswith('>'):
-                return float(cell[:-1])
-        return cell
+            self.engine.set_seed(int(seed_text) if seed_text else None)
+            self.seed_label.setText(f"Session seed: {self.engine.seed}")
+
+            def load(worker):
+                def on_chunk(rows_loaded):
+                    worker.check()
+                    worker.report(rows_loaded) # total unknown until the file is read
+                self.engine.load(file_path, on_chunk=on_chunk)
+                return file_path
+            self.start_worker(
+                "Loading", load, self.file_loaded,
+                on_failed=self.load_failed, on_cancelled=self.load_cancelled, on_progress=self.show_loading_progress
+            )
+    def file_loaded(self, file_path):
+        self.next_column_button.setEnabled(True)
+        self.load_column(1)
+        self.source_path = file_path
+        self.session_active = True
+        self.autosave.start()
+        self.autosave.save(self.view_state())
+        self.status_bar.showMessage(f"Loaded file: {file_path}")
+        if self.engine.load_errors:
+            QMessageBox.warning(
+                self, "Unparseable cells",
+                f"{len(self.engine.load_errors)} cells could not be read as numbers and were left empty:\n"
+                f"{self.engine.load_error_summary()}"
+            )
+    def load_failed(self, error):
+        self.reset_data()
+        QMessageBox.critical(self, "Error", f"Failed to load file: {str(error)}")
+        self.status_bar.showMessage("Error loading file")
+    def load_cancelled(self):
+        self.reset_data()
+        self.status_bar.showMessage("Loading cancelled")
+    def view_state(self):
+        """What the window needs besides the engine to resume a session."""
+        return {
+            'source': self.source_path,
+            'current_column_index': self.current_column_index,
+            'all_processed_mode': self.all_processed_mode,
+            'recipe': self.recipe.to_dict(),
+            'duplicate_pattern': self.dup_pattern_edit.text(),
+        }
+    def autosave_edit(self, *args):
+        if self.session_active:
+            self.autosave.edited(self.view_state())
+    def offer_resume(self):
+        """Ask to continue the autosaved session, if there is one."""
+        view = session_view()
+        if view is None:
+            return
+        saved_at = time.strftime('%Y-%m-%d %H:%M', time.localtime(view['saved_at']))
+        answer = QMessageBox.question(
+            self, "Resume Session",
+            f"Resume the unsaved session of {os.path.basename(view['source'] or '')} (autosaved {saved_at})?"
+        )
+        if answer == QMessageBox.StandardButton.Yes:
+            self.resume_session()
+        else:
+            self.autosave.discard()
+    def resume_session(self):
+        self.reset_data()
+        try:
+            view = restore(self.engine)
+        except NPZ_ERRORS as e:
+            self.engine.reset()
+            self.autosave.discard()
+            QMessageBox.warning(self, "Error", f"Failed to resume session: {str(e)}")
+            return
+        self.recipe = Recipe.from_dict(view['recipe'])
+        self.dup_pattern_edit.setText(view['duplicate_pattern'])
+        self.seed_label.setText(f"Session seed: {self.engine.seed}")
+        self.update_crm_combo()
+        self.source_path = view['source']
+        if view['all_processed_mode']:
+            self.current_column_index = view['current_column_index']
+            self.check_all_columns_processed()
+        else:
+            self.load_column(view['current_column_index'])
+        self.session_active = True
+        self.status_bar.showMessage(f"Resumed session: {self.source_path}")
+    def closeEvent(self, event):
+        if self.worker is not None:
+            self.worker.cancel()
+            QThreadPool.globalInstance().waitForDone()
+        if self.session_active:
+            self.autosave.save(self.view_state())
+        self.autosave.close()
+        self.pool.close(self.engine)
+        self.model.close()
+        super().closeEvent(event)
+    def show_loading_progress(self, rows_loaded, total, columns):
+        """Show the first element as soon as the first chunk of a large CSV is parsed."""
+        if self.worker is None or self.engine.original is None:
+            return # finished or cancelled meanwhile
+        self.model.invalidate() # rows were filled in underneath the cached views
+        if self.model.column_index is None and self.engine.num_columns > 1:
+            self.model.show_column(1)
+        else:
+            self.model.refresh()
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(rows_loaded)
+        self.status_bar.showMessage(f"Loading... {rows_loaded} rows")
     def get_current_element_name(self):
         """دریافت نام عنصر از سطر 1 (هدر)"""
-        if self.header_row is None or self.current_column_index >= len(self.header_row):
-            return "Unknown"
-        name = str(self.header_row.iloc[self.current_column_index]).strip()
-        return name if name else "Unknown"
+        return self.engine.get_element_name(self.current_column_index)
     def get_element_name(self, col_index):
-        if self.header_row is None or col_index >= len(self.header_row):
-            return "Unknown"
-        name = str(self.header_row.iloc[col_index]).strip()
-        return name if name else "Unknown"
+        return self.engine.get_element_name(col_index)
     def load_column(self, col_index):
-        if col_index < 1 or col_index >= len(self.processing_df.columns):
+        if col_index < 1 or col_index >= self.engine.num_columns:
             return
-       
-        col_data = self.processing_df.iloc[:, col_index].values
-        num_rows = len(self.fixed_column)
-       
-        modified = self.processed_columns.get(col_index, [None] * num_rows)
-        bases = self.base_columns.get(col_index, [None] * num_rows)
-        self.current_column_data = pd.DataFrame({
-            'Original': col_data,
-            'Modified': modified,
-            'Base': bases
-        })
-       
-        self.remove_crm_reference_row()
-       
-        self.table.setRowCount(num_rows)
-        self.table.setColumnCount(3)
-        self.table.setHorizontalHeaderLabels(['Fixed', 'Original', 'Modified'])
-       
-        for i in range(num_rows):
-            fixed_item = QTableWidgetItem(str(self.fixed_column[i]))
-            fixed_item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
-            self.table.setItem(i, 0, fixed_item)
-           
-            orig_val = self.current_column_data.at[i, 'Original']
-            if isinstance(orig_val, (int, float)) and not pd.isna(orig_val):
-                if orig_val == int(orig_val): # عدد صحیح است
-                    orig_text = str(int(orig_val))
-                else: # اعشار دارد
-                    orig_text = f"{orig_val:.2f}"
-            else:
-                orig_text = "" if pd.isna(orig_val) else str(orig_val)
-            orig_item = QTableWidgetItem(orig_text)
-           
-            orig_item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
-            self.table.setItem(i, 1, orig_item)
-           
-            mod_val = self.current_column_data.at[i, 'Modified']
-            mod_item = QTableWidgetItem(str(mod_val) if mod_val is not None else "")
-            mod_item.setFlags(Qt.ItemFlag.ItemIsEditable | Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
-            self.table.setItem(i, 2, mod_item)
-       
+
+        self.clear_all_crm()
         self.current_column_index = col_index
+        self.engine.mark_processed(col_index)
+        self.model.show_column(col_index)
         self.update_navigation_buttons()
-       
+
         # نمایش نام عنصر
         element_name = self.get_current_element_name()
         self.element_label.setText(f"Element: {element_name}")
         self.status_bar.showMessage(f"Loaded column {col_index}: {element_name}")
 
-        # Reset ratio and offset to defaults
-        self.ratio_spin.setValue(1.0)
-        self.offset_spin.setValue(0.0)
+        # Settings of this element from the recipe (defaults when it has none)
+        self.show_recipe_settings()
     def update_navigation_buttons(self):
         if self.all_processed_mode:
             self.prev_column_button.setEnabled(False)
@@ -529,46 +700,25 @@ class DataProcessor(QMainWindow):
             self.prev_column_button.setEnabled(self.current_column_index > 1)
             self.next_column_button.setEnabled(True)
     def next_column(self):
-        self.save_current_modified()
         next_index = self.current_column_index + 1
-        if next_index < len(self.processing_df.columns):
+        if next_index < self.engine.num_columns:
             self.load_column(next_index)
         else:
             self.check_all_columns_processed()
     def prev_column(self):
-        self.save_current_modified()
         self.load_column(self.current_column_index - 1)
-    def save_current_modified(self):
-        if self.all_processed_mode:
-            return
-        modified = []
-        bases = []
-        for i in range(self.table.rowCount()):
-            if self.crm_reference_row is not None and i == self.crm_reference_row:
-                continue
-            item = self.table.item(i, 2)
-            text = item.text().strip() if item else ""
-            try:
-                val = float(text) if text else None
-            except ValueError:
-                val = text if text else None
-            modified.append(val)
-            bases.append(self.current_column_data.at[i, 'Base'])
-        self.processed_columns[self.current_column_index] = modified
-        self.base_columns[self.current_column_index] = bases
-        self.current_column_data['Modified'] = modified
     def check_all_columns_processed(self):
-        num_columns = len(self.processing_df.columns) - 1 # excluding fixed column
-        if len(self.processed_columns) == num_columns:
+        if self.engine.all_columns_processed():
             self.global_group.setEnabled(True)
             self.apply_limits_button.setEnabled(True)
             self.column_combo.clear()
             self.column_combo.addItem("All", None)
-            for col_index in range(1, len(self.processing_df.columns)):
+            for col_index in self.engine.element_columns():
                 element_name = self.get_element_name(col_index)
                 self.column_combo.addItem(element_name, col_index)
             self.load_all_processed()
             self.all_processed_mode = True
+            self.show_recipe_settings()
             self.update_navigation_buttons()
             self.element_label.setText("All Elements")
             self.status_bar.showMessage("All columns processed. Showing all modified columns.")
@@ -576,400 +726,358 @@ class DataProcessor(QMainWindow):
             self.global_group.setEnabled(False)
             self.apply_limits_button.setEnabled(False)
     def load_all_processed(self):
-        self.table.clear()
-        num_rows = len(self.fixed_column)
-        num_cols = len(self.processing_df.columns) # fixed + modified columns (col 0 fixed, 1..n-1 modified)
-        self.table.setRowCount(num_rows)
-        self.table.setColumnCount(num_cols)
-        headers = ['Fixed']
-        for col_index in range(1, num_cols):
-            headers.append(self.get_element_name(col_index))
-        self.table.setHorizontalHeaderLabels(headers)
-        for i in range(num_rows):
-            fixed_item = QTableWidgetItem(str(self.fixed_column[i]))
-            fixed_item.setFlags(Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
-            self.table.setItem(i, 0, fixed_item)
-            for col_index in range(1, num_cols):
-                mod_val = self.processed_columns.get(col_index, [None] * num_rows)[i]
-                mod_item = QTableWidgetItem(str(mod_val) if mod_val is not None else "")
-                mod_item.setFlags(Qt.ItemFlag.ItemIsEditable | Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable)
-                self.table.setItem(i, col_index, mod_item)
-                
-    def fill_empty_cells(self):
+        self.model.show_all()
+
+    def target_columns(self):
+        """Columns an action applies to: the current element, or the column selector in all mode."""
+        if not self.all_processed_mode:
+            return [self.current_column_index]
+        col_data = self.column_combo.currentData()
+        return list(self.engine.element_columns()) if col_data is None else [col_data]
+
+    def recipe_element(self):
+        """Element whose settings the spin boxes show: the current column, or the
+        column selector in all mode; None edits the recipe defaults."""
+        if self.engine.original is None:
+            return None
         if self.all_processed_mode:
-            return  # Fill not available in all mode
+            col_data = self.column_combo.currentData()
+            return None if col_data is None else self.get_element_name(col_data)
+        return self.get_current_element_name()
 
-        min_val = self.min_spin.value()
-        max_val = self.max_spin.value()
-        offset = self.offset_spin.value()
-        ratio = self.ratio_spin.value()
+    def show_recipe_settings(self, *args):
+        element = self.recipe_element()
+        settings = self.recipe.settings(element) if element is not None else self.recipe.defaults
+        for key, widget in self.recipe_widgets().items():
+            widget.blockSignals(True)
+            if isinstance(widget, QCheckBox):
+                widget.setChecked(bool(settings[key]))
+            else:
+                widget.setValue(settings[key])
+            widget.blockSignals(False)
 
-        for i in range(len(self.current_column_data)):
-            original = self.current_column_data.at[i, 'Original']
-            modified = self.current_column_data.at[i, 'Modified']
-            base = self.current_column_data.at[i, 'Base']
+    def recipe_widgets(self):
+        return {
+            'min': self.min_spin, 'max': self.max_spin, 'ratio': self.ratio_spin, 'offset': self.offset_spin,
+            'apply_to_manual': self.apply_to_manual_checkbox,
+            'dup_range': self.global_dup_range_spin, 'crm_range': self.global_crm_range_spin,
+        }
 
-            if pd.isna(original) or not isinstance(original, (int, float)):
-                continue
+    def store_recipe_setting(self, key, value):
+        element = self.recipe_element()
+        if element is None:
+            self.recipe.defaults[key] = value
+        else:
+            self.recipe.set_element(element, **{key: value})
 
-            if base is not None:
-                # Regenerate for previous random-filled cells
-                rand_factor = random.uniform(min_val, max_val)
-                new_base = original * rand_factor
-                self.current_column_data.at[i, 'Base'] = new_base
-                new_val = (new_base * ratio) + offset
-                new_val = round(new_val, 2)
-                self.current_column_data.at[i, 'Modified'] = new_val
-                item = self.table.item(i, 2)
-                if item:
-                    item.setText(str(new_val))
-            elif modified is None:
-                # Fill new empty cells
-                rand_factor = random.uniform(min_val, max_val)
-                base = original * rand_factor
-                self.current_column_data.at[i, 'Base'] = base
-                new_val = (base * ratio) + offset
-                new_val = round(new_val, 2)
-                self.current_column_data.at[i, 'Modified'] = new_val
-                item = self.table.item(i, 2)
-                if not item:
-                    item = QTableWidgetItem()
-                    self.table.setItem(i, 2, item)
-                item.setText(str(new_val))
+    def recipe_vector(self, key, columns):
+        """One recipe setting per column, for engine calls over several columns."""
+        return self.recipe.vectors([self.get_element_name(col) for col in columns])[key]
 
-        self.status_bar.showMessage("Generated random values")
+    def load_recipe(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open Recipe", "", "Recipe (*.json *.toml)")
+        if not file_path:
+            return
+        try:
+            self.recipe = Recipe.load(file_path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Error", f"Failed to load recipe: {str(e)}")
+            return
+        options = self.recipe.options
+        self.dup_pattern_edit.setText(options['duplicate_pattern'] or DUPLICATE_PATTERN)
+        try:
+            if options['crm_library'] and os.path.exists(options['crm_library']):
+                self.engine.set_crm_library(CRMLibrary.load(options['crm_library']))
+            if options['crm_name']:
+                self.engine.select_crm(options['crm_name'])
+        except LIBRARY_ERRORS as e:
+            QMessageBox.warning(self, "Error", f"Recipe CRM settings not applied: {str(e)}")
+        self.crm_library_changed()
+        self.show_recipe_settings()
+        self.status_bar.showMessage(
+            f"Loaded recipe {os.path.basename(file_path)} ({len(self.recipe.elements)} elements)"
+        )
 
-    def apply_ratio_offset_to_filled(self):
-        if self.all_processed_mode or self.current_column_data is None:
+    def save_recipe(self):
+        file_path, _ = QFileDialog.getSaveFileName(self, "Save Recipe", "", "JSON (*.json);;TOML (*.toml)")
+        if not file_path:
             return
+        options = self.recipe.options
+        pattern = self.dup_pattern_edit.text()
+        options['duplicate_pattern'] = None if pattern == DUPLICATE_PATTERN else pattern
+        options['crm_library'] = self.engine.crm_library.source
+        options['crm_name'] = self.engine.crm_name()
+        try:
+            self.recipe.save(file_path)
+        except (OSError, ValueError) as e:
+            QMessageBox.warning(self, "Error", f"Failed to save recipe: {str(e)}")
+            return
+        self.status_bar.showMessage(f"Saved recipe: {file_path}")
+
+    def apply_recipe(self):
+        if self.engine.original is None:
+            return
+        columns = np.array(self.engine.element_columns())
+        self.run_columns(
+            "Applying recipe", 'apply_recipe', (self.recipe, columns),
+            lambda filled: self.status_bar.showMessage(f"Applied recipe to {len(columns)} columns ({filled} cells filled)")
+        )
 
-        ratio = self.ratio_spin.value()
-        offset = self.offset_spin.value()
+    def fill_empty_cells(self):
+        if self.engine.original is None:
+            return
 
-        for i in range(len(self.current_column_data)):
-            base = self.current_column_data.at[i, 'Base']
-            modified = self.current_column_data.at[i, 'Modified']
+        # Vectorized passes over the target columns, each with its own recipe settings
+        columns = np.asarray(self.target_columns())
+        settings = [self.recipe_vector(key, columns) for key in ('min', 'max', 'ratio', 'offset')]
+        self.run_columns(
+            "Generating random values", 'fill_empty_cells', (columns, *settings),
+            lambda filled: self.status_bar.showMessage("Generated random values")
+        )
 
-            if base is not None:
-                new_val = (base * ratio) + offset
-                new_val = round(new_val, 2)
-                self.current_column_data.at[i, 'Modified'] = new_val
-                item = self.table.item(i, 2)
-                if item:
-                    item.setText(str(new_val))
-            elif self.apply_to_manual_checkbox.isChecked() and modified is not None and isinstance(modified, (int, float)):
-                new_val = (modified * ratio) + offset
-                new_val = round(new_val, 2)
-                self.current_column_data.at[i, 'Modified'] = new_val
-                item = self.table.item(i, 2)
-                if item:
-                    item.setText(str(new_val))
+    def apply_ratio_offset_to_filled(self):
+        if self.all_processed_mode or self.engine.original is None:
+            return
 
+        with self.engine.transaction("Ratio/offset"):
+            self.engine.apply_ratio_offset(
+                self.current_column_index,
+                self.ratio_spin.value(),
+                self.offset_spin.value(),
+                self.apply_to_manual_checkbox.isChecked()
+            )
         self.status_bar.showMessage("Applied ratio and offset to filled cells")
 
+    def selected_indexes(self):
+        return self.table.selectionModel().selectedIndexes()
+
+    def selected_original_rows(self, table_col=None):
+        return {
+            index.row() for index in self.selected_indexes()
+            if table_col is None or index.column() == table_col
+        }
+
     def global_check_duplicates(self):
         col_data = self.column_combo.currentData()
         if col_data is None:
-            for col_index in range(1, len(self.processing_df.columns)):
-                self.check_duplicates(col_index)
+            self.check_duplicates(np.asarray(self.engine.element_columns()), None)
         else:
-            self.check_duplicates(col_data)
+            self.check_duplicates(np.array([col_data]), self.model.modified_column(col_data))
 
-    def check_duplicates(self, col_index):
-        table_col = 2 if not self.all_processed_mode else col_index
-        selected_items = self.table.selectedItems()
-        if not selected_items:
-            self.status_bar.showMessage("No rows selected for duplicates")
-            return
+    def selected_group(self, table_col, action):
+        """Rows of the selected cells as one duplicate group, or None after showing why not.
 
-        # فقط سلول‌های ستون Modified
-        selected_rows = {
-            item.row() for item in selected_items
-            if item.column() == table_col and item.row() != self.crm_reference_row
-        }
+        table_col restricts the selection to one table column; None takes the
+        rows of every selected cell.
+        """
+        if not self.selected_indexes():
+            self.status_bar.showMessage(f"No rows selected for {action}")
+            return None
 
-        if not selected_rows:
+        # فقط سلول‌های ستون Modified
+        orig_selected_rows = self.selected_original_rows(table_col)
+        if not orig_selected_rows:
             self.status_bar.showMessage("No valid cells selected in the target column")
+            return None
+        return sorted(orig_selected_rows)
+
+    def check_duplicates(self, columns, table_col):
+        """Check the selected row group in all given columns with one engine call."""
+        rows = self.selected_group(table_col, "duplicates")
+        if rows is None:
             return
 
-        # تبدیل به ایندکس اصلی در processing_df
-        orig_selected_rows = set()
-        for table_row in selected_rows:
-            if self.all_processed_mode and self.crm_reference_row is not None:
-                orig_row = table_row - 1 if table_row > self.crm_reference_row else table_row
-            else:
-                orig_row = table_row
-            orig_selected_rows.add(orig_row)
+        def checked(result):
+            _, out_of_range = result
+            self.status_bar.showMessage(
+                f"Checked duplicates: {int(out_of_range.sum())} values out of range in "
+                f"{int(out_of_range.any(axis=0).sum())} of {len(columns)} columns"
+            )
+        self.run_columns(
+            "Checking duplicates", 'check_duplicate_groups', ([rows], columns, self.recipe_vector('dup_range', columns)),
+            checked
+        )
 
-        # استفاده از processed_columns (مقادیر Modified) به جای processing_df
-        modified_values = self.processed_columns.get(col_index, [])
-        values = []
-        for orig_row in orig_selected_rows:
-            if orig_row < len(modified_values):
-                val = modified_values[orig_row]
-                if val is not None and isinstance(val, (int, float)):
-                    values.append(val)
+    def global_fix_duplicates(self):
+        col_data = self.column_combo.currentData()
+        if col_data is None:
+            self.fix_duplicates(np.asarray(self.engine.element_columns()), None)
+        else:
+            self.fix_duplicates(np.array([col_data]), self.model.modified_column(col_data))
 
-        if not values:
-            self.status_bar.showMessage("No valid numeric values in selected modified cells")
+    def fix_duplicates(self, columns, table_col):
+        """Fix the selected row group in all given columns, like check_duplicates."""
+        rows = self.selected_group(table_col, "fixing duplicates")
+        if rows is None:
             return
+        self.run_columns(
+            "Fixing duplicates", 'fix_duplicate_groups',
+            ([rows], columns, self.recipe_vector('min', columns), self.recipe_vector('max', columns)),
+            lambda result: self.status_bar.showMessage(f"Fixed {int(result[0].sum())} duplicate values")
+        )
 
-        print("check duplicate (Modified): ", values)
-        mean_val = sum(values) / len(values)
-        dup_range = self.global_dup_range_spin.value()
-        light_yellow = QColor(255, 255, 150)
-        light_red = QColor(255, 180, 180)
+    def duplicate_groups(self):
+        """Duplicate groups found from the sample names, or None after showing why not."""
+        try:
+            groups = self.engine.find_duplicate_groups(self.dup_pattern_edit.text())
+        except re.error as e:
+            QMessageBox.warning(self, "Error", f"Invalid duplicate suffix pattern: {e}")
+            return None
+        if not groups:
+            self.status_bar.showMessage("No duplicate samples found by name")
+            return None
+        return groups
 
-        # رنگ زرد برای همه سطرهای انتخاب‌شده
-        for orig_row in orig_selected_rows:
-            table_row = self.get_table_row_from_original(orig_row)
-            if table_row < self.table.rowCount():
-                item = self.table.item(table_row, table_col)
-                fixed_item = self.table.item(table_row, 0)
-                if item:
-                    item.setBackground(QBrush(light_yellow))
-                if fixed_item:
-                    fixed_item.setBackground(QBrush(light_yellow))
+    def auto_check_duplicates(self):
+        groups = self.duplicate_groups()
+        if groups is None:
+            return
+        columns = np.asarray(self.target_columns())
+        groups = list(groups.values())
 
-        # رنگ قرمز برای مقادیر خارج از محدوده
-        for orig_row in orig_selected_rows:
-            if orig_row >= len(modified_values):
-                continue
-            val = modified_values[orig_row]
-            if val is not None and isinstance(val, (int, float)) and abs(val - mean_val) > mean_val * dup_range:
-                table_row = self.get_table_row_from_original(orig_row)
-                if table_row < self.table.rowCount():
-                    item = self.table.item(table_row, table_col)
-                    fixed_item = self.table.item(table_row, 0)
-                    if item:
-                        item.setBackground(QBrush(light_red))
-                    if fixed_item:
-                        fixed_item.setBackground(QBrush(light_red))
+        def checked(result):
+            _, out_of_range = result
+            self.status_bar.showMessage(
+                f"Checked {len(groups)} duplicate groups: {int(out_of_range.sum())} values out of range in "
+                f"{int(out_of_range.any(axis=0).sum())} of {len(columns)} columns"
+            )
+        self.run_columns(
+            "Checking duplicates", 'check_duplicate_groups', (groups, columns, self.recipe_vector('dup_range', columns)),
+            checked
+        )
 
-        self.status_bar.showMessage(f"Checked duplicates: {len(values)} values")
+    def auto_fix_duplicates(self):
+        groups = self.duplicate_groups()
+        if groups is None:
+            return
+        columns = np.asarray(self.target_columns())
+        groups = list(groups.values())
+        self.run_columns(
+            "Fixing duplicates", 'fix_duplicate_groups',
+            (groups, columns, self.recipe_vector('min', columns), self.recipe_vector('max', columns)),
+            lambda result: self.status_bar.showMessage(f"Fixed {int(result[0].sum())} duplicate values in {len(groups)} groups")
+        )
 
-    def global_fix_duplicates(self):
-        col_data = self.column_combo.currentData()
-        if col_data is None:
-            for col_index in range(1, len(self.processing_df.columns)):
-                self.fix_duplicates(col_index)
-        else:
-            self.fix_duplicates(col_data)
-    def fix_duplicates(self, col_index):
-        table_col = 2 if not self.all_processed_mode else col_index
-        selected_items = self.table.selectedItems()
-        if not selected_items:
-            self.status_bar.showMessage("No rows selected for fixing duplicates")
+    def clear_all_crm(self):
+        if self.engine.crm_original_row is None:
             return
-       
-        selected_rows = set(item.row() for item in selected_items if item.column() == table_col and item.row() != self.crm_reference_row)
-        orig_selected_rows = {self.get_original_row_from_table(row) for row in selected_rows}
-        originals = self.processing_df.iloc[:, col_index]
-        values = [originals[row] for row in orig_selected_rows
-                  if originals[row] is not None and isinstance(originals[row], (int, float))]
-        if not values:
+        with self.engine.transaction("Clear CRM"):
+            self.engine.clear_crm()
+        self.update_crm_strip()
+        self.global_clear_crm_button.setEnabled(False)
+    def update_crm_strip(self, *args):
+        """Show the CRM of the current row if it is a CRM sample, else the first CRM row."""
+        current = self.table.currentIndex().row()
+        row = current if current in self.engine.crm_rows else self.engine.crm_original_row
+        self.crm_model.set_crm_row(row)
+        self.crm_strip.setVisible(row is not None)
+    def sync_crm_strip(self):
+        self.crm_strip.verticalHeader().setFixedWidth(self.table.verticalHeader().width())
+        for section in range(self.model.columnCount()):
+            self.crm_strip.setColumnWidth(section, self.table.columnWidth(section))
+    def update_crm_combo(self):
+        self.crm_combo.blockSignals(True)
+        self.crm_combo.clear()
+        self.crm_combo.addItems(self.engine.crm_library.names)
+        self.crm_combo.setCurrentIndex(self.engine.crm_index)
+        self.crm_combo.blockSignals(False)
+    def select_crm(self, name):
+        if name:
+            self.engine.select_crm(name)
+    def load_crm_library(self):
+        file_path, _ = QFileDialog.getOpenFileName(self, "Open CRM Library", "", "CSV/Excel (*.csv *.xlsx)")
+        if not file_path:
             return
-        mean_val = sum(values) / len(values)
-       
-        min_val = self.min_spin.value()
-        max_val = self.max_spin.value()
-       
-        light_red = QColor(255, 180, 180)
-        light_green = QColor(180, 255, 180)
-        for table_row in selected_rows:
-            orig_row = self.get_original_row_from_table(table_row)
-            mod_item = self.table.item(table_row, table_col)
-            orig_val = originals[orig_row]
-            if mod_item and mod_item.background().color() == light_red:
-                rand_factor = random.uniform(min_val, max_val)
-                new_val = round(mean_val * rand_factor, 2)
-                self.processed_columns[col_index][orig_row] = new_val
-                mod_item.setText(str(new_val))
-                mod_item.setBackground(QBrush(light_green))
-                self.table.item(table_row, 0).setBackground(QBrush(light_green))
-            else:
-                mod_val = self.processed_columns[col_index][orig_row]
-                if mod_val is None and orig_val is not None:
-                    self.processed_columns[col_index][orig_row] = orig_val
-                    mod_item.setText(str(orig_val))
-        self.status_bar.showMessage("Fixed duplicates")
-    def remove_crm_reference_row(self):
-        if self.crm_reference_row is None:
+        try:
+            library = CRMLibrary.load(file_path)
+        except LIBRARY_ERRORS as e:
+            QMessageBox.warning(self, "Error", f"Failed to load CRM library: {str(e)}")
             return
-        self.table.removeRow(self.crm_reference_row)
-        self.crm_reference_row = None
-        self.crm_original_row = None
-        self.crm_compared_columns.clear()
-        self.global_clear_crm_button.setEnabled(False)
+        self.engine.set_crm_library(library)
+        self.crm_library_changed()
+        self.status_bar.showMessage(f"Loaded {len(library)} CRMs from {os.path.basename(file_path)}")
+    def crm_library_changed(self):
+        """Redraw everything showing CRM values or comparisons after set_crm_library cleared them."""
+        self.model.invalidate()
+        self.model.refresh()
+        self.update_crm_strip()
+        self.update_crm_combo()
+        self.update_clear_crm_button()
     def global_compare_with_crm(self):
         col_data = self.column_combo.currentData()
-        if col_data is None:
-            selected_items = self.table.selectedItems()
-            if not selected_items:
-                QMessageBox.warning(self, "Error", "Please select at least one row.")
-                return
-            selected_rows = set(item.row() for item in selected_items)
-            if len(selected_rows) != 1:
-                QMessageBox.warning(self, "Error", "Please select exactly one row for CRM comparison.")
-                return
-            table_crm_row = next(iter(selected_rows))
-            crm_row = self.get_original_row_from_table(table_crm_row)
-            if self.crm_original_row is None:
-                self.crm_original_row = crm_row
-            elif self.crm_original_row != crm_row:
-                QMessageBox.warning(self, "Error", "CRM row must be the same for all columns.")
-                return
-            if self.crm_reference_row is None:
-                insert_row = table_crm_row + 1
-                self.table.insertRow(insert_row)
-                self.crm_reference_row = insert_row
-                fixed_item = QTableWidgetItem("CRM 903")
-                fixed_item.setBackground(QBrush(QColor(200, 200, 255)))
-                fixed_item.setFlags(Qt.ItemFlag.ItemIsEnabled)
-                self.table.setItem(insert_row, 0, fixed_item)
-            else:
-                insert_row = self.crm_reference_row
-            for col_index in range(1, len(self.processing_df.columns)):
-                self.compare_with_crm_single(col_index, crm_row, insert_row)
-            self.global_clear_crm_button.setEnabled(True)
-        else:
-            table_col = 2 if not self.all_processed_mode else col_data
-            selected_items = self.table.selectedItems()
-            if not selected_items:
-                QMessageBox.warning(self, "Error", "Please select at least one row.")
-                return
-            selected_rows = set(item.row() for item in selected_items if item.column() == table_col and item.row() != self.crm_reference_row)
-            if len(selected_rows) != 1:
-                QMessageBox.warning(self, "Error", "Please select exactly one row for CRM comparison.")
-                return
-            table_crm_row = next(iter(selected_rows))
-            crm_row = self.get_original_row_from_table(table_crm_row)
-            if self.crm_original_row is None:
-                self.crm_original_row = crm_row
-            elif self.crm_original_row != crm_row:
-                QMessageBox.warning(self, "Error", "CRM row must be the same for all columns.")
-                return
-            if self.crm_reference_row is None:
-                insert_row = table_crm_row + 1
-                self.table.insertRow(insert_row)
-                self.crm_reference_row = insert_row
-                fixed_item = QTableWidgetItem("CRM 903")
-                fixed_item.setBackground(QBrush(QColor(200, 200, 255)))
-                fixed_item.setFlags(Qt.ItemFlag.ItemIsEnabled)
-                self.table.setItem(insert_row, 0, fixed_item)
-            else:
-                insert_row = self.crm_reference_row
-            self.compare_with_crm_single(col_data, crm_row, insert_row)
-            self.global_clear_crm_button.setEnabled(True)
-    def compare_with_crm_single(self, col_index, crm_row, insert_row):
-        if col_index in self.crm_compared_columns:
+        if not self.selected_indexes():
+            QMessageBox.warning(self, "Error", "Please select at least one row.")
             return
-        element_name = self.get_element_name(col_index)
-        if element_name not in self.crm_903:
+        table_col = None if col_data is None else self.model.modified_column(col_data)
+        crm_rows = self.selected_original_rows(table_col)
+        if not crm_rows:
+            QMessageBox.warning(self, "Error", "Please select the CRM row(s) in the selected column.")
             return
-        crm_903_val = self.crm_903[element_name]
-        originals = self.processing_df.iloc[:, col_index]
-        crm_original = originals[crm_row]
-        if crm_original is None or not isinstance(crm_original, (int, float)):
+        # Hand-picked rows are compared with the CRM chosen in the selector
+        self.compare_crm_rows({row: self.engine.crm_index for row in crm_rows})
+    def auto_compare_with_crm(self):
+        crm_rows = self.engine.find_crm_rows()
+        if not crm_rows:
+            self.status_bar.showMessage("No CRM samples found by name")
             return
-        crm_range = self.global_crm_range_spin.value()
-        light_green = QColor(180, 255, 180)
-        light_red = QColor(255, 180, 180)
-        table_col = 2 if not self.all_processed_mode else col_index
-        table_crm_row = self.get_table_row_from_original(crm_row)
-        if not self.all_processed_mode:
-            orig_item = QTableWidgetItem(str(crm_903_val))
-            orig_item.setBackground(QBrush(QColor(200, 200, 255)))
-            orig_item.setFlags(Qt.ItemFlag.ItemIsEnabled)
-            self.table.setItem(insert_row, 1, orig_item)
-            mod_item = QTableWidgetItem("")
-            mod_item.setBackground(QBrush(QColor(200, 200, 255)))
-            mod_item.setFlags(Qt.ItemFlag.ItemIsEnabled)
-            self.table.setItem(insert_row, 2, mod_item)
-        else:
-            crm_item = QTableWidgetItem(str(crm_903_val))
-            crm_item.setBackground(QBrush(QColor(200, 200, 255)))
-            crm_item.setFlags(Qt.ItemFlag.ItemIsEnabled)
-            self.table.setItem(insert_row, col_index, crm_item)
-        mod_item = self.table.item(table_crm_row, table_col)
-        if mod_item:
-            try:
-                mod_val = float(mod_item.text())
-                if abs(mod_val - crm_903_val) <= crm_903_val * crm_range:
-                    color = light_green
-                else:
-                    color = light_red
-                mod_item.setBackground(QBrush(color))
-                self.table.item(table_crm_row, 0).setBackground(QBrush(color))
-            except ValueError:
-                pass
-        self.crm_compared_columns.add(col_index)
-        self.status_bar.showMessage("Compared with CRM 903")
+        self.compare_crm_rows(crm_rows)
+    def compare_crm_rows(self, crm_rows):
+        columns = self.target_columns()
+        with self.engine.transaction("Compare with CRM"):
+            rows, recovery = self.engine.compare_crm_rows(crm_rows, columns, self.recipe_vector('crm_range', columns))
+        self.update_crm_strip()
+        self.update_clear_crm_button()
+        names = sorted({self.engine.crm_name(row) for row in rows})
+        out_of_range = int((self.engine.crm_status[rows] == STATUS_OUT_OF_RANGE).sum())
+        self.status_bar.showMessage(
+            f"Compared {len(rows)} CRM rows ({', '.join(names)}): {out_of_range} values out of range"
+        )
     def global_fix_crm_differences(self):
-        col_data = self.column_combo.currentData()
-        if col_data is None:
-            for col_index in range(1, len(self.processing_df.columns)):
-                self.fix_crm_differences(col_index)
-        else:
-            self.fix_crm_differences(col_data)
-    def fix_crm_differences(self, col_index):
-        if self.crm_original_row is None or col_index not in self.crm_compared_columns:
-            QMessageBox.warning(self, "Error", "No CRM comparison done for this column.")
-            return
-       
-        table_col = 2 if not self.all_processed_mode else col_index
-        element_name = self.get_element_name(col_index)
-        if element_name not in self.crm_903:
+        columns = np.asarray(self.target_columns())
+
+        def fixed(count):
+            if not count:
+                QMessageBox.warning(self, "Error", "No CRM comparison done for this column.")
+                return
+            self.status_bar.showMessage("Fixed CRM differences")
+        self.run_columns(
+            "Fixing CRM differences", 'fix_crm_cells', (columns, self.recipe_vector('crm_range', columns)), fixed
+        )
+    def show_crm_recovery(self):
+        recovery = self.engine.crm_recovery() if self.engine.crm_compared is not None else None
+        if recovery is None or recovery.empty:
+            QMessageBox.information(self, "CRM Recovery", "No CRM comparison done yet.")
             return
-       
-        crm_903_val = self.crm_903[element_name]
-        crm_range = self.global_crm_range_spin.value()
-        min_factor = 1.0 - crm_range
-        max_factor = 1.0 + crm_range
-        light_green = QColor(180, 255, 180)
-        rand_factor = random.uniform(min_factor, max_factor)
-        new_val = round(crm_903_val * rand_factor, 2)
-        self.processed_columns[col_index][self.crm_original_row] = new_val
-        table_crm_row = self.get_table_row_from_original(self.crm_original_row)
-        mod_item = self.table.item(table_crm_row, table_col)
-        if mod_item is None:
-            mod_item = QTableWidgetItem()
-            self.table.setItem(table_crm_row, table_col, mod_item)
-        mod_item.setText(str(new_val))
-        mod_item.setBackground(QBrush(light_green))
-        self.table.item(table_crm_row, 0).setBackground(QBrush(light_green))
-        self.status_bar.showMessage("Fixed CRM differences")
+        box = QMessageBox(self)
+        box.setWindowTitle("CRM Recovery (%)")
+        box.setText(recovery.round(1).T.to_string())
+        box.setStyleSheet("QLabel { font-family: monospace; }")
+        box.exec()
     def global_clear_crm_row(self):
         col_data = self.column_combo.currentData()
         if col_data is None:
-            self.remove_crm_reference_row()
+            self.clear_all_crm()
         else:
             self.clear_crm_column(col_data)
         self.update_clear_crm_button()
     def clear_crm_column(self, col_index):
-        if self.crm_original_row is None or col_index not in self.crm_compared_columns:
+        if self.engine.crm_original_row is None or col_index not in self.engine.crm_compared_columns:
             return
-        table_col = 2 if not self.all_processed_mode else col_index
-        table_crm_row = self.get_table_row_from_original(self.crm_original_row)
-        self.table.item(table_crm_row, table_col).setBackground(QBrush(QColor("white")))
-        self.table.item(table_crm_row, 0).setBackground(QBrush(QColor("white")))
-        if not self.all_processed_mode:
-            self.table.item(table_crm_row, 1).setBackground(QBrush(QColor("white")))
-        self.table.setItem(self.crm_reference_row, table_col, QTableWidgetItem(""))
-        self.crm_compared_columns.remove(col_index)
-        if not self.crm_compared_columns:
-            self.remove_crm_reference_row()
+        with self.engine.transaction("Clear CRM"):
+            self.engine.clear_crm(col_index)
+        self.update_crm_strip()
         self.status_bar.showMessage("Cleared CRM for column")
     def update_clear_crm_button(self):
         col_data = self.column_combo.currentData()
         if col_data is None:
-            self.global_clear_crm_button.setEnabled(self.crm_reference_row is not None)
+            self.global_clear_crm_button.setEnabled(self.engine.crm_original_row is not None)
         else:
-            self.global_clear_crm_button.setEnabled(col_data in self.crm_compared_columns)
+            self.global_clear_crm_button.setEnabled(col_data in self.engine.crm_compared_columns)
     def apply_limits_to_all(self):
-        for col_index in range(1, len(self.processing_df.columns)):
-            self.apply_limits_to_column(col_index)
-        self.status_bar.showMessage("Applied limits to all columns")
+        self.run_columns(
+            "Applying limits", 'apply_limits', (np.array(self.engine.element_columns()),),
+            lambda below: self.status_bar.showMessage(f"Applied limits to all columns ({below} values below limit)")
+        )
     def global_apply_limits(self):
         col_data = self.column_combo.currentData()
         if col_data is None:
@@ -977,83 +1085,82 @@ class DataProcessor(QMainWindow):
         else:
             self.apply_limits_to_column(col_data)
     def apply_limits_to_column(self, col_index):
-        limit_row = self.reserved_rows[3]
-        limit_val = limit_row[col_index] if not pd.isna(limit_row[col_index]) else None
-        if limit_val is None or not isinstance(limit_val, (int, float)):
-            return
-        mods = self.processed_columns[col_index]
-        table_col = 2 if not self.all_processed_mode else col_index
-        for i in range(len(mods)):
-            mod_val = mods[i]
-            if mod_val is not None and isinstance(mod_val, (int, float)):
-                if mod_val < limit_val:
-                    new_val = f"<{limit_val}"
-                    mods[i] = new_val
-                    table_row = self.get_table_row_from_original(i)
-                    item = self.table.item(table_row, table_col)
-                    if item:
-                        item.setText(new_val)
+        with self.engine.transaction("Apply limits"):
+            self.engine.apply_limits_to_column(col_index)
         self.status_bar.showMessage(f"Applied limits to column: {self.get_element_name(col_index)}")
+    def update_limit_edit(self, *args):
+        col_data = self.column_combo.currentData()
+        self.limit_edit.setEnabled(col_data is not None)
+        limit_val = None if col_data is None else self.engine.limit_value(col_data)
+        self.limit_edit.setText("" if limit_val is None else f"{limit_val:g}")
+    def edit_limit(self):
+        col_data = self.column_combo.currentData()
+        if col_data is None:
+            return
+        text = self.limit_edit.text().strip()
+        try:
+            limit_val = float(text) if text else None
+        except ValueError:
+            QMessageBox.warning(self, "Error", "Limit must be a number.")
+            self.update_limit_edit()
+            return
+        if limit_val == self.engine.limit_value(col_data):
+            return
+        with self.engine.transaction("Edit limit"):
+            self.engine.set_limit(col_data, limit_val)
+        self.status_bar.showMessage(f"Limit of {self.get_element_name(col_data)} set to {text or 'none'}")
+    def clear_limits(self):
+        col_data = self.column_combo.currentData()
+        columns = self.engine.element_columns() if col_data is None else [col_data]
+        with self.engine.transaction("Remove limits"):
+            self.engine.clear_limits(columns)
+        self.status_bar.showMessage("Removed limits")
 
-    def get_table_row_from_original(self, orig_row):
-        if not self.all_processed_mode:
-            return orig_row
-        if self.crm_reference_row is None:
-            return orig_row
-        # در حالت all_processed، همه سطرهای بعد از crm_original_row یک واحد بالا میان
-        shift = 1 if orig_row > self.crm_original_row else 0
-        return orig_row + shift
-
-    def get_original_row_from_table(self, table_row):
-        if not self.all_processed_mode or self.crm_reference_row is None:
-            return table_row
-        return table_row - 1 if table_row > self.crm_reference_row else table_row
     def finalize_data(self):
-        if self.all_processed_mode:
-            self.save_all_modified()
-        else:
-            self.save_current_modified()
-        num_columns = len(self.processing_df.columns) - 1
-        if len(self.processed_columns) != num_columns:
+        if not self.engine.all_columns_processed():
             QMessageBox.warning(self, "Error", "Process all columns first.")
             return
-       
-        for col_index, col_data in self.processed_columns.items():
-            self.processing_df.iloc[:, col_index] = col_data
-       
-        full_df = pd.DataFrame(columns=self.df.columns, index=range(len(self.df)))
-        full_df.iloc[1] = self.header_row # بازگرداندن هدر اصلی (سطر 1)
-        full_df.iloc[2] = self.reserved_rows[2]
-        full_df.iloc[3] = self.reserved_rows[3]
-        full_df.iloc[4] = self.reserved_rows[4]
-        full_df.iloc[5] = self.reserved_rows[5]
-        full_df.iloc[6:] = self.processing_df.values
-       
-        save_path, _ = QFileDialog.getSaveFileName(self, "Save File", "", "Excel (*.xlsx)")
+
+        save_path, _ = QFileDialog.getSaveFileName(
+            self, "Save File", "", "Excel (*.xlsx);;CSV (*.csv);;Parquet (*.parquet);;Arrow IPC (*.arrow)"
+        )
         if save_path:
-            full_df.to_excel(save_path, index=False, header=False)
-            QMessageBox.information(self, "Saved", "File saved successfully.")
-            self.status_bar.showMessage(f"Saved file: {save_path}")
-    def save_all_modified(self):
-        if not self.all_processed_mode:
-            return
-        original_num_rows = len(self.fixed_column)
-        for col_index in range(1, self.table.columnCount()):
-            modified = []
-            for i in range(self.table.rowCount()):
-                if self.crm_reference_row is not None and i == self.crm_reference_row:
-                    continue
-                item = self.table.item(i, col_index)
-                text = item.text().strip() if item else ""
+            def save(worker):
+                def progress(rows_written, total):
+                    worker.check()
+                    worker.report(rows_written, total)
                 try:
-                    val = float(text) if text else None
-                except ValueError:
-                    val = text if text else None
-                modified.append(val)
-            self.processed_columns[col_index] = modified
+                    self.engine.save(save_path, progress=progress)
+                except Cancelled:
+                    # Don't leave half a file behind
+                    if os.path.exists(save_path):
+                        os.remove(save_path)
+                    raise
+                return save_path
+            self.start_worker("Saving", save, self.file_saved, on_failed=self.save_failed)
+    def file_saved(self, save_path):
+        QMessageBox.information(self, "Saved", f"File saved successfully (seed {self.engine.seed}).")
+        self.status_bar.showMessage(f"Saved file: {save_path}")
+    def save_failed(self, error):
+        if isinstance(error, ImportError):
+            QMessageBox.warning(self, "Error", f"This format needs an extra package: {error.name}")
+        else:
+            QMessageBox.critical(self, "Error", f"Failed to save file: {str(error)}")
+        self.status_bar.showMessage("Error saving file")
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        if sys.stdout is not None:
+            from batch import main as batch_main
+            sys.exit(batch_main(sys.argv[2:]))
+        # The windowed build has no console for the run summary or argparse errors
+        app = QApplication(sys.argv)
+        QMessageBox.critical(None, "Batch mode", "Batch mode reports to a console: run melimess-batch instead, e.g.\n"
+                             "melimess-batch <indir> <outdir> --recipe recipe.json")
+        sys.exit(2)
     app = QApplication(sys.argv)
     app.setFont(QFont("Arial", 10))
     window = DataProcessor()
     window.show()
-    sys.exit(app.exec())
\ No newline at end of file
+    window.offer_resume()
+    sys.exit(app.exec())
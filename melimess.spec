@@ -36,3 +36,40 @@ exe = EXE(
     codesign_identity=None,
     entitlements_file=None,
 )
+
+# Batch mode reports to the console, which the windowed melimess.exe doesn't have
+b = Analysis(
+    ['batch.py'],
+    pathex=[],
+    binaries=[],
+    datas=[],
+    hiddenimports=[],
+    hookspath=[],
+    hooksconfig={},
+    runtime_hooks=[],
+    excludes=['PyQt6'],
+    noarchive=False,
+    optimize=0,
+)
+batch_pyz = PYZ(b.pure)
+
+batch_exe = EXE(
+    batch_pyz,
+    b.scripts,
+    b.binaries,
+    b.datas,
+    [],
+    name='melimess-batch',
+    debug=False,
+    bootloader_ignore_signals=False,
+    strip=False,
+    upx=True,
+    upx_exclude=[],
+    runtime_tmpdir=None,
+    console=True,
+    disable_windowed_traceback=False,
+    argv_emulation=False,
+    target_arch=None,
+    codesign_identity=None,
+    entitlements_file=None,
+)
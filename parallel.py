@@ -0,0 +1,256 @@
+"""Column-parallel processing of one sheet on a pool of worker processes.
+
+The cell matrices of the sheet are moved into shared memory
+(multiprocessing.shared_memory) once per sheet; the engine keeps using them as
+ordinary numpy arrays. An "All" operation is split into contiguous column
+slices; each worker process maps the same memory, runs the engine method on
+its slice and writes the results in place, so no cells are pickled and
+nothing is copied back. Only the small sheet state (seed, draw counters, CRM
+rows, header) travels with a task. Random values come from the per-(stage,
+column) streams of column_rng, so the result is the same however the columns
+are split, and the same as running the method in this process.
+"""
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Arrays a worker reads or writes; the rest of the sheet (names, qualifier
+# text) holds Python objects and never leaves this process
+SHARED_ARRAYS = (
+    'original', 'censored', 'modified', 'base', 'censor', 'dup_status', 'crm_status', 'crm_compared',
+    'processed', 'limits', 'limits_applied',
+)
+# Engine methods that can be split by column:
+# method -> (position of the columns argument, positions of per-column settings)
+OPERATIONS = {
+    'apply_recipe': (1, ()),
+    'fill_empty_cells': (0, (1, 2, 3, 4)),
+    'check_duplicate_groups': (1, (2,)),
+    'fix_duplicate_groups': (1, (2, 3)),
+    'fix_crm_cells': (0, (1,)),
+    'apply_limits': (0, ()),
+}
+PARALLEL_CELLS = 2_000_000 # smaller column sets run in the calling process
+PARTS_PER_WORKER = 4 # column slices per worker, so progress and cancel come in steps
+
+
+def columns_of(method, args):
+    return np.atleast_1d(np.asarray(args[OPERATIONS[method][0]], dtype=np.intp))
+
+
+def slice_args(method, args, part):
+    """args of an OPERATIONS call with the columns and per-column settings cut to part."""
+    columns, settings = OPERATIONS[method]
+    args = list(args)
+    args[columns] = columns_of(method, args)[part]
+    for i in settings:
+        if np.ndim(args[i]):
+            args[i] = np.asarray(args[i])[part]
+    return args
+
+
+def combine(results):
+    """Join the results of column slices: counts are added, (rows x columns)
+    matrices put side by side; row lists are the same for every slice."""
+    first = results[0]
+    if isinstance(first, tuple):
+        return tuple(combine(list(parts)) for parts in zip(*results))
+    if isinstance(first, np.ndarray):
+        return np.hstack(results) if first.ndim == 2 else first
+    return sum(results)
+
+
+class SharedSheet:
+    """Shared-memory copies of an engine's SHARED_ARRAYS, swapped into the engine."""
+    def __init__(self, engine):
+        self.blocks = {}
+        self.views = {}
+        for name in SHARED_ARRAYS:
+            array = getattr(engine, name)
+            block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+            view = np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)
+            view[...] = array
+            self.blocks[name] = block
+            self.views[name] = view
+            setattr(engine, name, view)
+
+    def shares(self, engine):
+        return all(getattr(engine, name) is view for name, view in self.views.items())
+
+    def spec(self):
+        """What a worker needs to map the arrays: name -> (block name, shape, dtype)."""
+        return {name: (self.blocks[name].name, view.shape, view.dtype.str) for name, view in self.views.items()}
+
+    def release(self, engine):
+        """Free the shared memory; an engine still using it gets private copies first."""
+        for name, view in self.views.items():
+            if engine is not None and getattr(engine, name) is view:
+                setattr(engine, name, view.copy())
+        self.views = {}
+        for block in self.blocks.values():
+            block.unlink()
+            try:
+                block.close()
+            except BufferError:
+                pass # a view is still referenced somewhere; the mapping goes with it
+        self.blocks = {}
+
+
+class ColumnPool:
+    """Runs OPERATIONS on column slices of one engine in worker processes."""
+    def __init__(self, workers=None, min_cells=PARALLEL_CELLS):
+        self.workers = workers or os.cpu_count() or 1
+        self.min_cells = min_cells
+        self.executor = None
+        self.sheet = None
+        self.futures = set() # submitted tasks not finished yet, cancelled by close
+
+    def worth(self, engine, num_columns):
+        """True when a column set is large enough to pay for the worker processes."""
+        return self.workers > 1 and num_columns > 1 and engine.num_rows * num_columns >= self.min_cells
+
+    def share(self, engine):
+        """Move the engine's arrays into shared memory (once per sheet) and start the workers."""
+        if self.sheet is not None and self.sheet.shares(engine):
+            return
+        if self.sheet is not None:
+            self.sheet.release(engine)
+        self.sheet = SharedSheet(engine)
+        if self.executor is None:
+            # spawn: the GUI calls in from a worker thread, where fork is unsafe
+            self.executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+        # Map the new blocks in every worker ahead of the first task
+        spec = self.sheet.spec()
+        for _ in range(self.workers):
+            self.submit(_attach, spec)
+
+    def submit(self, function, *args):
+        future = self.executor.submit(function, *args)
+        self.futures.add(future)
+        future.add_done_callback(self.futures.discard)
+        return future
+
+    def run(self, engine, method, args, kwargs=None, on_part=None, cancelled=None):
+        """Call engine.<method>(*args, **kwargs) split by column; returns the list of slice results.
+
+        on_part(columns) is called as each slice finishes. When cancelled()
+        turns true, slices not yet started are dropped; the running ones are
+        waited for, and the results cover the finished slices only.
+        """
+        columns = columns_of(method, args)
+        size = max(1, -(-len(columns) // (self.workers * PARTS_PER_WORKER)))
+        parts = [slice(start, start + size) for start in range(0, len(columns), size)]
+        self.share(engine)
+        # Workers write past the engine, so the undo history and autosave are told here
+        engine.touch(columns)
+        spec = self.sheet.spec()
+        futures = {
+            self.submit(
+                _run, spec, sheet_state(engine, columns[part]), method, slice_args(method, args, part), kwargs or {}
+            ): part
+            for part in parts
+        }
+        results = {}
+        try:
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                result, draws = future.result()
+                engine.draws.update(draws)
+                part = futures[future]
+                results[part.start] = result
+                if on_part is not None:
+                    on_part(columns[part].tolist())
+                if cancelled is not None and cancelled():
+                    for pending in futures:
+                        pending.cancel()
+        except BaseException:
+            for pending in futures:
+                pending.cancel()
+            wait(futures)
+            raise
+        return [results[start] for start in sorted(results)]
+
+    def call(self, engine, method, args, kwargs=None):
+        """engine.<method>(*args, **kwargs) on the pool when worth it, else in this process."""
+        if not self.worth(engine, len(columns_of(method, args))):
+            return getattr(engine, method)(*args, **(kwargs or {}))
+        return combine(self.run(engine, method, args, kwargs))
+
+    def close(self, engine=None):
+        if self.executor is not None:
+            shutdown(self.executor, self.futures)
+            self.executor = None
+        if self.sheet is not None:
+            self.sheet.release(engine)
+            self.sheet = None
+
+
+def shutdown(executor, futures):
+    """Cancel the futures not yet started, then wait for the executor to stop.
+
+    This is shutdown(wait=True, cancel_futures=True), which needs Python 3.9;
+    the packaged build runs on 3.8.
+    """
+    for future in list(futures):
+        future.cancel()
+    executor.shutdown(wait=True)
+
+
+def sheet_state(engine, columns):
+    """Sheet state a worker needs besides the shared arrays; draw counters of columns only."""
+    wanted = set(columns.tolist())
+    return {
+        'seed': engine.seed,
+        'draws': {key: count for key, count in engine.draws.items() if key[1] in wanted},
+        'header_row': engine.header_row,
+        'crm_reference': engine.crm_reference,
+        'crm_rows': engine.crm_rows,
+        'crm_index': engine.crm_index,
+    }
+
+
+# --- worker process side ---
+_mapped = {'names': None, 'blocks': [], 'arrays': {}}
+
+
+def _map(spec):
+    """Map the shared arrays of spec in this worker (once per sheet); returns them by name."""
+    names = tuple(block for block, _, _ in spec.values())
+    if _mapped['names'] != names:
+        _mapped['arrays'] = {}
+        for block in _mapped['blocks']:
+            try:
+                block.close()
+            except BufferError:
+                pass
+        blocks = {name: shared_memory.SharedMemory(name=block) for name, (block, _, _) in spec.items()}
+        _mapped['blocks'] = list(blocks.values())
+        _mapped['arrays'] = {
+            name: np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[name].buf)
+            for name, (_, shape, dtype) in spec.items()
+        }
+        _mapped['names'] = names
+    return _mapped['arrays']
+
+
+def _attach(spec):
+    _map(spec)
+
+
+def _run(spec, state, method, args, kwargs):
+    from engine import ProcessingEngine # not needed until the first task
+    engine = ProcessingEngine(seed=state['seed'])
+    for name, array in _map(spec).items():
+        setattr(engine, name, array)
+    engine.draws = state['draws']
+    engine.header_row = state['header_row']
+    engine.crm_reference = state['crm_reference']
+    engine.crm_rows = state['crm_rows']
+    engine.crm_index = state['crm_index']
+    engine.dirty = np.zeros(engine.num_columns, dtype=bool) # the caller marks the columns
+    result = getattr(engine, method)(*args, **kwargs)
+    return result, engine.draws
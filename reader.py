@@ -0,0 +1,257 @@
+"""Reading CSV/XLSX exports straight into typed arrays.
+
+The first PREAMBLE_ROWS rows (title, element header and reserved rows 2-5) are
+kept as read; sample rows are parsed with clean_frame. CSV files are read
+chunk by chunk, so only one chunk of raw text is held in memory at a time.
+XLSX files are read with python-calamine when it is installed, otherwise with
+openpyxl in read-only mode, and the parsed result is cached by content hash.
+"""
+import datetime
+import hashlib
+import os
+import re
+import tempfile
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+from cleaning import CleanResult, clean_frame
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
+
+PREAMBLE_ROWS = 6
+CHUNK_ROWS = 20000
+# Parsed XLSX sheets, one .npz per file content hash
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.melimess', 'cache')
+CACHE_FILES = 50
+CACHE_VERSION = 2 # bumped when the cached layout changes; older files are parsed again
+# Sheet caches are named <sha1>.v<version>.npz; other files in CACHE_DIR (CRM libraries) are left alone
+SHEET_CACHE_NAME = re.compile(r'[0-9a-f]{40}(\.v\d+)?\.npz')
+# Errors of an .npz file that can't be read (missing, truncated, other layout); it is treated as absent
+NPZ_ERRORS = (OSError, KeyError, ValueError, zipfile.BadZipFile)
+
+
+def count_lines(path, block_size=1 << 20):
+    """Number of lines in a file, counted on raw bytes (used to preallocate arrays)."""
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            lines += block.count(b'\n')
+            last = block[-1:]
+    return lines + (last != b'\n')
+
+
+def iter_csv(path, chunk_rows=CHUNK_ROWS):
+    """Read a CSV export in chunks.
+
+    Yields the preamble first, as a DataFrame of PREAMBLE_ROWS text rows, and
+    then one (start_row, sample_names, CleanResult) tuple per chunk of sample
+    rows, with start_row counted from the first sample row. The sample-name
+    column is always kept as text.
+    """
+    reader = pd.read_csv(path, header=None, chunksize=chunk_rows, dtype={0: object})
+    start = 0
+    preamble = None
+    head = [] # chunks read before the preamble is complete
+    with reader:
+        for chunk in reader:
+            if preamble is None:
+                head.append(chunk)
+                chunk = pd.concat(head)
+                if len(chunk) < PREAMBLE_ROWS:
+                    continue
+                preamble = chunk.iloc[:PREAMBLE_ROWS].astype(object).reset_index(drop=True)
+                yield preamble
+                chunk = chunk.iloc[PREAMBLE_ROWS:]
+            chunk = chunk.reset_index(drop=True)
+            if chunk.empty:
+                continue
+            cleaned = clean_frame(chunk, columns=range(1, chunk.shape[1]))
+            yield start, chunk.iloc[:, 0].to_numpy(dtype=object), cleaned
+            start += len(chunk)
+    if preamble is None:
+        raise ValueError(f"{path} has fewer than {PREAMBLE_ROWS} header rows")
+
+
+def read_xlsx_rows(path):
+    """Cell values of the first sheet as a list of rows (None for empty cells)."""
+    if CalamineWorkbook is not None:
+        rows = CalamineWorkbook.from_path(path).get_sheet_by_index(0).to_python(skip_empty_area=False)
+        # calamine gives every number as float; whole numbers are int, as openpyxl returns them
+        rows = [
+            [None if cell == '' else int(cell) if isinstance(cell, float) and cell.is_integer() else cell for cell in row]
+            for row in rows
+        ]
+    else:
+        import openpyxl
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = [list(row) for row in workbook.worksheets[0].iter_rows(values_only=True)]
+        finally:
+            workbook.close()
+    # Formatted but empty rows at the end are not data
+    while rows and all(cell is None for cell in rows[-1]):
+        rows.pop()
+    return rows
+
+
+def read_xlsx(path):
+    """Parse an XLSX export into (preamble, sample_names, CleanResult)."""
+    rows = read_xlsx_rows(path)
+    if len(rows) < PREAMBLE_ROWS:
+        raise ValueError(f"{path} has fewer than {PREAMBLE_ROWS} header rows")
+    width = max(len(row) for row in rows)
+    frame = pd.DataFrame([row + [None] * (width - len(row)) for row in rows], dtype=object)
+    samples = frame.iloc[PREAMBLE_ROWS:].reset_index(drop=True)
+    cleaned = clean_frame(samples, columns=range(1, width))
+    return frame.iloc[:PREAMBLE_ROWS].reset_index(drop=True), samples.iloc[:, 0].to_numpy(dtype=object), cleaned
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Kinds of cell values in pack_objects, in the order they are checked
+KIND_NONE, KIND_FLOAT, KIND_TEXT, KIND_INT, KIND_BOOL, KIND_DATETIME, KIND_DATE, KIND_TIME, KIND_DURATION = range(9)
+
+
+def pack_objects(values):
+    """Split an object array into (kind, numbers, text) arrays that np.savez can store.
+
+    kind is one of the KIND_ codes, so unpack_objects gives back the same
+    types: floats and bools in numbers, ints (exactly) and dates/times as
+    text, durations as seconds. Anything else is stored as its text.
+    """
+    values = np.asarray(values, dtype=object)
+    kind = np.zeros(values.shape, dtype=np.int8)
+    numbers = np.full(values.shape, np.nan)
+    text = np.full(values.shape, '', dtype=object)
+    for index, value in np.ndenumerate(values):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            continue
+        if isinstance(value, (bool, np.bool_)):
+            kind[index], numbers[index] = KIND_BOOL, value
+        elif isinstance(value, (int, np.integer)):
+            kind[index], text[index] = KIND_INT, str(int(value))
+        elif isinstance(value, (float, np.floating)):
+            kind[index], numbers[index] = KIND_FLOAT, value
+        elif isinstance(value, datetime.datetime):
+            kind[index], text[index] = KIND_DATETIME, value.isoformat()
+        elif isinstance(value, datetime.date):
+            kind[index], text[index] = KIND_DATE, value.isoformat()
+        elif isinstance(value, datetime.time):
+            kind[index], text[index] = KIND_TIME, value.isoformat()
+        elif isinstance(value, datetime.timedelta):
+            kind[index], numbers[index] = KIND_DURATION, value.total_seconds()
+        else:
+            kind[index], text[index] = KIND_TEXT, str(value)
+    return kind, numbers, text.astype(str)
+
+
+def unpack_objects(kind, numbers, text):
+    values = np.full(kind.shape, None, dtype=object)
+    readers = {
+        KIND_FLOAT: lambda number, text: float(number),
+        KIND_TEXT: lambda number, text: text,
+        KIND_INT: lambda number, text: int(text),
+        KIND_BOOL: lambda number, text: bool(number),
+        KIND_DATETIME: lambda number, text: datetime.datetime.fromisoformat(text),
+        KIND_DATE: lambda number, text: datetime.date.fromisoformat(text),
+        KIND_TIME: lambda number, text: datetime.time.fromisoformat(text),
+        KIND_DURATION: lambda number, text: datetime.timedelta(seconds=number),
+    }
+    for code, read in readers.items():
+        cells = kind == code
+        if cells.any():
+            values[cells] = [read(number, text) for number, text in zip(numbers[cells].tolist(), text[cells].tolist())]
+    return values
+
+
+def sheet_arrays(preamble, names, errors):
+    """The object parts of a parsed sheet (preamble, sample names, load errors) as
+    arrays np.savez can store; unpack_sheet reads them back."""
+    arrays = {}
+    for prefix, values in (('preamble', preamble.to_numpy(dtype=object)), ('names', names)):
+        arrays[prefix + '_kind'], arrays[prefix + '_num'], arrays[prefix + '_text'] = pack_objects(values)
+    arrays['error_cells'] = np.array([(row, col) for row, col, _ in errors], dtype=np.int64).reshape(-1, 2)
+    arrays['error_text'] = np.array([text for _, _, text in errors], dtype=str)
+    return arrays
+
+
+def unpack_sheet(data):
+    """(preamble, names, errors) from the arrays written by sheet_arrays."""
+    preamble = pd.DataFrame(
+        unpack_objects(data['preamble_kind'], data['preamble_num'], data['preamble_text']), dtype=object
+    )
+    names = unpack_objects(data['names_kind'], data['names_num'], data['names_text'])
+    errors = [(int(row), int(col), str(text)) for (row, col), text in zip(data['error_cells'], data['error_text'])]
+    return preamble, names, errors
+
+
+def write_npz(path, arrays):
+    """np.savez to a unique temporary file next to path, then moved over it, so a
+    crash never leaves half a file and processes writing the same path don't collide."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def save_cached_sheet(cache_file, preamble, names, cleaned):
+    arrays = sheet_arrays(preamble, names, cleaned.errors)
+    arrays.update(values=cleaned.values, censored=cleaned.censored, qualifiers=cleaned.qualifiers)
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    write_npz(cache_file, arrays)
+    cached = sorted((entry for entry in os.scandir(os.path.dirname(cache_file))
+                     if SHEET_CACHE_NAME.fullmatch(entry.name)),
+                    key=lambda entry: entry.stat().st_mtime, reverse=True)
+    for entry in cached[CACHE_FILES:]:
+        os.remove(entry.path)
+
+
+def load_cached_sheet(cache_file):
+    with np.load(cache_file, allow_pickle=False) as data:
+        preamble, names, errors = unpack_sheet(data)
+        cleaned = CleanResult(data['values'], data['censored'], data['qualifiers'], errors)
+    return preamble, names, cleaned
+
+
+def read_xlsx_cached(path, cache_dir=None):
+    """read_xlsx with the parsed result cached under the file's content hash.
+
+    An edited workbook hashes differently and is parsed again; a cache that
+    can't be read or written is ignored. cache_dir defaults to CACHE_DIR.
+    """
+    cache_file = os.path.join(cache_dir or CACHE_DIR, f"{file_hash(path)}.v{CACHE_VERSION}.npz")
+    if os.path.exists(cache_file):
+        try:
+            sheet = load_cached_sheet(cache_file)
+            os.utime(cache_file) # recently used files survive pruning
+            return sheet
+        except NPZ_ERRORS:
+            pass
+    preamble, names, cleaned = read_xlsx(path)
+    try:
+        save_cached_sheet(cache_file, preamble, names, cleaned)
+    except OSError:
+        pass
+    return preamble, names, cleaned
@@ -0,0 +1,114 @@
+"""Recipes: processing settings per element, stored as JSON or TOML.
+
+    {
+      "defaults": {"min": 0.9, "max": 1.1, "ratio": 1.0, "offset": 0.0,
+                   "apply_to_manual": false, "dup_range": 0.05, "crm_range": 0.1},
+      "elements": {"Cu": {"ratio": 1.02, "offset": -3}},
+      "crm_sample": "SER-152-010"
+    }
+
+Elements without an entry use the defaults. Other top-level keys are sheet
+options used by batch mode (see OPTIONS). Older flat recipes with "min",
+"max", ... at the top level are read as defaults.
+"""
+import json
+import os
+
+import numpy as np
+
+SETTINGS = {
+    'min': 0.9,
+    'max': 1.1,
+    'ratio': 1.0,
+    'offset': 0.0,
+    'apply_to_manual': False,
+    'dup_range': 0.05,
+    'crm_range': 0.1,
+}
+
+OPTIONS = {
+    # Lists of sample names (fixed column) that are duplicates of each other;
+    # when empty, pairs are found from the names with duplicate_pattern
+    'duplicate_groups': [],
+    'duplicate_pattern': None,
+    # Sample name of the row(s) compared with the selected CRM; None finds CRM rows by name
+    'crm_sample': None,
+    # CRM library file (layout of Book1.xlsx) and the CRM to use; None = crm.default_library_path or built-in OREAS 903
+    'crm_library': None,
+    'crm_name': None,
+    'apply_limits': True,
+    # Random seed shared by every file; None draws a new one per file
+    'seed': None,
+}
+
+
+class Recipe:
+    """Default settings, per-element overrides and sheet options."""
+    def __init__(self, defaults=None, elements=None, options=None):
+        self.defaults = dict(SETTINGS)
+        self.defaults.update(defaults or {})
+        self.elements = {name: dict(settings) for name, settings in (elements or {}).items()}
+        self.options = dict(OPTIONS)
+        self.options.update(options or {})
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        defaults = {key: data.pop(key) for key in SETTINGS if key in data}
+        defaults.update(data.pop('defaults', {}))
+        elements = data.pop('elements', {})
+        unknown = [key for settings in elements.values() for key in settings if key not in SETTINGS]
+        if unknown:
+            raise ValueError(f"Unknown recipe settings: {', '.join(sorted(set(unknown)))}")
+        return cls(defaults, elements, data)
+
+    def to_dict(self):
+        data = {'defaults': dict(self.defaults), 'elements': {name: dict(s) for name, s in self.elements.items()}}
+        data.update(self.options)
+        return data
+
+    @classmethod
+    def load(cls, path):
+        if path.lower().endswith('.toml'):
+            try:
+                import tomllib
+            except ImportError: # Python < 3.11
+                try:
+                    import tomli as tomllib
+                except ImportError:
+                    raise ValueError("Reading TOML recipes needs Python 3.11 or the tomli package; use .json instead")
+            with open(path, 'rb') as f:
+                return cls.from_dict(tomllib.load(f))
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    def save(self, path):
+        data = self.to_dict()
+        if path.lower().endswith('.toml'):
+            try:
+                import tomli_w
+            except ImportError:
+                raise ValueError("Saving TOML recipes needs the tomli_w package; use .json instead")
+            # TOML has no null
+            data = {key: value for key, value in data.items() if value is not None}
+            with open(path, 'wb') as f:
+                tomli_w.dump(data, f)
+            return
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def settings(self, element):
+        """All settings of one element, defaults filled in."""
+        settings = dict(self.defaults)
+        settings.update(self.elements.get(element, {}))
+        return settings
+
+    def set_element(self, element, **settings):
+        self.elements.setdefault(element, {}).update(settings)
+
+    def vectors(self, element_names):
+        """One float64 array per setting with the value of every given element."""
+        rows = [self.settings(name) for name in element_names]
+        return {key: np.array([row[key] for row in rows], dtype=np.float64) for key in SETTINGS}
@@ -0,0 +1,203 @@
+"""Autosave of the working session, so a crash or a closed window loses nothing.
+
+The first save after a file is loaded writes base.npz with every array of the
+engine. Later saves write only the columns changed since the previous save
+(delta-000001.npz, ...) plus the small per-sheet state (processed columns,
+limits, draw counters, CRM rows, view state). After COMPACT_AFTER deltas the next
+save writes a new base and drops them. Arrays are copied on the caller's
+thread and written by a single background thread, in order; every file is
+written under a temporary name first, so a crash mid-write leaves the
+previous files usable. All files are uncompressed .npz, so resuming is a
+few array reads.
+"""
+import glob
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from cleaning import CleanResult
+from crm import CRMLibrary
+from engine import CELL_ARRAYS
+from reader import NPZ_ERRORS, sheet_arrays, unpack_sheet, write_npz
+
+SESSION_DIR = os.path.join(os.path.expanduser('~'), '.melimess', 'session')
+SAVE_EVERY = 20 # edits between autosaves
+COMPACT_AFTER = 50 # deltas before the base is rewritten
+
+
+def base_path(directory):
+    return os.path.join(directory, 'base.npz')
+
+
+def delta_paths(directory):
+    return sorted(glob.glob(os.path.join(directory, 'delta-*.npz')))
+
+
+def sheet_state(engine, view):
+    """Per-sheet state saved with every snapshot; view is a JSON-serialisable dict."""
+    draws = sorted(engine.draws.items())
+    crm_rows = sorted(engine.crm_rows.items())
+    library = engine.crm_library
+    return {
+        'processed': engine.processed.copy(),
+        'limits': engine.limits.copy(),
+        'limits_applied': engine.limits_applied.copy(),
+        'seed': np.array(str(engine.seed)), # seeds are unbounded ints; text holds any of them
+        'draw_keys': np.array([key for key, _ in draws], dtype=np.int64).reshape(-1, 2),
+        'draw_counts': np.array([count for _, count in draws], dtype=np.int64),
+        'crm_row_keys': np.array([row for row, _ in crm_rows], dtype=np.int64),
+        'crm_row_values': np.array([index for _, index in crm_rows], dtype=np.int64),
+        'crm_original_row': np.array(-1 if engine.crm_original_row is None else engine.crm_original_row),
+        'crm_index': np.array(engine.crm_index),
+        'crm_names': np.array(library.names, dtype=str),
+        'crm_elements': np.array(library.elements, dtype=str),
+        'crm_values': library.values,
+        'crm_source': np.array(library.source or ''),
+        'view': np.array(json.dumps(view)),
+        'saved_at': np.array(time.time()),
+    }
+
+
+def base_arrays(engine, view):
+    """Everything needed to rebuild the engine. Arrays that never change after
+    loading are passed as they are; cell arrays are copied."""
+    arrays = sheet_state(engine, view)
+    arrays.update({name: getattr(engine, name).copy() for name in CELL_ARRAYS})
+    arrays.update(original=engine.original, censored=engine.censored, qualifiers=engine.qualifiers)
+    arrays.update(sheet_arrays(engine.preamble, engine.fixed_column, engine.load_errors))
+    return arrays
+
+
+def delta_arrays(engine, cols, view):
+    arrays = sheet_state(engine, view)
+    arrays['columns'] = cols
+    arrays.update({name: getattr(engine, name)[:, cols] for name in CELL_ARRAYS})
+    return arrays
+
+
+class Autosaver:
+    """Writes the engine state to directory every `every` edits, off the calling thread."""
+    def __init__(self, engine, directory=SESSION_DIR, every=SAVE_EVERY):
+        self.engine = engine
+        self.directory = directory
+        self.every = every
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.edits = 0
+        self.deltas = 0
+        self.needs_base = True
+        self.error = None # last write error, shown by the caller if it wants
+
+    def start(self):
+        """Drop the previous session; the next save writes a new base."""
+        self.edits = 0
+        self.deltas = 0
+        self.needs_base = True
+        self.executor.submit(self._remove, [base_path(self.directory)])
+
+    def edited(self, view):
+        """Count one edit; saves when `every` edits have piled up."""
+        self.edits += 1
+        if self.edits >= self.every:
+            self.save(view)
+
+    def save(self, view):
+        """Queue a snapshot of the engine as it is now; returns the Future of the write."""
+        self.edits = 0
+        engine = self.engine
+        if self.needs_base or self.deltas >= COMPACT_AFTER:
+            arrays = base_arrays(engine, view)
+            engine.dirty[:] = False
+            self.needs_base = False
+            self.deltas = 0
+            return self.executor.submit(self._write_base, arrays)
+        cols = np.flatnonzero(engine.dirty)
+        engine.dirty[cols] = False
+        self.deltas += 1
+        return self.executor.submit(self._write_delta, self.deltas, delta_arrays(engine, cols, view))
+
+    def discard(self):
+        self.edits = 0
+        self.needs_base = True
+        return self.executor.submit(self._remove, [base_path(self.directory)])
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def _write_base(self, arrays):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            write_npz(base_path(self.directory), arrays)
+            self._remove([])
+        except OSError as e:
+            self.error = e
+            self.needs_base = True
+
+    def _write_delta(self, number, arrays):
+        try:
+            write_npz(os.path.join(self.directory, f"delta-{number:06d}.npz"), arrays)
+        except OSError as e:
+            self.error = e
+            self.needs_base = True
+
+    def _remove(self, paths):
+        """Remove the given files and every delta."""
+        for path in paths + delta_paths(self.directory):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def session_view(directory=SESSION_DIR):
+    """View state of the saved session (with 'saved_at' added), or None if there is none."""
+    paths = delta_paths(directory) or [base_path(directory)]
+    if not os.path.exists(base_path(directory)):
+        return None
+    try:
+        with np.load(paths[-1], allow_pickle=False) as data:
+            view = json.loads(str(data['view']))
+            view['saved_at'] = float(data['saved_at'])
+            return view
+    except NPZ_ERRORS:
+        return None
+
+
+def restore_state(engine, data):
+    engine.processed[:] = data['processed']
+    engine.limits[:] = data['limits']
+    engine.limits_applied[:] = data['limits_applied']
+    engine.draws = {(int(stage), int(col)): int(count) for (stage, col), count in zip(data['draw_keys'], data['draw_counts'])}
+    engine.crm_rows = dict(zip(data['crm_row_keys'].tolist(), data['crm_row_values'].tolist()))
+    original_row = int(data['crm_original_row'])
+    engine.crm_original_row = None if original_row < 0 else original_row
+    engine.crm_index = int(data['crm_index'])
+    return json.loads(str(data['view']))
+
+
+def restore(engine, directory=SESSION_DIR):
+    """Rebuild the engine from the saved session; returns the view state of the last save.
+
+    Raises one of reader.NPZ_ERRORS when the session files can't be read.
+    """
+    with np.load(base_path(directory), allow_pickle=False) as data:
+        library = CRMLibrary(data['crm_names'], data['crm_elements'], data['crm_values'])
+        library.source = str(data['crm_source']) or None
+        engine.set_crm_library(library)
+        preamble, names, errors = unpack_sheet(data)
+        engine.set_seed(int(str(data['seed'])))
+        engine.start_sheet(preamble, len(names))
+        engine.store_rows(0, names, CleanResult(data['original'], data['censored'], data['qualifiers'], errors))
+        for name in CELL_ARRAYS:
+            getattr(engine, name)[:] = data[name]
+        view = restore_state(engine, data)
+    for path in delta_paths(directory):
+        with np.load(path, allow_pickle=False) as data:
+            cols = data['columns']
+            for name in CELL_ARRAYS:
+                getattr(engine, name)[:, cols] = data[name]
+            view = restore_state(engine, data)
+    engine.dirty[:] = False
+    return view
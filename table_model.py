@@ -0,0 +1,387 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer, pyqtSignal
+from PyQt6.QtGui import QBrush, QColor, QFont
+
+from engine import (
+    SOURCE_USER, STATUS_NONE, STATUS_CHECKED, STATUS_IN_RANGE, STATUS_FIXED, STATUS_OUT_OF_RANGE
+)
+from parallel import shutdown
+
+LIGHT_YELLOW = QColor(255, 255, 150)
+LIGHT_RED = QColor(255, 180, 180)
+LIGHT_GREEN = QColor(180, 255, 180)
+CRM_BLUE = QColor(200, 200, 255)
+CENSORED_GREY = QColor(120, 120, 120)
+
+STATUS_BRUSHES = {
+    STATUS_CHECKED: QBrush(LIGHT_YELLOW),
+    STATUS_IN_RANGE: QBrush(LIGHT_GREEN),
+    STATUS_FIXED: QBrush(LIGHT_GREEN),
+    STATUS_OUT_OF_RANGE: QBrush(LIGHT_RED),
+}
+CENSORED_BRUSH = QBrush(CENSORED_GREY)
+# Changed cells of one column that are patched into its cached view; more rebuild it
+PATCH_CELLS = 1000
+# Quiet time before views are built, so the table paints first and fast clicking builds nothing
+PREFETCH_DELAY_MS = 150
+
+
+class ColumnView:
+    """What the single-column view shows of one element, as plain lists indexed by row."""
+    __slots__ = ('rows', 'original', 'modified', 'status', 'censored', 'random', 'compared')
+
+    def __init__(self, engine, col_index):
+        self.original, self.modified = engine.column_texts(col_index)
+        crm, dup = engine.crm_status[:, col_index], engine.dup_status[:, col_index]
+        self.status = np.where(crm != STATUS_NONE, crm, dup).tolist()
+        self.censored = engine.censored[:, col_index].tolist()
+        self.random = (~np.isnan(engine.base[:, col_index])).tolist()
+        self.compared = engine.crm_compared[:, col_index].tolist()
+        # A load still running can grow the sheet between the reads above
+        self.rows = min(len(self.original), len(self.modified), len(self.status), len(self.compared))
+
+    def update(self, engine, col_index, rows):
+        """Re-read the cells of rows after they changed."""
+        for row in rows:
+            if row < self.rows:
+                self.modified[row] = engine.modified_text(row, col_index)
+                self.status[row] = int(engine.cell_status(row, col_index))
+                self.random[row] = engine.is_random_filled(row, col_index)
+                self.compared[row] = bool(engine.crm_compared[row, col_index])
+
+
+class SheetTableModel(QAbstractTableModel):
+    """Table model reading cells straight from a ProcessingEngine.
+
+    Shows either one element (Fixed / Original / Modified) or all elements
+    (Fixed + one Modified column per element). Text and colours are computed in
+    data() for the visible cells only. Table rows are always engine rows; CRM
+    reference values are shown by CRMReferenceModel in a separate strip.
+
+    Switching elements only resets the view. A background thread builds a
+    ColumnView of the shown element and its neighbours, which data() reads
+    instead of the engine once it is there; engine change sets patch or drop
+    the cached views.
+    """
+    # Change sets may be committed on a worker thread; the signal queues them to the GUI thread
+    engine_change = pyqtSignal(object, str)
+    view_ready = pyqtSignal(int, object, object) # column, token, ColumnView (None if it failed)
+
+    def __init__(self, engine, parent=None):
+        super().__init__(parent)
+        self.engine = engine
+        self.column_index = None
+        self.all_columns = False
+        self.views = {} # column -> ColumnView, for the shown element and its neighbours
+        self.view_arrays = None # engine.modified when the views were built
+        self.epoch = 0 # bumped when every view is dropped
+        self.versions = {} # column -> times its view was dropped; stale builds are thrown away
+        self.pending = {} # column -> Future of its build
+        self.prefetcher = ThreadPoolExecutor(max_workers=1)
+        self.prefetch_timer = QTimer(self)
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(PREFETCH_DELAY_MS)
+        self.prefetch_timer.timeout.connect(self.prefetch)
+        self.italic = QFont()
+        self.italic.setItalic(True)
+        self.engine_change.connect(self.engine_changed)
+        self.view_ready.connect(self.store_view)
+        engine.add_listener(self.engine_change.emit)
+
+    # --- view switching ---
+    def show_column(self, col_index):
+        self.beginResetModel()
+        self.column_index = col_index
+        self.all_columns = False
+        self.endResetModel()
+        self.prefetch_timer.start()
+
+    def show_all(self):
+        self.beginResetModel()
+        self.column_index = None
+        self.all_columns = True
+        self.endResetModel()
+
+    def clear(self):
+        self.beginResetModel()
+        self.column_index = None
+        self.all_columns = False
+        self.invalidate()
+        self.endResetModel()
+
+    def close(self):
+        self.prefetch_timer.stop()
+        shutdown(self.prefetcher, self.pending.values())
+        self.pending.clear()
+
+    # --- cached column views ---
+    def token(self, col_index):
+        return self.epoch, self.versions.get(col_index, 0)
+
+    def invalidate(self, columns=None):
+        """Drop the cached views of columns (default: all) after their cells changed; they are rebuilt shortly."""
+        self.prefetch_timer.start()
+        if columns is None:
+            self.epoch += 1
+            self.views.clear()
+            return
+        for col in columns:
+            self.versions[col] = self.versions.get(col, 0) + 1
+            self.views.pop(col, None)
+
+    def prefetch(self):
+        """Build the missing views of the shown element and its neighbours in the background."""
+        if self.engine.modified is not self.view_arrays: # another sheet was loaded
+            self.view_arrays = self.engine.modified
+            self.invalidate()
+        if self.all_columns or self.column_index is None:
+            return
+        wanted = {col for col in range(self.column_index - 1, self.column_index + 2) if 1 <= col < self.engine.num_columns}
+        for col in set(self.views) - wanted:
+            del self.views[col]
+        for col in set(self.pending) - wanted:
+            self.pending.pop(col).cancel()
+        for col in sorted(wanted - set(self.views) - set(self.pending), key=lambda col: col != self.column_index):
+            self.pending[col] = self.prefetcher.submit(self.build_view, col, self.token(col))
+
+    def build_view(self, col_index, token):
+        """Runs on the prefetch thread."""
+        try:
+            view = ColumnView(self.engine, col_index)
+        except (IndexError, ValueError): # sheet replaced while reading
+            view = None
+        self.view_ready.emit(col_index, token, view)
+
+    def store_view(self, col_index, token, view):
+        self.pending.pop(col_index, None)
+        if token != self.token(col_index):
+            self.prefetch_timer.start() # the cells changed while it was built
+        elif view is not None and not self.all_columns and self.column_index is not None \
+                and abs(col_index - self.column_index) <= 1:
+            self.views[col_index] = view
+
+    def update_views(self, operation):
+        """Patch the cached views with the cells of a change set, or drop them when it is large."""
+        columns = operation.columns
+        if not len(columns):
+            # Limits and other sheet state can change the text of any cell
+            self.invalidate()
+        else:
+            rows = np.concatenate([delta.rows for delta in operation.deltas.values()])
+            cols = np.concatenate([delta.cols for delta in operation.deltas.values()])
+            # Columns kept whole changed in most of their cells; they are rebuilt
+            whole = set(np.concatenate([delta.dense_cols for delta in operation.deltas.values()]).tolist())
+            for col in columns.tolist():
+                view = self.views.get(col)
+                changed = np.unique(rows[cols == col])
+                self.invalidate([col])
+                if view is not None and col not in whole and len(changed) <= PATCH_CELLS:
+                    view.update(self.engine, col, changed.tolist())
+                    self.views[col] = view
+
+    def refresh(self, top=0, left=0, bottom=None, right=None):
+        """Repaint cells (default: all) after the engine changed underneath the model."""
+        if self.rowCount() and self.columnCount():
+            bottom = self.rowCount() - 1 if bottom is None else min(bottom, self.rowCount() - 1)
+            right = self.columnCount() - 1 if right is None else min(right, self.columnCount() - 1)
+            self.dataChanged.emit(self.index(top, left), self.index(bottom, right))
+
+    def refresh_columns(self, columns):
+        """Repaint the given engine columns, e.g. the ones a background operation just finished."""
+        self.invalidate(columns)
+        if self.all_columns:
+            self.refresh(0, min(columns), None, max(columns))
+        elif self.column_index in columns:
+            self.refresh()
+
+    def engine_changed(self, operation, source):
+        """Repaint once per committed change set. User edits repaint their own
+        cells (setData, paste); changes without cell deltas, such as limits,
+        repaint everything."""
+        self.update_views(operation)
+        if source == SOURCE_USER:
+            return
+        columns = operation.columns
+        if not len(columns):
+            self.refresh()
+        elif self.all_columns:
+            self.refresh(0, 0, None, int(columns.max()))
+        elif self.column_index in columns:
+            self.refresh()
+
+    def element_column(self, table_col):
+        """Engine column shown in a table column, or None for the Fixed column."""
+        if table_col == 0:
+            return None
+        return table_col if self.all_columns else self.column_index
+
+    def modified_column(self, col_index):
+        """Table column that shows the Modified values of an element."""
+        return col_index if self.all_columns else 2
+
+    # --- QAbstractTableModel ---
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() or (self.column_index is None and not self.all_columns):
+            return 0
+        return self.engine.num_rows
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid() or (self.column_index is None and not self.all_columns):
+            return 0
+        return self.engine.num_columns if self.all_columns else 3
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role != Qt.ItemDataRole.DisplayRole:
+            return None
+        if orientation == Qt.Orientation.Vertical:
+            return str(section + 1)
+        if section == 0:
+            return 'Fixed'
+        if self.all_columns:
+            return self.engine.get_element_name(section)
+        return ['Fixed', 'Original', 'Modified'][section]
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.ItemFlag.NoItemFlags
+        flags = Qt.ItemFlag.ItemIsEnabled | Qt.ItemFlag.ItemIsSelectable
+        if index.column() > 0 and (self.all_columns or index.column() == 2):
+            flags |= Qt.ItemFlag.ItemIsEditable
+        return flags
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row, table_col = index.row(), index.column()
+        if row >= self.engine.num_rows:
+            return None # trimmed by a load running in the background
+        view = None if self.all_columns else self.views.get(self.column_index)
+        if view is not None and row < view.rows:
+            return self.view_data(view, row, table_col, role)
+        col_index = self.element_column(table_col)
+        is_original = not self.all_columns and table_col == 1
+
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            if col_index is None:
+                return str(self.engine.fixed_column[row])
+            if is_original:
+                return self.engine.original_text(row, col_index)
+            return self.engine.modified_text(row, col_index)
+        if role == Qt.ItemDataRole.BackgroundRole:
+            if col_index is None:
+                status = self.engine.row_status(row, None if self.all_columns else self.column_index)
+            elif is_original:
+                return None
+            else:
+                status = self.engine.cell_status(row, col_index)
+            return STATUS_BRUSHES.get(int(status))
+        if role == Qt.ItemDataRole.ForegroundRole:
+            if is_original and self.engine.censored[row, col_index]:
+                return CENSORED_BRUSH
+            return None
+        if role == Qt.ItemDataRole.ToolTipRole:
+            if col_index is not None and not is_original and self.engine.crm_compared[row, col_index]:
+                return self.crm_tooltip(row, col_index)
+            return None
+        if role == Qt.ItemDataRole.FontRole:
+            if col_index is not None and not is_original and self.engine.is_random_filled(row, col_index):
+                return self.italic
+            return None
+        return None
+
+    def view_data(self, view, row, table_col, role):
+        """data() of the single-column view from its cached ColumnView."""
+        if role in (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.EditRole):
+            if table_col == 0:
+                return str(self.engine.fixed_column[row])
+            return view.original[row] if table_col == 1 else view.modified[row]
+        if role == Qt.ItemDataRole.BackgroundRole:
+            return None if table_col == 1 else STATUS_BRUSHES.get(view.status[row])
+        if role == Qt.ItemDataRole.ForegroundRole:
+            return CENSORED_BRUSH if table_col == 1 and view.censored[row] else None
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return self.crm_tooltip(row, self.column_index) if table_col == 2 and view.compared[row] else None
+        if role == Qt.ItemDataRole.FontRole:
+            return self.italic if table_col == 2 and view.random[row] else None
+        return None
+
+    def crm_tooltip(self, row, col_index):
+        reference = self.engine.crm_value(col_index, row)
+        text = f"{self.engine.crm_name(row)}: {reference:g}"
+        val = self.engine.value(row, col_index)
+        if isinstance(val, float):
+            text += f" (recovery {val / reference * 100:.1f}%)"
+        return text
+
+    def setData(self, index, value, role=Qt.ItemDataRole.EditRole):
+        if role != Qt.ItemDataRole.EditRole or not (self.flags(index) & Qt.ItemFlag.ItemIsEditable):
+            return False
+        col_index = self.element_column(index.column())
+        try:
+            with self.engine.transaction("Edit cell", SOURCE_USER):
+                self.engine.set_text(col_index, index.row(), str(value))
+        except ValueError:
+            return False
+        self.dataChanged.emit(self.index(index.row(), 0), index)
+        return True
+
+
+class CRMReferenceModel(QAbstractTableModel):
+    """One-row model with the CRM reference values of one CRM sample row.
+
+    Mirrors the columns of a SheetTableModel so a frozen strip above the main
+    table lines up with it; the sheet itself never gets extra rows.
+    """
+    def __init__(self, sheet_model, parent=None):
+        super().__init__(parent)
+        self.sheet_model = sheet_model
+        self.engine = sheet_model.engine
+        self.crm_row = None
+        sheet_model.modelAboutToBeReset.connect(self.sheet_about_to_reset)
+        sheet_model.modelReset.connect(self.endResetModel)
+        sheet_model.dataChanged.connect(self.refresh)
+
+    def sheet_about_to_reset(self):
+        # The engine may be reloaded; the owner picks the row again afterwards
+        self.beginResetModel()
+        self.crm_row = None
+
+    def set_crm_row(self, row):
+        self.crm_row = row
+        self.refresh()
+
+    def refresh(self, *args):
+        if self.columnCount():
+            self.dataChanged.emit(self.index(0, 0), self.index(0, self.columnCount() - 1))
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 1
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else self.sheet_model.columnCount()
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Vertical:
+            return "CRM"
+        return None
+
+    def flags(self, index):
+        return Qt.ItemFlag.ItemIsEnabled if index.isValid() else Qt.ItemFlag.NoItemFlags
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or self.crm_row is None:
+            return None
+        table_col = index.column()
+        col_index = self.sheet_model.element_column(table_col)
+        compared = col_index is not None and self.engine.crm_compared[self.crm_row, col_index]
+        if role == Qt.ItemDataRole.DisplayRole:
+            if col_index is None:
+                return f"{self.engine.crm_name(self.crm_row)} (row {self.crm_row + 1})"
+            if compared and (self.sheet_model.all_columns or table_col == 1):
+                return str(self.engine.crm_value(col_index, self.crm_row))
+            return ""
+        if role == Qt.ItemDataRole.BackgroundRole and (col_index is None or compared):
+            return QBrush(CRM_BLUE)
+        return None
@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import reader # noqa: E402
+
+SAMPLE = os.path.join(ROOT, '13179-3 (SER-152) RECAL.xlsx')
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """Parsed-sheet cache in a temporary folder instead of ~/.melimess."""
+    path = str(tmp_path / 'cache')
+    monkeypatch.setattr(reader, 'CACHE_DIR', path)
+    return path
+
+
+@pytest.fixture
+def sample_path():
+    return SAMPLE
@@ -0,0 +1,37 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import batch
+
+
+def test_batch_directory(sample_path, tmp_path, capsys):
+    indir, outdir = tmp_path / 'in', tmp_path / 'out'
+    indir.mkdir()
+    shutil.copy(sample_path, indir / 'a.xlsx')
+    (indir / 'bad.csv').write_text('x\n', encoding='utf-8')
+    (indir / '~$a.xlsx').write_bytes(b'') # Excel lock file, skipped
+    recipe = tmp_path / 'recipe.json'
+    recipe.write_text('{"defaults": {"min": 0.95, "max": 1.05}, "apply_limits": true}', encoding='utf-8')
+
+    code = batch.main([str(indir), str(outdir), '--recipe', str(recipe), '--seed', '7', '--format', 'csv', '--workers', '1'])
+    out = capsys.readouterr().out
+    assert code == 1 # bad.csv failed
+    assert 'OK' in out and 'FAIL' in out and '2 files, 1 ok, 1 failed' in out
+    assert os.listdir(outdir) == ['a.csv']
+    first = (outdir / 'a.csv').read_bytes()
+
+    # Same seed, same output
+    assert batch.main([str(indir), str(outdir), '--recipe', str(recipe), '--seed', '7', '--format', 'csv',
+                       '--workers', '1']) == 1
+    assert (outdir / 'a.csv').read_bytes() == first
+    assert len(pd.read_csv(outdir / 'a.csv', header=None)) > 500
+
+
+def test_batch_usage_errors(capsys):
+    with pytest.raises(SystemExit) as error:
+        batch.main([])
+    assert error.value.code == 2
+    assert 'melimess-batch' in capsys.readouterr().err
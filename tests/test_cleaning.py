@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cleaning import clean_frame, format_numbers, parse_censored, restore_text
+
+
+def test_clean_frame_parses_qualified_values():
+    frame = pd.DataFrame({'a': ['1.5', '<2', '2>', '> 0.5', None],
+                          'b': [3.0, 'abc', '', ' 1e-3 ', '-4']}, dtype=object)
+    result = clean_frame(frame)
+    np.testing.assert_array_equal(result.values[:, 0], [1.5, 2.0, 2.0, 0.5, np.nan])
+    np.testing.assert_array_equal(result.values[:, 1], [3.0, np.nan, np.nan, 0.001, -4.0])
+    assert result.censored[:, 0].tolist() == [False, True, True, True, False]
+    assert not result.censored[:, 1].any()
+    assert result.qualifiers[:, 0].tolist() == ['', '<x', 'x>', '>x', '']
+    assert result.errors == [(1, 1, 'abc')]
+
+
+def test_clean_frame_only_given_columns():
+    frame = pd.DataFrame({'a': ['<1'], 'b': ['<2']}, dtype=object)
+    result = clean_frame(frame, columns=[1])
+    assert np.isnan(result.values[0, 0]) and not result.censored[0, 0]
+    assert result.values[0, 1] == 2.0 and result.censored[0, 1]
+
+
+def test_parse_censored():
+    assert parse_censored(' <0.25 ') == (0.25, '<x')
+    assert parse_censored('7') == (7.0, '')
+    assert parse_censored('  ') == (None, '')
+    with pytest.raises(ValueError):
+        parse_censored('<<2')
+
+
+def test_restore_and_format():
+    assert restore_text(2.0, '<x') == '<2'
+    assert restore_text(0.5, 'x>') == '0.50>'
+    assert restore_text(np.nan, '<x') == ''
+    assert format_numbers([1.0, 1.234, np.nan, np.inf]) == ['1', '1.23', '', 'inf']
@@ -0,0 +1,33 @@
+import os
+
+import numpy as np
+
+from conftest import ROOT
+from crm import BUILTIN_CRM, CRMLibrary, cache_path, default_library_path
+
+
+def test_default_library_is_book1(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    assert default_library_path() == os.path.join(ROOT, 'Book1.xlsx')
+    library = CRMLibrary.default()
+    assert library.source == default_library_path()
+    assert library.index(BUILTIN_CRM) is not None
+
+
+def test_library_cache_lives_in_cache_dir(cache_dir):
+    path = os.path.join(ROOT, 'Book1.xlsx')
+    first = CRMLibrary.load(path)
+    assert [name for name in os.listdir(cache_dir) if name.startswith('crm-')]
+    assert not os.path.exists(os.path.join(ROOT, '.Book1.xlsx.crm.npz'))
+    cached = CRMLibrary.load(path)
+    assert cached.names == first.names and cached.elements == first.elements
+    np.testing.assert_array_equal(cached.values, first.values)
+
+
+def test_corrupt_library_cache_is_a_miss(cache_dir):
+    path = os.path.join(ROOT, 'Book1.xlsx')
+    first = CRMLibrary.load(path)
+    with open(cache_path(path), 'r+b') as f:
+        f.truncate(50)
+    again = CRMLibrary.load(path)
+    np.testing.assert_array_equal(again.values, first.values)
@@ -0,0 +1,127 @@
+import numpy as np
+import pytest
+
+from crm import CRMLibrary
+from engine import SOURCE_USER, STAGE_FILL, STATUS_FIXED, STATUS_OUT_OF_RANGE, ProcessingEngine
+
+
+@pytest.fixture
+def engine(sample_path):
+    engine = ProcessingEngine(seed=11)
+    engine.load(sample_path)
+    return engine
+
+
+def test_columns_without_draws_keep_their_counter(engine):
+    engine.original[:, 2] = np.nan # nothing to fill in column 2
+    engine.fill_empty_cells([1, 2], 0.9, 1.1, 1.0, 0.0)
+    assert engine.draws.get((STAGE_FILL, 1)) == 1
+    assert (STAGE_FILL, 2) not in engine.draws
+
+
+def test_fill_empty_cells(engine):
+    cols = np.array(engine.element_columns())
+    written = engine.fill_empty_cells(cols, 0.9, 1.1, 1.02, -1.0)
+    present = ~np.isnan(engine.original[:, cols])
+    assert written == present.sum()
+    base = engine.base[:, cols][present]
+    factor = base / engine.original[:, cols][present]
+    assert ((factor >= 0.9) & (factor <= 1.1)).all()
+    np.testing.assert_array_equal(engine.modified[:, cols][present], np.round(base * 1.02 - 1.0, 2))
+    assert engine.processed[cols].all()
+
+
+def test_fill_is_reproducible(sample_path):
+    modified = []
+    for _ in range(2):
+        engine = ProcessingEngine(seed=3)
+        engine.load(sample_path)
+        engine.fill_empty_cells(engine.element_columns(), 0.9, 1.1, 1.0, 0.0)
+        modified.append(engine.modified)
+    np.testing.assert_array_equal(modified[0], modified[1])
+
+
+def test_find_duplicate_groups(engine):
+    engine.fixed_column[12] = 'SER-152-005 DUP'
+    groups = engine.find_duplicate_groups()
+    assert list(groups) == ['SER-152-005']
+    assert groups['SER-152-005'].tolist() == [4, 12]
+
+
+def test_check_and_fix_duplicates(engine):
+    cols = np.array(engine.element_columns())
+    cols = cols[~np.isnan(engine.original[:, cols]).any(axis=0)]
+    engine.fill_empty_cells(cols, 1.0, 1.0, 1.0, 0.0)
+    groups = [[10, 11], [20, 21, 22]]
+    engine.modified[11, cols] *= 3 # one duplicate far off its partner
+    rows, out_of_range = engine.check_duplicate_groups(groups, cols, 0.05)
+    assert rows.tolist() == [10, 11, 20, 21, 22]
+    assert out_of_range[:2].any()
+    assert (engine.dup_status[np.ix_(rows, cols)][out_of_range] == STATUS_OUT_OF_RANGE).all()
+
+    fixed, _ = engine.fix_duplicate_groups(groups, cols, 0.99, 1.01)
+    np.testing.assert_array_equal(fixed, out_of_range)
+    assert (engine.dup_status[np.ix_(rows, cols)][fixed] == STATUS_FIXED).all()
+    # Fixed cells are the group's Original mean times a factor within [min, max]
+    means = np.vstack([engine.original[np.ix_(group, cols)].mean(axis=0)[None].repeat(len(group), 0)
+                       for group in groups])[fixed]
+    values = engine.modified[np.ix_(rows, cols)][fixed]
+    low, high = np.minimum(means * 0.99, means * 1.01), np.maximum(means * 0.99, means * 1.01)
+    assert ((values >= low - 0.005) & (values <= high + 0.005)).all()
+
+
+def test_compare_and_fix_crm(engine):
+    engine.set_crm_library(CRMLibrary.default())
+    cols = np.array(engine.element_columns())
+    engine.fill_empty_cells(cols, 1.0, 1.0, 1.0, 0.0)
+    crm_rows = {30: 0, 31: 0}
+    rows, recovery = engine.compare_crm_rows(crm_rows, cols, 0.1)
+    assert rows.tolist() == [30, 31]
+    compared = engine.crm_compared[np.ix_(rows, cols)]
+    assert compared.any()
+    refs = np.broadcast_to(engine.crm_reference[0, cols], compared.shape)
+    np.testing.assert_allclose(recovery[compared], engine.modified[np.ix_(rows, cols)][compared] / refs[compared] * 100)
+
+    out_of_range = engine.crm_status[np.ix_(rows, cols)] == STATUS_OUT_OF_RANGE
+    assert engine.fix_crm_cells(cols, 0.1, out_of_range_only=True) == out_of_range.sum()
+    engine.compare_crm_rows(crm_rows, cols, 0.1)
+    assert not (engine.crm_status[np.ix_(rows, cols)] == STATUS_OUT_OF_RANGE).any()
+
+
+def test_apply_limits(engine):
+    cols = np.array(engine.element_columns())
+    with_limit = cols[~np.isnan(engine.limits[cols])]
+    engine.fill_empty_cells(cols, 1.0, 1.0, 1.0, 0.0)
+    below = engine.apply_limits(cols)
+    expected = (engine.modified[:, with_limit] < engine.limits[with_limit]) & np.isnan(engine.censor[:, with_limit])
+    assert below == expected.sum()
+    assert engine.limits_applied[with_limit].all()
+    np.testing.assert_array_equal(engine.below_limit()[:, with_limit], expected)
+    engine.clear_limits(cols)
+    assert not engine.below_limit().any()
+
+
+def test_set_texts_pastes_a_block(engine):
+    cols = [3, 4]
+    engine.fill_empty_cells(cols, 1.0, 1.0, 1.0, 0.0)
+    before = engine.modified.copy()
+    with engine.transaction("Paste", SOURCE_USER):
+        written = engine.set_texts(10, cols, [['1.5', '<2', 'extra'], ['', 'abc'], ['2>', '7']])
+    assert written == (3, 2, 2) # third text column dropped; 'abc' and '2>' left out
+    assert engine.modified[10, 3] == 1.5 and np.isnan(engine.censor[10, 3])
+    assert engine.modified[10, 4] == 2 and engine.censor[10, 4] == 2
+    assert np.isnan(engine.modified[11, 3]) # empty text clears the cell
+    assert engine.modified[11, 4] == before[11, 4] and engine.modified[12, 3] == before[12, 3]
+    assert engine.modified[12, 4] == 7
+    assert np.isnan(engine.base[10, 3]) and not np.isnan(engine.base[11, 4])
+    np.testing.assert_array_equal(np.delete(engine.modified, [10, 11, 12], axis=0),
+                                  np.delete(before, [10, 11, 12], axis=0))
+    engine.undo()
+    np.testing.assert_array_equal(engine.modified, before)
+
+
+def test_set_texts_clips_at_the_sheet_end(engine):
+    last = engine.num_rows - 1
+    assert engine.set_texts(last, [2], [['1'], ['2'], ['3']]) == (1, 1, 0)
+    assert engine.modified[last, 2] == 1
+    assert engine.set_texts(engine.num_rows, [2], [['1']]) == (0, 0, 0)
@@ -0,0 +1,128 @@
+import numpy as np
+import pytest
+
+from crm import CRMLibrary
+from engine import CELL_ARRAYS, SOURCE_USER, ProcessingEngine
+from history import COLUMN_VECTORS
+
+
+@pytest.fixture
+def engine(sample_path):
+    engine = ProcessingEngine(seed=5)
+    engine.load(sample_path)
+    return engine
+
+
+def test_undo_keeps_columns_marked_by_navigation(engine):
+    # Generate Random on column 1, then Next through every other column
+    with engine.transaction('Generate Random'):
+        engine.fill_empty_cells(1, 0.9, 1.1, 1.0, 0.0)
+    filled = engine.modified[:, 1].copy()
+    for col in range(2, engine.num_columns):
+        engine.mark_processed(col)
+    assert engine.all_columns_processed()
+
+    engine.undo()
+    assert np.isnan(engine.modified[:, 1]).all()
+    assert not engine.processed[1]
+    assert engine.processed[2:].all()
+
+    engine.redo()
+    np.testing.assert_array_equal(engine.modified[:, 1], filled)
+    assert engine.all_columns_processed()
+
+
+def test_undo_reverts_limits(engine):
+    before = engine.limits.copy()
+    with engine.transaction('Set limit'):
+        engine.set_limit(2, 0.5)
+        engine.apply_limits([2])
+    engine.set_limit(3, 7.0) # outside any transaction
+    engine.undo()
+    np.testing.assert_array_equal(engine.limits[[0, 1, 2]], before[[0, 1, 2]])
+    assert engine.limits[3] == 7.0
+    assert not engine.limits_applied[2]
+    engine.redo()
+    assert engine.limits[2] == 0.5 and engine.limits_applied[2]
+
+
+def snapshot(engine):
+    return {name: getattr(engine, name).copy() for name in CELL_ARRAYS + COLUMN_VECTORS}
+
+
+def same(a, b):
+    return all(np.array_equal(a[name], b[name], equal_nan=True) for name in a)
+
+
+def test_undo_redo_restore_every_step(engine):
+    cols = np.array(engine.element_columns())
+    states = [snapshot(engine)]
+    with engine.transaction('Generate Random'):
+        engine.fill_empty_cells(cols, 0.9, 1.1, 1.0, 0.0)
+    states.append(snapshot(engine))
+    with engine.transaction('Check duplicates'):
+        engine.check_duplicate_groups([[10, 11]], cols, 0.01)
+    states.append(snapshot(engine))
+    with engine.transaction('Fix duplicates'):
+        engine.fix_duplicate_groups([[10, 11]], cols, 0.99, 1.01)
+    states.append(snapshot(engine))
+    with engine.transaction('Edit cell', SOURCE_USER):
+        engine.set_text(3, 5, '<7')
+    states.append(snapshot(engine))
+
+    for state in reversed(states[:-1]):
+        assert engine.undo() is not None
+        assert same(snapshot(engine), state)
+    assert engine.undo() is None
+    for state in states[1:]:
+        assert engine.redo() is not None
+        assert same(snapshot(engine), state)
+
+
+def test_crm_library_swap_is_undone_with_its_comparisons(engine):
+    three = CRMLibrary(['OREAS 900', 'OREAS 901', 'OREAS 903'], ['Cu', 'Zn'], [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]])
+    engine.set_crm_library(three)
+    cols = [engine.header_row.tolist().index('Cu')]
+    with engine.transaction('Compare with CRM'):
+        engine.compare_crm_rows({30: 2}, cols, 0.1)
+    assert engine.crm_name(30) == 'OREAS 903'
+    engine.set_crm_library(CRMLibrary.builtin())
+    assert not engine.crm_compared.any() and engine.crm_rows == {}
+
+    assert engine.undo().label == 'Load CRM library'
+    assert engine.crm_library is three
+    assert engine.crm_name(30) == 'OREAS 903' and engine.crm_value(cols[0], 30) == 5.0
+    assert engine.crm_compared[30, cols].all()
+    assert engine.undo().label == 'Compare with CRM'
+    assert engine.redo() is not None and engine.redo() is not None
+    assert engine.crm_library.names == ['OREAS 903'] and engine.crm_rows == {}
+    engine.crm_name()
+    assert not engine.crm_recovery().size
+
+
+def test_mostly_changed_columns_are_kept_whole(engine):
+    cols = np.array(engine.element_columns())
+    with engine.transaction('Generate Random'):
+        engine.fill_empty_cells(cols, 0.9, 1.1, 1.0, 0.0)
+    operation = engine.history.undo_stack[-1]
+    for delta in operation.deltas.values():
+        assert not len(delta.rows)
+        assert delta.nbytes <= 2 * delta.dense_old.itemsize * engine.num_rows * len(cols) + 4 * len(cols)
+    with engine.transaction('Edit cell', SOURCE_USER):
+        engine.set_text(3, 5, '7')
+    delta = engine.history.undo_stack[-1].deltas['modified']
+    assert delta.rows.tolist() == [5] and not len(delta.dense_cols)
+
+
+def test_history_is_trimmed_to_its_byte_budget(engine):
+    size = engine.num_rows * 8 * 4 # a filled column: old and new modified and base
+    engine.history.max_bytes = int(2.5 * size)
+    for col in (1, 2, 3):
+        with engine.transaction(f'Fill {col}'):
+            engine.fill_empty_cells(col, 0.9, 1.1, 1.0, 0.0)
+    assert [operation.label for operation in engine.history.undo_stack] == ['Fill 2', 'Fill 3']
+    assert sum(operation.nbytes for operation in engine.history.undo_stack) <= engine.history.max_bytes
+    engine.history.max_bytes = 1
+    with engine.transaction('Fill 4'):
+        engine.fill_empty_cells(4, 0.9, 1.1, 1.0, 0.0)
+    assert [operation.label for operation in engine.history.undo_stack] == ['Fill 4'] # the newest always stays
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from crm import CRMLibrary
+from engine import CELL_ARRAYS, ProcessingEngine
+from parallel import ColumnPool
+
+
+@pytest.fixture(scope='module')
+def pool():
+    pool = ColumnPool(workers=2, min_cells=0)
+    yield pool
+    pool.close()
+
+
+def loaded(sample_path):
+    engine = ProcessingEngine(seed=9)
+    engine.set_crm_library(CRMLibrary.default())
+    engine.load(sample_path)
+    engine.compare_crm_rows({30: 0, 31: 0}, engine.element_columns(), 0.1)
+    return engine
+
+
+def test_pool_matches_in_process(sample_path, pool):
+    local, shared = loaded(sample_path), loaded(sample_path)
+    cols = list(local.element_columns())
+    groups = [[10, 11], [20, 21, 22]]
+    steps = [
+        ('fill_empty_cells', (cols, 0.9, 1.1, 1.02, -1.0)),
+        ('check_duplicate_groups', (groups, cols, 0.02)),
+        ('fix_duplicate_groups', (groups, cols, 0.99, 1.01)),
+        ('fix_crm_cells', (cols, 0.1)),
+        ('apply_limits', (cols,)),
+    ]
+    for method, args in steps:
+        expected = getattr(local, method)(*args)
+        result = pool.call(shared, method, args)
+        if isinstance(expected, tuple):
+            for a, b in zip(expected, result):
+                np.testing.assert_array_equal(a, b)
+        else:
+            assert result == expected
+    for name in CELL_ARRAYS + ('processed', 'limits_applied'):
+        np.testing.assert_array_equal(getattr(shared, name), getattr(local, name), err_msg=name)
+    assert shared.draws == local.draws
+    # Closing the pool hands the engine private copies of its arrays
+    pool.close(shared)
+    np.testing.assert_array_equal(shared.modified, local.modified)
@@ -0,0 +1,152 @@
+import datetime
+import os
+
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+import engine as engine_module
+from engine import ProcessingEngine
+import reader
+from reader import PREAMBLE_ROWS, iter_csv, pack_objects, read_xlsx_cached, unpack_objects, write_npz
+
+
+def write_sheet(path):
+    workbook = openpyxl.Workbook()
+    sheet = workbook.active
+    sheet.append(['Title', datetime.datetime(2024, 5, 1, 9, 30)])
+    sheet.append(['Sample', 'Cu', 'Zn'])
+    for _ in range(PREAMBLE_ROWS - 2):
+        sheet.append([None, 1, 2.5])
+    sheet.append([1001, '<2', 3.25])
+    sheet.append(['1001 DUP', 4, None])
+    sheet.append([datetime.date(2024, 5, 2), 5, 6])
+    workbook.save(path)
+
+
+def same(a, b):
+    return type(a) is type(b) and (a == b or (a is None and b is None))
+
+
+def test_pack_objects_keeps_types():
+    values = np.array([
+        None, 1001, 2.5, 2.0, 'text', True, datetime.datetime(2024, 5, 1, 9, 30),
+        datetime.date(2024, 5, 2), datetime.time(8, 15), datetime.timedelta(hours=2), 2 ** 60,
+    ], dtype=object)
+    for before, after in zip(values, unpack_objects(*pack_objects(values))):
+        assert same(before, after), (before, after)
+
+
+def test_cached_load_equals_first_load(tmp_path, cache_dir):
+    path = str(tmp_path / 'sheet.xlsx')
+    write_sheet(path)
+    first = read_xlsx_cached(path)
+    assert os.listdir(cache_dir)
+    cached = read_xlsx_cached(path)
+    for before, after in zip(first[0].to_numpy().ravel(), cached[0].to_numpy().ravel()):
+        assert same(before, after), (before, after)
+    for before, after in zip(first[1], cached[1]):
+        assert same(before, after), (before, after)
+    np.testing.assert_array_equal(first[2].values, cached[2].values)
+    np.testing.assert_array_equal(first[2].censored, cached[2].censored)
+    assert first[2].errors == cached[2].errors
+
+    engines = []
+    for _ in range(2):
+        engine = ProcessingEngine(seed=1)
+        engine.load(path)
+        engines.append(engine)
+    groups = [engine.find_duplicate_groups() for engine in engines]
+    assert list(groups[0]) == list(groups[1]) == ['1001']
+
+
+def test_sample_workbook_round_trip(sample_path):
+    first = read_xlsx_cached(sample_path)
+    cached = read_xlsx_cached(sample_path)
+    pd.testing.assert_frame_equal(first[0], cached[0])
+    assert [type(name) for name in first[1]] == [type(name) for name in cached[1]]
+    assert list(first[1]) == list(cached[1])
+    np.testing.assert_array_equal(first[2].values, cached[2].values)
+
+
+def test_corrupt_cache_is_a_miss(sample_path, cache_dir):
+    first = read_xlsx_cached(sample_path)
+    (cache_file,) = os.listdir(cache_dir)
+    with open(os.path.join(cache_dir, cache_file), 'r+b') as f:
+        f.truncate(100)
+    again = read_xlsx_cached(sample_path)
+    np.testing.assert_array_equal(first[2].values, again[2].values)
+    with np.load(os.path.join(cache_dir, cache_file)) as data: # rewritten whole
+        assert 'values' in data
+
+
+def test_pruning_keeps_other_caches(sample_path, cache_dir, monkeypatch):
+    os.makedirs(cache_dir)
+    other = os.path.join(cache_dir, 'crm-' + '0' * 40 + '.npz')
+    write_npz(other, {'key': np.zeros(2)})
+    monkeypatch.setattr(reader, 'CACHE_FILES', 0)
+    read_xlsx_cached(sample_path)
+    assert os.listdir(cache_dir) == [os.path.basename(other)]
+
+
+def test_write_npz_leaves_no_temporary_files(tmp_path):
+    path = str(tmp_path / 'a.npz')
+    write_npz(path, {'x': np.arange(3)})
+    write_npz(path, {'x': np.arange(4)})
+    assert os.listdir(tmp_path) == ['a.npz']
+    with np.load(path) as data:
+        assert data['x'].tolist() == [0, 1, 2, 3]
+
+
+def write_csv(path):
+    with open(path, 'w') as f:
+        f.write('Title,,\nSample,Cu,Zn\n')
+        for _ in range(PREAMBLE_ROWS - 2):
+            f.write(',1,2.5\n')
+        for row in range(7):
+            f.write(f'S-{row},{row}.5,<{row + 1}\n')
+        f.write('S-7 DUP,,abc\n\n') # blank line at the end is skipped
+
+
+def test_iter_csv_chunks(tmp_path):
+    path = str(tmp_path / 'sheet.csv')
+    write_csv(path)
+    chunks = iter_csv(path, chunk_rows=3)
+    preamble = next(chunks)
+    assert preamble.shape == (PREAMBLE_ROWS, 3)
+    assert preamble.iloc[1].tolist() == ['Sample', 'Cu', 'Zn']
+    chunks = list(chunks)
+    starts = [start for start, _, _ in chunks]
+    sizes = [len(names) for _, names, _ in chunks]
+    assert starts == list(np.cumsum([0] + sizes[:-1]))
+    names = np.concatenate([names for _, names, _ in chunks])
+    assert names.tolist() == [f'S-{row}' for row in range(7)] + ['S-7 DUP']
+    last = chunks[-1][2]
+    assert np.isnan(last.values[-1, 1]) and last.errors == [(sizes[-1] - 1, 2, 'abc')]
+
+
+def test_iter_csv_needs_preamble(tmp_path):
+    path = str(tmp_path / 'short.csv')
+    with open(path, 'w') as f:
+        f.write('Title\nSample\n')
+    with pytest.raises(ValueError):
+        next(iter_csv(path))
+
+
+def test_chunked_csv_load_equals_whole_load(tmp_path, monkeypatch):
+    path = str(tmp_path / 'sheet.csv')
+    write_csv(path)
+    engines = []
+    for chunk_rows in (reader.CHUNK_ROWS, 2):
+        monkeypatch.setattr(engine_module, 'iter_csv', lambda path, rows=chunk_rows: iter_csv(path, rows))
+        engine = ProcessingEngine(seed=1)
+        loaded = []
+        engine.load(path, on_chunk=loaded.append)
+        assert loaded[-1] == engine.num_rows == 8
+        engines.append(engine)
+    whole, chunked = engines
+    np.testing.assert_array_equal(whole.original, chunked.original)
+    np.testing.assert_array_equal(whole.censored, chunked.censored)
+    assert whole.fixed_column.tolist() == chunked.fixed_column.tolist()
+    assert chunked.censored[:, 2].sum() == 7
@@ -0,0 +1,27 @@
+import builtins
+
+import pytest
+
+from recipe import Recipe
+
+
+def test_toml_recipe(tmp_path):
+    path = tmp_path / 'recipe.toml'
+    path.write_text('seed = 7\n[defaults]\nmin = 0.95\n[elements.Cu]\nratio = 1.02\n', encoding='utf-8')
+    recipe = Recipe.load(str(path))
+    assert recipe.options['seed'] == 7
+    assert recipe.settings('Cu')['ratio'] == 1.02 and recipe.settings('Cu')['min'] == 0.95
+
+
+def test_toml_recipe_without_reader(tmp_path, monkeypatch):
+    path = tmp_path / 'recipe.toml'
+    path.write_text('seed = 7\n', encoding='utf-8')
+    real_import = builtins.__import__
+
+    def no_toml(name, *args, **kwargs):
+        if name in ('tomllib', 'tomli'):
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+    monkeypatch.setattr(builtins, '__import__', no_toml)
+    with pytest.raises(ValueError, match='tomli'):
+        Recipe.load(str(path))
@@ -0,0 +1,69 @@
+import os
+
+import numpy as np
+import pytest
+
+from engine import CELL_ARRAYS, ProcessingEngine
+from reader import NPZ_ERRORS
+from session import Autosaver, restore, session_view
+
+
+def test_restore_base_and_deltas(sample_path, tmp_path):
+    directory = str(tmp_path / 'session')
+    engine = ProcessingEngine(seed=4)
+    engine.load(sample_path)
+    saver = Autosaver(engine, directory=directory, every=1)
+    saver.start()
+    cols = np.array(engine.element_columns())
+    engine.fill_empty_cells(cols, 0.9, 1.1, 1.0, 0.0)
+    saver.edited({'column': 1}) # base
+    engine.set_text(3, 5, '<7')
+    engine.mark_processed(2)
+    saver.edited({'column': 3}) # delta of column 3
+    engine.apply_limits(cols)
+    saver.edited({'column': 4})
+    saver.close()
+    assert saver.error is None
+    assert session_view(directory)['column'] == 4
+
+    restored = ProcessingEngine()
+    assert restore(restored, directory)['column'] == 4
+    for name in CELL_ARRAYS + ('original', 'censored', 'processed', 'limits', 'limits_applied'):
+        np.testing.assert_array_equal(getattr(restored, name), getattr(engine, name), err_msg=name)
+    assert restored.seed == engine.seed and restored.draws == engine.draws
+    assert list(restored.fixed_column) == list(engine.fixed_column)
+    assert restored.preamble.equals(engine.preamble)
+
+    # Continuing from the restored session draws what the original would have
+    engine.fill_empty_cells(cols, 0.9, 1.1, 1.0, 0.0)
+    restored.fill_empty_cells(cols, 0.9, 1.1, 1.0, 0.0)
+    np.testing.assert_array_equal(restored.modified, engine.modified)
+
+
+def test_seed_beyond_64_bits(sample_path, tmp_path):
+    directory = str(tmp_path / 'session')
+    engine = ProcessingEngine(seed=2 ** 70 + 1)
+    engine.load(sample_path)
+    engine.fill_empty_cells(1, 0.9, 1.1, 1.0, 0.0)
+    saver = Autosaver(engine, directory=directory)
+    saver.save({})
+    saver.close()
+    assert saver.error is None
+    restored = ProcessingEngine()
+    restore(restored, directory)
+    assert restored.seed == 2 ** 70 + 1
+    np.testing.assert_array_equal(restored.modified, engine.modified)
+
+
+def test_corrupt_session_is_reported(sample_path, tmp_path):
+    directory = str(tmp_path / 'session')
+    engine = ProcessingEngine(seed=4)
+    engine.load(sample_path)
+    saver = Autosaver(engine, directory=directory)
+    saver.save({'column': 1})
+    saver.close()
+    with open(os.path.join(directory, 'base.npz'), 'r+b') as f:
+        f.truncate(100)
+    assert session_view(directory) is None
+    with pytest.raises(NPZ_ERRORS):
+        restore(ProcessingEngine(), directory)
@@ -0,0 +1,84 @@
+import os
+import time
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+from PyQt6.QtCore import Qt # noqa: E402
+from PyQt6.QtWidgets import QApplication # noqa: E402
+
+from engine import ProcessingEngine # noqa: E402
+from table_model import SheetTableModel # noqa: E402
+
+ROLES = (Qt.ItemDataRole.DisplayRole, Qt.ItemDataRole.BackgroundRole, Qt.ItemDataRole.FontRole)
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QApplication.instance() or QApplication([])
+
+
+@pytest.fixture
+def model(app, sample_path):
+    engine = ProcessingEngine(seed=6)
+    engine.load(sample_path)
+    engine.fill_empty_cells([4, 5, 6], 0.9, 1.1, 1.0, 0.0)
+    model = SheetTableModel(engine)
+    yield model
+    model.close()
+
+
+def wait_for(app, done, timeout=5.0):
+    end = time.monotonic() + timeout
+    while not done():
+        assert time.monotonic() < end, 'timed out'
+        app.processEvents()
+        time.sleep(0.005)
+
+
+def cells(model, rows):
+    return [[model.data(model.index(row, col), role) for col in range(3) for role in ROLES] for row in rows]
+
+
+def test_prefetch_builds_the_column_and_its_neighbours(app, model):
+    model.show_column(5)
+    rows = range(0, model.engine.num_rows, 37)
+    direct = cells(model, rows)
+    model.prefetch()
+    wait_for(app, lambda: not model.pending)
+    assert set(model.views) == {4, 5, 6}
+    assert cells(model, rows) == direct
+
+    model.show_column(10) # far away: old views are dropped
+    model.prefetch()
+    wait_for(app, lambda: not model.pending)
+    assert set(model.views) == {9, 10, 11}
+
+
+def test_views_follow_engine_changes(app, model):
+    model.show_column(5)
+    model.prefetch()
+    wait_for(app, lambda: not model.pending)
+    view = model.views[5]
+    with model.engine.transaction('Edit'):
+        model.engine.set_text(5, 3, '42')
+    app.processEvents() # the change set is queued to the model
+    assert model.views[5] is view # a few cells are patched in place
+    assert model.data(model.index(3, 2)) == model.engine.modified_text(3, 5) == '42.0'
+    assert model.data(model.index(3, 2), Qt.ItemDataRole.FontRole) is None
+
+    with model.engine.transaction('Fill'):
+        model.engine.fill_empty_cells([5], 2.0, 2.0, 1.0, 0.0)
+    app.processEvents()
+    assert 5 not in model.views # rebuilt after a large change
+    model.prefetch()
+    wait_for(app, lambda: not model.pending)
+    assert model.data(model.index(3, 2)) == model.engine.modified_text(3, 5)
+
+
+def test_stale_builds_are_dropped(app, model):
+    model.show_column(5)
+    model.prefetch()
+    model.invalidate([5, 6]) # cells changed while the views were built
+    wait_for(app, lambda: not model.pending)
+    assert set(model.views) == {4}
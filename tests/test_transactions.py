@@ -0,0 +1,49 @@
+import pytest
+
+from engine import SOURCE_HISTORY, SOURCE_PROGRAM, SOURCE_USER, ProcessingEngine
+
+
+@pytest.fixture
+def engine(sample_path):
+    engine = ProcessingEngine(seed=9)
+    engine.load(sample_path)
+    return engine
+
+
+@pytest.fixture
+def calls(engine):
+    calls = []
+    engine.add_listener(lambda operation, source: calls.append((operation, source)))
+    return calls
+
+
+def test_one_notification_per_outer_transaction(engine, calls):
+    with engine.transaction('Paste', SOURCE_USER):
+        engine.set_text(3, 0, '1.5')
+        with engine.transaction('Inner'): # joins the outer change set
+            engine.set_text(4, 1, '<2')
+        assert calls == []
+    ((operation, source),) = calls
+    assert source == SOURCE_USER
+    assert operation.label == 'Paste'
+    assert sorted(operation.columns) == [3, 4]
+    assert len(engine.history.undo_stack) == 1
+
+
+def test_no_notification_without_changes(engine, calls):
+    with engine.transaction('Nothing'):
+        pass
+    engine.mark_processed(3)
+    with engine.transaction('Same value'):
+        engine.set_value(3, 0, engine.modified[0, 3])
+    assert calls == []
+
+
+def test_program_steps_and_history(engine, calls):
+    with engine.transaction('Generate Random'):
+        engine.fill_empty_cells([5], 0.9, 1.1, 1.0, 0.0)
+    assert [source for _, source in calls] == [SOURCE_PROGRAM]
+    assert engine.undo() is calls[0][0]
+    assert engine.redo() is calls[0][0]
+    assert [source for _, source in calls] == [SOURCE_PROGRAM, SOURCE_HISTORY, SOURCE_HISTORY]
+    assert list(calls[-1][0].columns) == [5]
@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from engine import ProcessingEngine
+from workers import COLUMN_BATCH, Worker, run_operation
+
+
+@pytest.fixture
+def engine(sample_path):
+    engine = ProcessingEngine(seed=4)
+    engine.load(sample_path)
+    return engine
+
+
+def run(fn):
+    """Run a Worker on this thread; returns the (signal, args) it emitted."""
+    worker = Worker(fn)
+    emitted = []
+    for name in ('progress', 'finished', 'failed', 'cancelled'):
+        getattr(worker.signals, name).connect(lambda *args, name=name: emitted.append((name, args)))
+    worker.run()
+    return worker, emitted
+
+
+def test_worker_finishes_with_progress(engine):
+    cols = engine.element_columns()
+    _, emitted = run(lambda worker: run_operation(worker, engine, 'Fill', 'fill_empty_cells',
+                                                  (cols, 0.9, 1.1, 1.0, 0.0)))
+    progress = [args for name, args in emitted if name == 'progress']
+    assert len(progress) == -(-len(cols) // COLUMN_BATCH)
+    assert progress[-1][:2] == (len(cols), len(cols))
+    assert [name for name, _ in emitted][-1] == 'finished'
+    assert engine.processed[cols].all()
+
+
+def test_cancel_keeps_finished_batches_as_one_step(engine):
+    cols = engine.element_columns()
+
+    def fill(worker):
+        worker.signals.progress.connect(lambda *args: worker.cancel())
+        return run_operation(worker, engine, 'Fill', 'fill_empty_cells', (cols, 0.9, 1.1, 1.0, 0.0))
+    worker, emitted = run(fill)
+    assert worker.cancelled
+    assert [name for name, _ in emitted] == ['progress', 'cancelled']
+    assert engine.processed[cols[:COLUMN_BATCH]].all()
+    assert not engine.processed[cols[COLUMN_BATCH:]].any()
+    assert len(engine.history.undo_stack) == 1
+    engine.undo()
+    assert np.isnan(engine.modified[:, cols]).all()
+
+
+def test_worker_reports_failures():
+    def fail(worker):
+        raise ValueError('bad input')
+    _, emitted = run(fail)
+    ((name, (error,)),) = emitted
+    assert name == 'failed' and str(error) == 'bad input'
@@ -0,0 +1,77 @@
+import numpy as np
+import openpyxl
+import pandas as pd
+import pytest
+
+from engine import PROVENANCE, SEED_PROPERTY, STATUS_OUT_OF_RANGE, ProcessingEngine, read_saved_seed
+from reader import PREAMBLE_ROWS
+import writer
+
+
+@pytest.fixture
+def engine(sample_path):
+    engine = ProcessingEngine(seed=2 ** 70 + 5)
+    engine.load(sample_path)
+    engine.fill_empty_cells(engine.element_columns(), 0.9, 1.1, 1.0, 0.0)
+    return engine
+
+
+@pytest.mark.parametrize('use_xlsxwriter', [True, False])
+def test_xlsx_round_trip(engine, tmp_path, monkeypatch, use_xlsxwriter):
+    if not use_xlsxwriter:
+        monkeypatch.setattr(writer, 'xlsxwriter', None)
+    engine.dup_status[3, 5] = STATUS_OUT_OF_RANGE
+    path = str(tmp_path / 'out.xlsx')
+    reports = []
+    engine.save(path, progress=lambda row, total: reports.append(total))
+    assert reports and set(reports) == {PREAMBLE_ROWS + engine.num_rows}
+    assert read_saved_seed(path) == engine.seed
+
+    workbook = openpyxl.load_workbook(path)
+    rows = list(workbook.active.iter_rows(values_only=True))
+    assert len(rows) == PREAMBLE_ROWS + engine.num_rows
+    expected = engine.output_values()
+    for row in (0, 100, engine.num_rows - 1):
+        for got, want in zip(rows[PREAMBLE_ROWS + row], expected[row]):
+            assert got == want or (got is None and want is None), (row, got, want)
+    cell = workbook.active.cell(PREAMBLE_ROWS + 4, 6)
+    assert cell.fill.start_color.rgb.endswith(writer.STATUS_FILLS[STATUS_OUT_OF_RANGE])
+    workbook.close()
+
+
+def check_export(engine, frame):
+    assert len(frame) == engine.num_rows
+    assert frame['Sample'].tolist() == [None if name is None else str(name) for name in engine.fixed_column]
+    col = engine.element_columns()[0]
+    name = engine.get_element_name(col)
+    np.testing.assert_array_equal(frame[name].to_numpy(dtype=np.float64), engine.modified[:, col])
+    assert frame[name + '_censored'].dtype == bool
+    assert set(frame[name + '_provenance'].astype(str)) <= set(PROVENANCE)
+
+
+def test_csv_export(engine, tmp_path):
+    path = str(tmp_path / 'out.csv')
+    engine.save(path)
+    frame = pd.read_csv(path, dtype={'Sample': object})
+    frame['Sample'] = frame['Sample'].astype(object).where(frame['Sample'].notna(), None)
+    check_export(engine, frame)
+
+
+@pytest.mark.parametrize('extension', ['.parquet', '.arrow'])
+def test_columnar_export_carries_seed(engine, tmp_path, extension):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet as pq
+
+    path = str(tmp_path / ('out' + extension))
+    engine.save(path)
+    if extension == '.parquet':
+        table = pq.read_table(path)
+    else:
+        with pa.memory_map(path) as source:
+            table = pa.ipc.open_file(source).read_all()
+    assert int(table.schema.metadata[SEED_PROPERTY.encode()]) == engine.seed
+    frame = table.to_pandas()
+    col = engine.element_columns()[0]
+    assert isinstance(frame[engine.get_element_name(col) + '_provenance'].dtype, pd.CategoricalDtype)
+    frame['Sample'] = frame['Sample'].astype(object).where(frame['Sample'].notna(), None)
+    check_export(engine, frame)
@@ -0,0 +1,103 @@
+"""Long engine operations on a QThreadPool thread, with progress and cancellation.
+
+A Worker runs fn(worker) off the GUI thread; fn calls worker.report() as it
+goes and stops when worker.cancelled is set. Signals are delivered on the GUI
+thread, so slots may touch widgets and the table model.
+"""
+import threading
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal
+
+from parallel import columns_of, slice_args
+
+# Columns processed per step of a column-wise operation; progress and partial
+# results are reported after every batch
+COLUMN_BATCH = 4
+
+
+class Cancelled(Exception):
+    """Raised by Worker.check() to abandon an operation that can't stop half-way."""
+
+
+class WorkerSignals(QObject):
+    progress = pyqtSignal(int, int, object) # done, total (0 = unknown), columns just finished or None
+    finished = pyqtSignal(object) # fn's return value
+    failed = pyqtSignal(object) # the exception
+    cancelled = pyqtSignal()
+
+
+class Worker(QRunnable):
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+        self.signals = WorkerSignals()
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def check(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def report(self, done, total=0, columns=None):
+        self.signals.progress.emit(done, total, columns)
+
+    def run(self):
+        try:
+            result = self.fn(self)
+        except Cancelled:
+            self.signals.cancelled.emit()
+        except Exception as e:
+            self.signals.failed.emit(e)
+        else:
+            self.signals.finished.emit(result)
+
+
+def column_batches(num_columns, size=COLUMN_BATCH):
+    """Slices over a column list, COLUMN_BATCH columns at a time."""
+    return [slice(start, min(start + size, num_columns)) for start in range(0, num_columns, size)]
+
+
+def run_by_columns(worker, engine, label, columns, step):
+    """Call step(batch) for every batch slice of columns inside one engine transaction.
+
+    Reports the finished columns after every batch. A cancelled run stops
+    between batches, keeps what is done as one change set (one undo step)
+    and raises Cancelled. Returns the list of step results.
+    """
+    results = []
+    with engine.transaction(label):
+        for batch in column_batches(len(columns)):
+            if worker.cancelled:
+                break
+            results.append(step(batch))
+            worker.report(batch.stop, len(columns), list(columns[batch]))
+    worker.check()
+    return results
+
+
+def run_operation(worker, engine, label, method, args, pool=None):
+    """engine.<method>(*args) for a parallel.OPERATIONS method, like run_by_columns.
+
+    With a pool (see parallel.ColumnPool) the column slices run in its worker
+    processes; otherwise COLUMN_BATCH columns at a time on this thread.
+    """
+    columns = columns_of(method, args)
+    if pool is None:
+        return run_by_columns(
+            worker, engine, label, columns, lambda batch: getattr(engine, method)(*slice_args(method, args, batch))
+        )
+    done = []
+
+    def finished_part(cols):
+        done.extend(cols)
+        worker.report(len(done), len(columns), cols)
+    with engine.transaction(label):
+        results = pool.run(engine, method, args, on_part=finished_part, cancelled=lambda: worker.cancelled)
+    worker.check()
+    return results
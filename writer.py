@@ -0,0 +1,163 @@
+"""Export of a processed sheet as XLSX, CSV, parquet or Arrow IPC.
+
+XLSX rows are written in order to a constant-memory writer: xlsxwriter when it
+is installed, otherwise openpyxl in write-only mode. The preamble rows are
+copied as read (limits changed in the program go into the DL row), numbers stay numbers, censored cells are written as "<L" text
+and the duplicate/CRM status of each cell becomes its fill colour.
+
+CSV, parquet and Arrow files hold one row per sample and three typed columns
+per element: the value, a censored flag and the provenance of the value. The
+preamble is not included; parquet and Arrow files carry the seed as metadata.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from engine import (
+    PREAMBLE_ROWS, PROVENANCE, SEED_PROPERTY,
+    STATUS_CHECKED, STATUS_IN_RANGE, STATUS_FIXED, STATUS_OUT_OF_RANGE
+)
+
+try:
+    import xlsxwriter
+except ImportError:
+    xlsxwriter = None
+
+# Same colours as the table view
+STATUS_FILLS = {
+    STATUS_CHECKED: 'FFFF96',
+    STATUS_IN_RANGE: 'B4FFB4',
+    STATUS_FIXED: 'B4FFB4',
+    STATUS_OUT_OF_RANGE: 'FFB4B4',
+}
+PROGRESS_ROWS = 1000 # XLSX rows between progress callbacks
+
+
+def sheet_rows(engine):
+    """Yield (values, statuses) per output row; statuses is None for preamble rows."""
+    preamble = engine.preamble.to_numpy(dtype=object)[:PREAMBLE_ROWS].copy()
+    preamble[3] = engine.limit_row()
+    for values in preamble:
+        yield [None if isinstance(value, float) and np.isnan(value) else value for value in values], None
+    values = engine.output_values()
+    statuses = np.where(engine.crm_status != 0, engine.crm_status, engine.dup_status)
+    # Fixed column is coloured by the strongest status of its row, like in the table
+    statuses[:, 0] = np.maximum(engine.dup_status.max(axis=1), engine.crm_status.max(axis=1))
+    for row_values, row_statuses in zip(values.tolist(), statuses):
+        yield row_values, row_statuses
+
+
+def write_output(engine, path, progress=None):
+    """Write in the format given by the file extension; anything else is XLSX.
+
+    progress(rows_written, total_rows) is called every PROGRESS_ROWS rows of an
+    XLSX sheet and may raise to abandon the write.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.csv':
+        export_frame(engine).to_csv(path, index=False)
+    elif extension == '.parquet':
+        write_parquet(engine, path)
+    elif extension in ('.arrow', '.feather', '.ipc'):
+        write_arrow(engine, path)
+    else:
+        write_xlsx(engine, path, progress)
+
+
+def export_frame(engine):
+    """Columnar form of the result: Sample, then <element>, <element>_censored and
+    <element>_provenance for every element column.
+
+    Censored cells hold their limit as the value, like the "<L" text in XLSX.
+    """
+    values = np.where(engine.processed, engine.modified, engine.original)
+    censored = engine.output_censored()
+    limits = engine.output_limits()
+    values = np.where(censored & engine.processed & ~np.isnan(limits), limits, values)
+    provenance = engine.provenance()
+    columns = {'Sample': pd.array([None if name is None else str(name) for name in engine.fixed_column], dtype='string')}
+    for col in engine.element_columns():
+        name = engine.get_element_name(col)
+        if name in columns:
+            name = f"{name}_{col}"
+        columns[name] = values[:, col]
+        columns[name + '_censored'] = censored[:, col]
+        columns[name + '_provenance'] = pd.Categorical.from_codes(provenance[:, col], categories=PROVENANCE)
+    return pd.DataFrame(columns)
+
+
+def arrow_table(engine):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(export_frame(engine), preserve_index=False)
+    metadata = dict(table.schema.metadata or {})
+    metadata[SEED_PROPERTY.encode()] = str(engine.seed).encode()
+    return table.replace_schema_metadata(metadata)
+
+
+def write_parquet(engine, path):
+    import pyarrow.parquet as pq
+
+    pq.write_table(arrow_table(engine), path)
+
+
+def write_arrow(engine, path):
+    """Uncompressed Arrow IPC file, so readers can memory-map it."""
+    import pyarrow as pa
+
+    table = arrow_table(engine)
+    with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+
+
+def write_xlsx(engine, path, progress=None):
+    if xlsxwriter is not None:
+        write_with_xlsxwriter(engine, path, progress)
+    else:
+        write_with_openpyxl(engine, path, progress)
+
+
+def report_rows(progress, row, total):
+    if progress is not None and row % PROGRESS_ROWS == 0:
+        progress(row, total)
+
+
+def write_with_xlsxwriter(engine, path, progress=None):
+    workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+    try:
+        worksheet = workbook.add_worksheet()
+        formats = {status: workbook.add_format({'bg_color': '#' + color, 'pattern': 1})
+                   for status, color in STATUS_FILLS.items()}
+        total = PREAMBLE_ROWS + engine.num_rows
+        for row, (values, statuses) in enumerate(sheet_rows(engine)):
+            report_rows(progress, row, total)
+            worksheet.write_row(row, 0, values)
+            if statuses is not None:
+                for col in np.flatnonzero(statuses):
+                    worksheet.write(row, col, values[col], formats[statuses[col]])
+        workbook.set_custom_property(SEED_PROPERTY, str(engine.seed))
+    finally:
+        workbook.close()
+
+
+def write_with_openpyxl(engine, path, progress=None):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.packaging.custom import StringProperty
+    from openpyxl.styles import PatternFill
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet()
+    fills = {status: PatternFill('solid', start_color=color) for status, color in STATUS_FILLS.items()}
+    total = PREAMBLE_ROWS + engine.num_rows
+    for row, (values, statuses) in enumerate(sheet_rows(engine)):
+        report_rows(progress, row, total)
+        if statuses is not None:
+            for col in np.flatnonzero(statuses):
+                cell = WriteOnlyCell(worksheet, value=values[col])
+                cell.fill = fills[statuses[col]]
+                values[col] = cell
+        worksheet.append(values)
+    workbook.custom_doc_props.append(StringProperty(name=SEED_PROPERTY, value=str(engine.seed)))
+    workbook.save(path)